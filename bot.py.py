@@ -3,21 +3,44 @@
 Sistema RPG basado en estadísticas puras sin niveles
 """
 
+import time
+BOOT_STARTED = time.perf_counter()  # referencia para medir el tiempo hasta on_ready
+
 import discord
 from discord import app_commands
 from discord.ext import commands
 import asyncio
 import logging
+import logging.handlers
 import os
-import random
-import pandas as pd
+import sys
+import argparse
 import sqlite3
-import gspread
-from datetime import datetime
+import subprocess
+from datetime import datetime, timezone
 from dotenv import load_dotenv
-from google.oauth2.service_account import Credentials
 import aiohttp
 import hashlib
+import shutil
+import tempfile
+import zipfile
+import threading
+import functools
+import queue
+import random
+import json
+import csv
+import io
+import atexit
+import contextvars
+import copy
+import unicodedata
+import re
+import glob
+from bisect import bisect_left, insort
+from collections import OrderedDict, Counter
+from contextlib import contextmanager, closing
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, wait, FIRST_COMPLETED
 
 # ============= CONFIGURACIÓN =============
 class UnityConfig:
@@ -28,18 +51,41 @@ class UnityConfig:
         self.GUILD_NAME = os.getenv('GUILD_NAME', 'Servidor Unity')
         self.GOOGLE_CREDENTIALS_FILE = os.getenv('GOOGLE_CREDENTIALS_FILE', 'google-credentials.json')
         
-        # Directorios
-        self.DATA_DIR = "unity_data"
+        # Sincronización con Google Sheets en segundo plano ('google' o 'fake' para trabajar sin red)
+        self.SHEETS_BACKEND = os.getenv('SHEETS_BACKEND', 'google')
+        self.SHEETS_BATCH_SIZE = int(os.getenv('SHEETS_BATCH_SIZE', 50))
+        self.SHEETS_MAX_PENDING = int(os.getenv('SHEETS_MAX_PENDING', 1000))
+        self.SHEETS_FLUSH_INTERVAL = float(os.getenv('SHEETS_FLUSH_INTERVAL', 2))
+        self.SHEETS_MAX_BACKOFF = float(os.getenv('SHEETS_MAX_BACKOFF', 300))
+        
+        # Directorios (UNITY_DATA_DIR permite trabajar sobre una copia, p. ej. en el benchmark)
+        self.DATA_DIR = os.getenv('UNITY_DATA_DIR', "unity_data")
         self.EXCEL_DIR = f"{self.DATA_DIR}/personajes"
         self.IMAGES_DIR = f"{self.DATA_DIR}/imagenes"
         self.LOGS_DIR = f"{self.DATA_DIR}/logs"
         self.DB_PATH = f"{self.DATA_DIR}/unity_master.db"
         
+        # Registros JSON-lines rotados por tamaño: sistema, tiradas y combates
+        self.SYSTEM_LOG = f"{self.LOGS_DIR}/unity.jsonl"
+        self.ROLL_LOG = f"{self.LOGS_DIR}/tiradas/tiradas.jsonl"
+        self.COMBAT_LOG = f"{self.LOGS_DIR}/combates/combates.jsonl"
+        self.LOG_MAX_BYTES = int(os.getenv('LOG_MAX_BYTES', 10 * 1024 * 1024))
+        self.LOG_BACKUPS = int(os.getenv('LOG_BACKUPS', 5))
+        
         # Subdirectorios para imágenes
         self.CHAR_IMAGES = f"{self.IMAGES_DIR}/personajes"
         self.NPC_IMAGES = f"{self.IMAGES_DIR}/npcs"
         self.ITEM_IMAGES = f"{self.IMAGES_DIR}/items"
         
+        # Almacén de imágenes por contenido (sha256), compartido por personajes, NPCs e items
+        self.IMAGE_STORE = f"{self.IMAGES_DIR}/store"
+        self.IMAGE_MAX_BYTES = int(os.getenv('IMAGE_MAX_BYTES', 25 * 1024 * 1024))
+        self.IMAGE_GC_GRACE = int(os.getenv('IMAGE_GC_GRACE', 3600))  # segundos antes de borrar una huérfana
+        
+        # Miniaturas WEBP para embeds (lado máximo en px, procesos que las generan)
+        self.THUMB_SIZE = int(os.getenv('THUMB_SIZE', 256))
+        self.THUMB_WORKERS = int(os.getenv('THUMB_WORKERS', 2))
+        
         # Atributos base para personajes
         self.BASE_ATTRIBUTES = ['Fuerza', 'Destreza', 'Velocidad', 'Resistencia', 'Inteligencia', 'Mana']
         
@@ -47,39 +93,450 @@ class UnityConfig:
         self.DICE_TYPES = [3, 6, 8, 10, 12, 20]
         self.MAX_DICE_COUNT = 5
         
+        # Semilla del motor de dados (vacía = aleatoria); cada canal usa su propio generador derivado
+        self.DICE_SEED = int(os.getenv('DICE_SEED')) if os.getenv('DICE_SEED') else None
+        
+        # Simulador de combate (procesos, tope de rondas por combate, combates por enfrentamiento)
+        self.SIM_WORKERS = int(os.getenv('SIM_WORKERS', os.cpu_count() or 1))
+        self.SIM_MAX_ROUNDS = int(os.getenv('SIM_MAX_ROUNDS', 30))
+        self.SIM_MAX_TRIALS = int(os.getenv('SIM_MAX_TRIALS', 20000))
+        
+        # Historial de tiradas: filas por lote, segundos entre escrituras y tope del búfer en memoria
+        self.ROLL_BATCH_SIZE = int(os.getenv('ROLL_BATCH_SIZE', 200))
+        self.ROLL_FLUSH_INTERVAL = float(os.getenv('ROLL_FLUSH_INTERVAL', 2))
+        self.ROLL_MAX_PENDING = int(os.getenv('ROLL_MAX_PENDING', 10000))
+        
+        # Importación de logs de texto antiguos ([DADOS] / [NPC ...]) al historial de tiradas
+        self.LEGACY_LOG = f"{self.LOGS_DIR}/unity.log"
+        self.LOG_IMPORT_BATCH = int(os.getenv('LOG_IMPORT_BATCH', 1000))
+        
+        # Catálogo en bloque (bestiario e items): tamaño máximo del adjunto, filas por bloque y carpeta de exportación
+        self.CATALOG_MAX_BYTES = int(os.getenv('CATALOG_MAX_BYTES', 5 * 1024 * 1024))
+        self.CATALOG_CHUNK_SIZE = int(os.getenv('CATALOG_CHUNK_SIZE', 500))
+        self.EXPORTS_DIR = f"{self.DATA_DIR}/exportaciones"
+        
+        # Respaldo completo de personajes (zip de libros Excel escritos en un pool de procesos)
+        self.BACKUP_DIR = f"{self.DATA_DIR}/respaldos"
+        self.BACKUP_WORKERS = int(os.getenv('BACKUP_WORKERS', min(4, os.cpu_count() or 1)))
+        self.BACKUP_PAGE_SIZE = int(os.getenv('BACKUP_PAGE_SIZE', 100))
+        self.BACKUP_TIMEOUT = float(os.getenv('BACKUP_TIMEOUT', 600))
+        
+        # Escenas de combate: segundos entre volcados a SQLite y máximo de participantes por escena
+        self.SCENE_FLUSH_INTERVAL = float(os.getenv('SCENE_FLUSH_INTERVAL', 5))
+        self.MAX_SCENE_PARTICIPANTS = int(os.getenv('MAX_SCENE_PARTICIPANTS', 30))
+        
+        # Máximo de acciones por /tirada_grupal (un campo de embed por acción, Discord admite 25)
+        self.MAX_GROUP_ROLLS = int(os.getenv('MAX_GROUP_ROLLS', 20))
+        
         # Puntos de golpe fijos para todos
         self.FIXED_HP = 10
         
+        # Caché de estadísticas en memoria (número máximo de personajes)
+        self.STAT_CACHE_SIZE = int(os.getenv('STAT_CACHE_SIZE', 128))
+        
+        # Caché de embeds de info_npc / info_personaje / inventario (número máximo de entradas)
+        self.EMBED_CACHE_SIZE = int(os.getenv('EMBED_CACHE_SIZE', 256))
+        
+        # Pool de conexiones SQLite
+        self.DB_READERS = int(os.getenv('DB_READERS', 4))
+        self.DB_MMAP_SIZE = int(os.getenv('DB_MMAP_SIZE', 64 * 1024 * 1024))
+        self.DB_STATEMENT_CACHE = int(os.getenv('DB_STATEMENT_CACHE', 256))
+        self.DB_TIMEOUT = float(os.getenv('DB_TIMEOUT', 30))
+        
+        # E/S bloqueante fuera del event loop
+        self.IO_WORKERS = int(os.getenv('IO_WORKERS', 8))
+        self.IO_TIMEOUT = float(os.getenv('IO_TIMEOUT', 20))
+        
+        # Métricas por comando: archivo en formato Prometheus y endpoint HTTP opcional (puerto 0 = apagado)
+        self.METRICS_FILE = f"{self.DATA_DIR}/metrics.prom"
+        self.METRICS_INTERVAL = float(os.getenv('METRICS_INTERVAL', 30))
+        self.METRICS_HOST = os.getenv('METRICS_HOST', '127.0.0.1')
+        self.METRICS_PORT = int(os.getenv('METRICS_PORT', 0))
+        
+        # Árbol de comandos: sólo se sube a Discord si cambia su hash; DEV_GUILD_ID sincroniza en un servidor de pruebas
+        self.COMMAND_HASH_FILE = f"{self.DATA_DIR}/command_tree.json"
+        self.DEV_GUILD_ID = int(os.getenv('DEV_GUILD_ID', 0)) or None
+        self.FORCE_COMMAND_SYNC = os.getenv('FORCE_COMMAND_SYNC', '').lower() in ('1', 'true', 'si', 'sí')
+        
         self.create_directories()
         
     def create_directories(self):
         dirs = [self.DATA_DIR, self.EXCEL_DIR, self.IMAGES_DIR, self.LOGS_DIR,
+                os.path.dirname(self.ROLL_LOG), os.path.dirname(self.COMBAT_LOG),
                 f"{self.EXCEL_DIR}/activos", f"{self.EXCEL_DIR}/archivados",
-                self.CHAR_IMAGES, self.NPC_IMAGES, self.ITEM_IMAGES]
+                self.CHAR_IMAGES, self.NPC_IMAGES, self.ITEM_IMAGES, self.IMAGE_STORE, f"{self.IMAGE_STORE}/tmp",
+                self.EXPORTS_DIR, self.BACKUP_DIR]
         for directory in dirs:
             os.makedirs(directory, exist_ok=True)
 
 config = UnityConfig()
 
 # ============= LOGGING =============
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler(f"{config.LOGS_DIR}/unity.log", encoding='utf-8'),
-        logging.StreamHandler()
-    ]
-)
+class JsonLinesFormatter(logging.Formatter):
+    """Una línea JSON por registro; los campos de extra={'data': {...}} van al primer nivel"""
+    def format(self, record):
+        entry = {
+            'ts': datetime.fromtimestamp(record.created).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'msg': record.getMessage()
+        }
+        entry.update(getattr(record, 'data', None) or {})
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+class LoggerPrefixFilter(logging.Filter):
+    """Deja pasar (o excluye, con exclude=True) los registros de ciertos loggers"""
+    def __init__(self, prefixes, exclude=False):
+        super().__init__()
+        self.prefixes = tuple(prefixes)
+        self.exclude = exclude
+    
+    def filter(self, record):
+        return record.name.startswith(self.prefixes) != self.exclude
+
+LOG_STREAMS = {'UnityRPG.tiradas': config.ROLL_LOG, 'UnityRPG.combates': config.COMBAT_LOG}
+
+def setup_logging():
+    """Los comandos solo encolan registros; un hilo aparte escribe consola y archivos rotados"""
+    def rotating(path):
+        handler = logging.handlers.RotatingFileHandler(path, maxBytes=config.LOG_MAX_BYTES,
+                                                       backupCount=config.LOG_BACKUPS, encoding='utf-8')
+        handler.setFormatter(JsonLinesFormatter())
+        return handler
+    
+    console = logging.StreamHandler()
+    console.setFormatter(logging.Formatter('%(asctime)s - %(levelname)s - %(message)s'))
+    system = rotating(config.SYSTEM_LOG)
+    system.addFilter(LoggerPrefixFilter(LOG_STREAMS, exclude=True))
+    handlers = [console, system]
+    for name, path in LOG_STREAMS.items():
+        handler = rotating(path)
+        handler.addFilter(LoggerPrefixFilter([name]))
+        handlers.append(handler)
+    
+    log_queue = queue.SimpleQueue()
+    root = logging.getLogger()
+    root.setLevel(logging.INFO)
+    root.addHandler(logging.handlers.QueueHandler(log_queue))
+    listener = logging.handlers.QueueListener(log_queue, *handlers, respect_handler_level=True)
+    listener.start()
+    atexit.register(listener.stop)  # vacía la cola antes de salir
+    return listener
+
+log_listener = setup_logging()
 logger = logging.getLogger("UnityRPG")
+roll_logger = logging.getLogger("UnityRPG.tiradas")
+combat_logger = logging.getLogger("UnityRPG.combates")
+
+# ============= POOL DE CONEXIONES =============
+class ConnectionPool:
+    """Conexiones SQLite de larga vida: un escritor serializado y varios lectores reutilizables"""
+    def __init__(self, db_path, max_readers):
+        self.db_path = db_path
+        self.max_readers = max_readers
+        self._writer = None
+        self._writer_lock = threading.Lock()
+        self._idle_readers = queue.LifoQueue()
+        self._reader_slots = threading.BoundedSemaphore(max_readers)
+        self._stats_lock = threading.Lock()
+        self._open = 0
+        self._readers_in_use = 0
+        self._writer_in_use = False
+        self._checkouts = 0
+        # Contención: cuántas veces hubo que esperar al escritor o a un hueco de lector, y cuánto
+        self._writer_waits = 0
+        self._writer_wait_time = 0.0
+        self._reader_waits = 0
+        self._reader_wait_time = 0.0
+        self._readers_peak = 0
+    
+    def _acquire(self, lock, kind):
+        """Toma lock sin bloquear si está libre; si no, espera y anota la contención"""
+        if lock.acquire(blocking=False):
+            return
+        started = time.perf_counter()
+        lock.acquire()
+        waited = time.perf_counter() - started
+        with self._stats_lock:
+            if kind == 'writer':
+                self._writer_waits += 1
+                self._writer_wait_time += waited
+            else:
+                self._reader_waits += 1
+                self._reader_wait_time += waited
+    
+    def _connect(self, readonly):
+        conn = sqlite3.connect(self.db_path, timeout=config.DB_TIMEOUT, check_same_thread=False,
+                               cached_statements=config.DB_STATEMENT_CACHE)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute(f"PRAGMA mmap_size={config.DB_MMAP_SIZE}")
+        if readonly:
+            conn.execute("PRAGMA query_only=ON")
+        with self._stats_lock:
+            self._open += 1
+        return conn
+    
+    @contextmanager
+    def writer(self):
+        """Conexión de escritura exclusiva; confirma al salir o revierte si hubo error"""
+        self._acquire(self._writer_lock, 'writer')
+        try:
+            if self._writer is None:
+                self._writer = self._connect(readonly=False)
+            conn = self._writer
+            with self._stats_lock:
+                self._writer_in_use = True
+                self._checkouts += 1
+            try:
+                yield conn
+                if conn.in_transaction:
+                    conn.commit()
+            except BaseException:
+                if conn.in_transaction:
+                    conn.rollback()
+                raise
+            finally:
+                with self._stats_lock:
+                    self._writer_in_use = False
+        finally:
+            self._writer_lock.release()
+    
+    @contextmanager
+    def reader(self):
+        """Conexión de solo lectura tomada del pool (se crea bajo demanda hasta el máximo)"""
+        self._acquire(self._reader_slots, 'reader')
+        try:
+            try:
+                conn = self._idle_readers.get_nowait()
+            except queue.Empty:
+                conn = self._connect(readonly=True)
+            with self._stats_lock:
+                self._readers_in_use += 1
+                self._readers_peak = max(self._readers_peak, self._readers_in_use)
+                self._checkouts += 1
+            try:
+                yield conn
+            finally:
+                if conn.in_transaction:
+                    conn.rollback()
+                with self._stats_lock:
+                    self._readers_in_use -= 1
+                self._idle_readers.put(conn)
+        finally:
+            self._reader_slots.release()
+    
+    def stats(self):
+        with self._stats_lock:
+            return {
+                'open': self._open,
+                'in_use': self._readers_in_use + (1 if self._writer_in_use else 0),
+                'readers_in_use': self._readers_in_use,
+                'readers_idle': self._idle_readers.qsize(),
+                'max_readers': self.max_readers,
+                'readers_peak': self._readers_peak,
+                'writer_in_use': self._writer_in_use,
+                'checkouts': self._checkouts,
+                'writer_waits': self._writer_waits,
+                'writer_wait_time': self._writer_wait_time,
+                'reader_waits': self._reader_waits,
+                'reader_wait_time': self._reader_wait_time
+            }
+    
+    def close(self):
+        closed = 0
+        while True:
+            try:
+                self._idle_readers.get_nowait().close()
+                closed += 1
+            except queue.Empty:
+                break
+        with self._writer_lock:
+            if self._writer is not None:
+                self._writer.close()
+                self._writer = None
+                closed += 1
+        with self._stats_lock:
+            self._open -= closed
+        logger.info(f"🔌 {closed} conexiones SQLite cerradas")
+
+# ============= CONSULTAS FRECUENTES =============
+# SQL de las rutas calientes; audit_query_plans() verifica que ninguna recorra tablas completas
+SQL_EQUIPPED_BONUSES = """
+    SELECT b.fuerza, b.destreza, b.velocidad, b.resistencia, b.inteligencia, b.mana
+    FROM bonos_equipados b
+    JOIN personajes p ON b.personaje_id = p.id
+    WHERE p.nombre = ?
+"""
+
+# Recalcula desde cero los bonos de items equipados (verificación y reparación, no es ruta caliente)
+SQL_RECOMPUTE_BONUSES = """
+    SELECT inv.personaje_id,
+           SUM(COALESCE(i.efecto_fuerza, 0)), SUM(COALESCE(i.efecto_destreza, 0)),
+           SUM(COALESCE(i.efecto_velocidad, 0)), SUM(COALESCE(i.efecto_resistencia, 0)),
+           SUM(COALESCE(i.efecto_inteligencia, 0)), SUM(COALESCE(i.efecto_mana, 0))
+    FROM inventarios inv
+    JOIN items i ON inv.item_id = i.id
+    WHERE inv.equipado = TRUE
+"""
+
+# Suma (signo +1) o resta (-1) los efectos de un item al total materializado de un personaje
+SQL_APPLY_ITEM_BONUS = """
+    INSERT INTO bonos_equipados (personaje_id, fuerza, destreza, velocidad, resistencia, inteligencia, mana)
+    SELECT ?, ? * COALESCE(efecto_fuerza, 0), ? * COALESCE(efecto_destreza, 0), ? * COALESCE(efecto_velocidad, 0),
+           ? * COALESCE(efecto_resistencia, 0), ? * COALESCE(efecto_inteligencia, 0), ? * COALESCE(efecto_mana, 0)
+    FROM items WHERE id = ?
+    ON CONFLICT(personaje_id) DO UPDATE SET
+        fuerza = fuerza + excluded.fuerza, destreza = destreza + excluded.destreza,
+        velocidad = velocidad + excluded.velocidad, resistencia = resistencia + excluded.resistencia,
+        inteligencia = inteligencia + excluded.inteligencia, mana = mana + excluded.mana
+"""
+
+SQL_EQUIP_MENU = """
+    SELECT i.nombre, inv.equipado, i.rareza
+    FROM inventarios inv
+    JOIN items i ON inv.item_id = i.id
+    JOIN personajes p ON inv.personaje_id = p.id
+    WHERE p.nombre = ? AND i.es_equipable = TRUE
+    ORDER BY inv.equipado DESC, i.nombre
+"""
+
+SQL_EQUIP_LOOKUP = """
+    SELECT inv.id, inv.equipado, inv.personaje_id, inv.item_id FROM inventarios inv
+    JOIN personajes p ON inv.personaje_id = p.id
+    JOIN items i ON inv.item_id = i.id
+    WHERE p.nombre = ? AND i.nombre = ?
+"""
+
+SQL_INVENTORY = """
+    SELECT i.nombre, i.tipo, i.rareza, inv.cantidad, inv.equipado,
+           i.efecto_fuerza, i.efecto_destreza, i.efecto_velocidad,
+           i.efecto_resistencia, i.efecto_inteligencia, i.efecto_mana
+    FROM inventarios inv
+    JOIN items i ON inv.item_id = i.id
+    JOIN personajes p ON inv.personaje_id = p.id
+    WHERE p.nombre = ?
+    ORDER BY inv.equipado DESC, i.nombre
+"""
+
+# Variantes por lotes para /tirada_grupal: {placeholders} se sustituye por "?, ?, ..."
+SQL_STATS_MANY = """
+    SELECT p.nombre, s.fuerza, s.destreza, s.velocidad, s.resistencia, s.inteligencia, s.mana
+    FROM estadisticas_personajes s
+    JOIN personajes p ON s.personaje_id = p.id
+    WHERE p.nombre IN ({placeholders})
+"""
+
+SQL_EQUIPPED_BONUSES_MANY = """
+    SELECT p.nombre, b.fuerza, b.destreza, b.velocidad, b.resistencia, b.inteligencia, b.mana
+    FROM bonos_equipados b
+    JOIN personajes p ON b.personaje_id = p.id
+    WHERE p.nombre IN ({placeholders})
+"""
+
+SQL_NPCS_MANY = """
+    SELECT nombre, ataq_fisic, ataq_dist, ataq_magic, res_fisica, res_magica, velocidad,
+           sincronizado, cantidad, imagen_url, imagen_hash
+    FROM npcs WHERE nombre IN ({placeholders})
+"""
+
+SQL_GIVE_ITEM = """
+    INSERT INTO inventarios (personaje_id, item_id, cantidad) VALUES (?, ?, ?)
+    ON CONFLICT(personaje_id, item_id) DO UPDATE SET cantidad = cantidad + excluded.cantidad
+"""
+
+# Historial de tiradas (tabla tiradas, migración v4)
+SQL_INSERT_ROLL = """
+    INSERT INTO tiradas (origen, nombre, accion, cantidad, caras, dados, atributo, valor_atributo,
+                         bonificador, total, critico, pifia, canal_id, created_at)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+"""
+
+SQL_ROLL_HISTORY = """
+    SELECT accion, cantidad, caras, dados, atributo, valor_atributo, bonificador, total,
+           critico, pifia, created_at
+    FROM tiradas WHERE nombre = ?
+    ORDER BY created_at DESC LIMIT ?
+"""
+
+# {where}: filtro por nombre (idx_tiradas_nombre), canal (idx_tiradas_canal) o solo por fecha
+SQL_ROLL_STATS = """
+    SELECT accion, COUNT(*), AVG(total), MIN(total), MAX(total),
+           SUM(critico), SUM(pifia), SUM(cantidad IS NOT NULL)
+    FROM tiradas WHERE {where} AND created_at >= datetime('now', ?)
+    GROUP BY accion ORDER BY COUNT(*) DESC
+"""
+
+SQL_INSERT_SCENE_PARTICIPANT = """
+    INSERT INTO escena_participantes (canal_id, nombre, tipo, pg, pg_max, velocidad, iniciativa,
+                                      condiciones, cantidad, orden)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+"""
+
+# info_npc / info_personaje por nombre de columna (el orden de SELECT * depende de la historia del esquema)
+SQL_NPC_INFO = """
+    SELECT nombre, tipo, ataq_fisic, ataq_dist, ataq_magic, res_fisica, res_magica,
+           velocidad, mana, descripcion, imagen_url, imagen_hash, sincronizado, cantidad
+    FROM npcs WHERE nombre = ?
+"""
+
+SQL_CHARACTER_INFO = """
+    SELECT nombre, descripcion, oro, estado, imagen_url, imagen_hash
+    FROM personajes WHERE nombre = ?
+"""
+
+# nombre -> (sql, parámetros de ejemplo)
+HOT_QUERIES = {
+    'bonos_equipados': (SQL_EQUIPPED_BONUSES, ('x',)),
+    'equipar_menu': (SQL_EQUIP_MENU, ('x',)),
+    'equipar_item': (SQL_EQUIP_LOOKUP, ('x', 'y')),
+    'inventario': (SQL_INVENTORY, ('x',)),
+    'cantidad_inventario': ("SELECT cantidad FROM inventarios WHERE personaje_id = ? AND item_id = ?", (1, 1)),
+    'items_de_personaje': ("SELECT item_id FROM inventarios WHERE personaje_id = ?", (1,)),
+    'portadores_de_item': ("SELECT personaje_id FROM inventarios WHERE item_id = ?", (1,)),
+    'recalcular_bonos_personaje': (SQL_RECOMPUTE_BONUSES + " AND inv.personaje_id = ? GROUP BY inv.personaje_id", (1,)),
+    'stats_grupo': (SQL_STATS_MANY.format(placeholders='?, ?'), ('x', 'y')),
+    'bonos_grupo': (SQL_EQUIPPED_BONUSES_MANY.format(placeholders='?, ?'), ('x', 'y')),
+    'npcs_grupo': (SQL_NPCS_MANY.format(placeholders='?, ?'), ('x', 'y')),
+    'info_npc': (SQL_NPC_INFO, ('x',)),
+    'info_personaje': (SQL_CHARACTER_INFO, ('x',)),
+    'historial_tiradas': (SQL_ROLL_HISTORY, ('x', 10)),
+    'estadisticas_personaje': (SQL_ROLL_STATS.format(where="nombre = ?"), ('x', '-30 days')),
+    'estadisticas_canal': (SQL_ROLL_STATS.format(where="canal_id = ?"), ('1', '-30 days')),
+    'estadisticas_recientes': (SQL_ROLL_STATS.format(where="origen = 'personaje'"), ('-30 days',))
+}
 
 # ============= BASE DE DATOS =============
 class DatabaseManager:
     def __init__(self):
         self.db_path = config.DB_PATH
-        self.init_database()
+        self.pool = ConnectionPool(self.db_path, config.DB_READERS)
+        # Las migraciones se aplican en el primer uso, no al importar el módulo
+        self._init_lock = threading.Lock()
+        self._init_owner = None  # hilo que está migrando (sus propias consultas no esperan)
+        self._initialized = False
     
-    def get_connection(self):
-        return sqlite3.connect(self.db_path)
+    def ensure_initialized(self):
+        """Crea tablas y aplica migraciones una sola vez, antes de la primera consulta"""
+        if self._initialized or self._init_owner == threading.get_ident():
+            return
+        with self._init_lock:
+            if self._initialized:
+                return
+            self._init_owner = threading.get_ident()
+            try:
+                self.init_database()
+                self._initialized = True
+            finally:
+                self._init_owner = None
+    
+    def get_connection(self, readonly=False):
+        """Context manager con una conexión del pool (lectura compartida o escritura exclusiva)"""
+        self.ensure_initialized()
+        return self.pool.reader() if readonly else self.pool.writer()
+    
+    def close(self):
+        self.pool.close()
     
     def init_database(self):
         with self.get_connection() as conn:
@@ -170,55 +627,521 @@ class DatabaseManager:
                 )
             """)
             
+            # Estadísticas base de personajes (fuente de verdad, Excel es solo exportación)
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS estadisticas_personajes (
+                    personaje_id INTEGER PRIMARY KEY,
+                    fuerza INTEGER DEFAULT 10,
+                    destreza INTEGER DEFAULT 10,
+                    velocidad INTEGER DEFAULT 10,
+                    resistencia INTEGER DEFAULT 10,
+                    inteligencia INTEGER DEFAULT 10,
+                    mana INTEGER DEFAULT 10,
+                    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    FOREIGN KEY (personaje_id) REFERENCES personajes (id)
+                )
+            """)
+            
             conn.commit()
-            logger.info("✅ Base de datos inicializada correctamente")
+        
+        self.run_migrations()
+        logger.info("✅ Base de datos inicializada correctamente")
+    
+    def migrate_v1(self, cursor):
+        """Índices de inventario y UNIQUE(personaje_id, item_id) para el upsert de /dar_item"""
+        # Bases creadas por versiones antiguas no tienen todas las columnas de items
+        cursor.execute("PRAGMA table_info(items)")
+        item_columns = [col[1] for col in cursor.fetchall()]
+        for column, definition in [('es_equipable', 'BOOLEAN DEFAULT TRUE'), ('slot_equipo', "TEXT DEFAULT 'general'"),
+                                   ('efecto_resistencia', 'INTEGER DEFAULT 0')]:
+            if column not in item_columns:
+                cursor.execute(f"ALTER TABLE items ADD COLUMN {column} {definition}")
+        
+        # Fusionar filas duplicadas antes de crear el índice único
+        cursor.execute("""
+            UPDATE inventarios SET
+                cantidad = (SELECT SUM(d.cantidad) FROM inventarios d
+                            WHERE d.personaje_id = inventarios.personaje_id AND d.item_id = inventarios.item_id),
+                equipado = (SELECT MAX(d.equipado) FROM inventarios d
+                            WHERE d.personaje_id = inventarios.personaje_id AND d.item_id = inventarios.item_id)
+            WHERE id IN (SELECT MIN(id) FROM inventarios GROUP BY personaje_id, item_id HAVING COUNT(*) > 1)
+        """)
+        cursor.execute("""DELETE FROM inventarios WHERE id NOT IN
+                        (SELECT MIN(id) FROM inventarios GROUP BY personaje_id, item_id)""")
+        if cursor.rowcount:
+            logger.info(f"🔄 {cursor.rowcount} filas duplicadas de inventario fusionadas")
+        
+        cursor.execute("""CREATE UNIQUE INDEX IF NOT EXISTS idx_inventarios_personaje_item
+                        ON inventarios (personaje_id, item_id)""")
+        cursor.execute("""CREATE INDEX IF NOT EXISTS idx_inventarios_personaje_equipado
+                        ON inventarios (personaje_id, equipado, item_id)""")
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_inventarios_item ON inventarios (item_id)")
+    
+    def migrate_v2(self, cursor):
+        """Totales materializados de bonos por items equipados, poblados desde cero"""
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS bonos_equipados (
+                personaje_id INTEGER PRIMARY KEY,
+                fuerza INTEGER DEFAULT 0,
+                destreza INTEGER DEFAULT 0,
+                velocidad INTEGER DEFAULT 0,
+                resistencia INTEGER DEFAULT 0,
+                inteligencia INTEGER DEFAULT 0,
+                mana INTEGER DEFAULT 0,
+                FOREIGN KEY (personaje_id) REFERENCES personajes (id)
+            )
+        """)
+        cursor.execute("DELETE FROM bonos_equipados")
+        cursor.execute(f"""INSERT INTO bonos_equipados
+                        (personaje_id, fuerza, destreza, velocidad, resistencia, inteligencia, mana)
+                        {SQL_RECOMPUTE_BONUSES} GROUP BY inv.personaje_id""")
+    
+    def migrate_v3(self, cursor):
+        """Registro de imágenes por hash con contador de referencias, y hash en cada entidad"""
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS imagenes (
+                hash TEXT PRIMARY KEY,
+                ruta TEXT NOT NULL,
+                tamano INTEGER NOT NULL,
+                tipo TEXT,
+                referencias INTEGER DEFAULT 0,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        """)
+        for table in ('personajes', 'npcs', 'items'):
+            cursor.execute(f"PRAGMA table_info({table})")
+            if 'imagen_hash' not in [col[1] for col in cursor.fetchall()]:
+                cursor.execute(f"ALTER TABLE {table} ADD COLUMN imagen_hash TEXT")
+    
+    def migrate_v4(self, cursor):
+        """Historial de tiradas de personajes y acciones de NPCs"""
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS tiradas (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                origen TEXT NOT NULL,
+                nombre TEXT NOT NULL,
+                accion TEXT NOT NULL,
+                cantidad INTEGER,
+                caras INTEGER,
+                dados TEXT,
+                atributo TEXT,
+                valor_atributo INTEGER,
+                bonificador INTEGER DEFAULT 0,
+                total INTEGER NOT NULL,
+                critico BOOLEAN DEFAULT FALSE,
+                pifia BOOLEAN DEFAULT FALSE,
+                canal_id TEXT,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        """)
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_tiradas_nombre ON tiradas (nombre, created_at)")
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_tiradas_canal ON tiradas (canal_id, created_at)")
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_tiradas_fecha ON tiradas (created_at)")
+    
+    def migrate_v5(self, cursor):
+        """Avance de la importación de logs antiguos, por huella de archivo (sobrevive a rotaciones)"""
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS importaciones_logs (
+                huella TEXT PRIMARY KEY,
+                archivo TEXT NOT NULL,
+                offset INTEGER NOT NULL DEFAULT 0,
+                tiradas INTEGER NOT NULL DEFAULT 0,
+                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        """)
+    
+    def migrate_v6(self, cursor):
+        """Escenas de combate por canal (copia de lo que vive en memoria, para sobrevivir a reinicios)"""
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS escenas (
+                canal_id TEXT PRIMARY KEY,
+                ronda INTEGER NOT NULL DEFAULT 1,
+                turno INTEGER NOT NULL DEFAULT 0,
+                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        """)
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS escena_participantes (
+                canal_id TEXT NOT NULL,
+                nombre TEXT NOT NULL,
+                tipo TEXT NOT NULL,
+                pg INTEGER NOT NULL,
+                pg_max INTEGER NOT NULL,
+                velocidad INTEGER NOT NULL,
+                iniciativa INTEGER NOT NULL,
+                condiciones TEXT,
+                cantidad INTEGER DEFAULT 1,
+                orden INTEGER NOT NULL,
+                PRIMARY KEY (canal_id, nombre)
+            )
+        """)
+    
+    def migrate_v7(self, cursor):
+        """Manifiesto de archivos revisados por la reconciliación: (mtime, tamaño) -> sha256 y datos leídos"""
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS manifiesto_archivos (
+                ruta TEXT PRIMARY KEY,
+                mtime_ns INTEGER NOT NULL,
+                tamano INTEGER NOT NULL,
+                sha256 TEXT NOT NULL,
+                datos TEXT,
+                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        """)
+    
+    def run_migrations(self):
+        """Aplica en orden las migraciones pendientes según PRAGMA user_version"""
+        migrations = [(1, self.migrate_v1), (2, self.migrate_v2), (3, self.migrate_v3), (4, self.migrate_v4),
+                      (5, self.migrate_v5), (6, self.migrate_v6), (7, self.migrate_v7)]
+        
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            version = cursor.execute("PRAGMA user_version").fetchone()[0]
+            for target, migration in migrations:
+                if version >= target:
+                    continue
+                migration(cursor)
+                cursor.execute(f"PRAGMA user_version = {target}")
+                conn.commit()
+                version = target
+                logger.info(f"🔄 Migración de esquema v{target} aplicada")
+    
+    def audit_query_plans(self):
+        """EXPLAIN QUERY PLAN de las consultas frecuentes; devuelve las que recorren tablas completas"""
+        offenders = {}
+        with self.get_connection(readonly=True) as conn:
+            for name, (sql, params) in HOT_QUERIES.items():
+                try:
+                    plan = conn.execute(f"EXPLAIN QUERY PLAN {sql}", params).fetchall()
+                except sqlite3.Error as e:
+                    offenders[name] = [f"ERROR: {e}"]
+                    continue
+                scans = [row[3] for row in plan if row[3].startswith('SCAN')]
+                if scans:
+                    offenders[name] = scans
+        
+        for name, scans in offenders.items():
+            logger.warning(f"⚠️ Consulta '{name}' recorre tablas completas: {'; '.join(scans)}")
+        return offenders
 
 db = DatabaseManager()
 
 # ============= IMAGE HANDLER =============
+def make_thumbnail(source_path, dest_path, max_size):
+    """Trabajador (proceso aparte): miniatura WEBP de como máximo max_size px por lado"""
+    from PIL import Image, ImageOps
+    
+    tmp_path = f"{dest_path}.{os.getpid()}.part"
+    with Image.open(source_path) as image:
+        image = ImageOps.exif_transpose(image)
+        image.thumbnail((max_size, max_size))
+        if image.mode not in ('RGB', 'RGBA'):
+            image = image.convert('RGBA')
+        os.makedirs(os.path.dirname(dest_path), exist_ok=True)
+        image.save(tmp_path, 'WEBP', quality=80, method=4)
+    os.replace(tmp_path, dest_path)
+    return os.path.getsize(dest_path)
+
 class ImageHandler:
-    @staticmethod
-    async def save_image(attachment, entity_type, entity_name):
-        """Guarda una imagen adjunta y retorna la URL"""
-        if not attachment:
+    """Imágenes guardadas por contenido (<sha256>.<ext>): bytes idénticos se guardan una sola vez"""
+    CHUNK_SIZE = 64 * 1024
+    ENTITY_TABLES = ('personajes', 'npcs', 'items')
+    LEGACY_DIRS = {'personajes': config.CHAR_IMAGES, 'npcs': config.NPC_IMAGES, 'items': config.ITEM_IMAGES}
+    
+    THUMB_NAME = "thumb.webp"
+    
+    def __init__(self, store_dir, max_bytes, gc_grace, thumb_size, thumb_workers):
+        self.store_dir = store_dir
+        self.tmp_dir = os.path.join(store_dir, 'tmp')
+        self.thumbs_dir = os.path.join(store_dir, 'thumbs')
+        self.max_bytes = max_bytes
+        self.gc_grace = gc_grace
+        self.thumb_size = thumb_size
+        self.thumb_workers = thumb_workers
+        self._session = None
+        self._thumb_executor = None
+        self._thumb_jobs = {}  # hash -> tarea en curso, para no generar dos veces la misma miniatura
+    
+    def path_for(self, image_hash, ext):
+        return os.path.join(self.store_dir, image_hash[:2], f"{image_hash}.{ext}")
+    
+    async def _get_session(self):
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=config.IO_TIMEOUT * 3))
+        return self._session
+    
+    async def close(self):
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        if self._thumb_executor is not None:
+            self._thumb_executor.shutdown(wait=False, cancel_futures=True)
+            self._thumb_executor = None
+    
+    def thumbnail_path(self, image_hash):
+        return os.path.join(self.thumbs_dir, image_hash[:2], f"{image_hash}_{self.thumb_size}.webp")
+    
+    def _source_path(self, image_hash):
+        with db.get_connection(readonly=True) as conn:
+            row = conn.execute("SELECT ruta FROM imagenes WHERE hash = ?", (image_hash,)).fetchone()
+        return row[0] if row else None
+    
+    async def _build_thumbnail(self, image_hash, path):
+        source = await data_access.run("img.ruta", self._source_path, image_hash)
+        if not source or not os.path.exists(source):
             return None
-            
+        if self._thumb_executor is None:
+            self._thumb_executor = ProcessPoolExecutor(max_workers=self.thumb_workers)
+        loop = asyncio.get_running_loop()
+        size = await asyncio.wait_for(
+            loop.run_in_executor(self._thumb_executor, make_thumbnail, source, path, self.thumb_size),
+            config.IO_TIMEOUT
+        )
+        logger.info(f"🖼️ Miniatura {image_hash[:12]} generada ({size} bytes)")
+        return path
+    
+    async def ensure_thumbnail(self, image_hash):
+        """Ruta de la miniatura WEBP cacheada por hash; se genera una sola vez en el pool de procesos"""
+        if not image_hash:
+            return None
+        path = self.thumbnail_path(image_hash)
+        if os.path.exists(path):
+            return path
+        
+        job = self._thumb_jobs.get(image_hash)
+        if job is None:
+            job = asyncio.ensure_future(self._build_thumbnail(image_hash, path))
+            self._thumb_jobs[image_hash] = job
+            job.add_done_callback(lambda _: self._thumb_jobs.pop(image_hash, None))
         try:
-            dirs = {
-                'personaje': config.CHAR_IMAGES,
-                'npc': config.NPC_IMAGES,
-                'item': config.ITEM_IMAGES
-            }
-            save_dir = dirs.get(entity_type, config.IMAGES_DIR)
-            
-            file_ext = attachment.filename.split('.')[-1]
-            file_hash = hashlib.md5(f"{entity_name}_{datetime.now()}".encode()).hexdigest()[:8]
-            filename = f"{entity_name}_{file_hash}.{file_ext}"
-            filepath = os.path.join(save_dir, filename)
+            return await asyncio.shield(job)
+        except Exception as e:
+            logger.warning(f"⚠️ No se pudo generar la miniatura {image_hash[:12]}: {e}")
+            return None
+    
+    async def attach_thumbnail(self, embed, image_hash, fallback_url=None):
+        """Usa la miniatura local como attachment://thumb.webp (o la URL original si no hay);
+        retorna los archivos a adjuntar al mensaje"""
+        path = await self.ensure_thumbnail(image_hash)
+        if path:
+            embed.set_thumbnail(url=f"attachment://{self.THUMB_NAME}")
+            return [discord.File(path, filename=self.THUMB_NAME)]
+        if fallback_url:
+            embed.set_thumbnail(url=fallback_url)
+        return []
+    
+    async def save_image(self, attachment, entity_type, entity_name):
+        """Descarga el adjunto en bloques calculando su sha256; retorna (url, hash) o (None, None)"""
+        if not attachment:
+            return None, None
+        
+        if attachment.size and attachment.size > self.max_bytes:
+            logger.warning(f"⚠️ Imagen de {entity_name} demasiado grande ({attachment.size} bytes)")
+            return None, None
+        
+        ext = os.path.splitext(attachment.filename)[1].lstrip('.').lower() or 'bin'
+        tmp_path = os.path.join(self.tmp_dir, f"{time.time_ns()}_{id(attachment)}.part")
+        hasher = hashlib.sha256()
+        size = 0
+        try:
+            session = await self._get_session()
+            async with session.get(attachment.url) as response:
+                response.raise_for_status()
+                with open(tmp_path, 'wb') as f:
+                    async for chunk in response.content.iter_chunked(self.CHUNK_SIZE):
+                        size += len(chunk)
+                        if size > self.max_bytes:
+                            raise ValueError(f"supera {self.max_bytes} bytes")
+                        hasher.update(chunk)
+                        f.write(chunk)
             
-            await attachment.save(filepath)
-            logger.info(f"✅ Imagen guardada: {filename}")
-            return attachment.url
+            image_hash = hasher.hexdigest()
+            path, is_new = await data_access.run("img.guardar", self._store_file, tmp_path, image_hash, ext, size,
+                                                 attachment.content_type)
+            logger.info(f"✅ Imagen de {entity_type} {entity_name}: {image_hash[:12]} "
+                        f"({'nueva' if is_new else 'ya existía, reutilizada'})")
+            asyncio.ensure_future(self.ensure_thumbnail(image_hash))
+            return attachment.url, image_hash
             
         except Exception as e:
             logger.error(f"❌ Error guardando imagen: {e}")
-            return None
+            return None, None
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+    
+    def _store_file(self, source_path, image_hash, ext, size, content_type, move=True):
+        """Coloca el archivo en su ruta por hash salvo que ya exista, y lo registra en imagenes"""
+        with db.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("SELECT ruta FROM imagenes WHERE hash = ?", (image_hash,))
+            row = cursor.fetchone()
+            if row and os.path.exists(row[0]):
+                return row[0], False
+            
+            path = self.path_for(image_hash, ext)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            if move:
+                os.replace(source_path, path)
+            else:
+                shutil.copyfile(source_path, path)
+            cursor.execute("""INSERT INTO imagenes (hash, ruta, tamano, tipo) VALUES (?, ?, ?, ?)
+                            ON CONFLICT(hash) DO UPDATE SET ruta = excluded.ruta""",
+                         (image_hash, path, size, content_type))
+            conn.commit()
+            return path, True
+    
+    @staticmethod
+    def retain(cursor, image_hash):
+        """Suma una referencia (dentro de la transacción que asigna la imagen a la entidad)"""
+        if image_hash:
+            cursor.execute("UPDATE imagenes SET referencias = referencias + 1 WHERE hash = ?", (image_hash,))
+    
+    @staticmethod
+    def release_entity(cursor, table, entity_id):
+        """Resta la referencia de la imagen actual de una entidad (antes de reemplazarla o borrarla)"""
+        cursor.execute(f"""UPDATE imagenes SET referencias = MAX(referencias - 1, 0)
+                         WHERE hash = (SELECT imagen_hash FROM {table} WHERE id = ?)""", (entity_id,))
+    
+    def _referenced_hashes_sql(self):
+        return " UNION ALL ".join(f"SELECT imagen_hash AS hash FROM {table} WHERE imagen_hash IS NOT NULL"
+                                  for table in self.ENTITY_TABLES)
+    
+    def garbage_collect(self, dry_run=False):
+        """Recalcula referencias desde personajes/npcs/items y borra imágenes huérfanas y temporales viejos"""
+        referenced = self._referenced_hashes_sql()
+        with db.get_connection(readonly=dry_run) as conn:
+            cursor = conn.cursor()
+            if not dry_run:
+                cursor.execute(f"""UPDATE imagenes SET referencias =
+                                (SELECT COUNT(*) FROM ({referenced}) r WHERE r.hash = imagenes.hash)""")
+            cursor.execute(f"""SELECT hash, ruta, tamano FROM imagenes
+                            WHERE hash NOT IN (SELECT hash FROM ({referenced}))
+                            AND created_at <= datetime('now', ?)""", (f"-{self.gc_grace} seconds",))
+            orphans = cursor.fetchall()
+            if orphans and not dry_run:
+                cursor.executemany("DELETE FROM imagenes WHERE hash = ?", [(row[0],) for row in orphans])
+            if not dry_run:
+                conn.commit()
+            cursor.execute("SELECT hash, ruta FROM imagenes")
+            rows = cursor.fetchall()
+            known_hashes = {row[0] for row in rows}
+            known = {os.path.normpath(row[1]) for row in rows}
+        
+        report = {'huerfanas': len(orphans), 'archivos_sueltos': 0, 'temporales': 0, 'miniaturas': 0,
+                  'bytes_liberados': sum(row[2] or 0 for row in orphans)}
+        to_delete = [row[1] for row in orphans]
+        known.update(os.path.normpath(path) for path in to_delete)
+        
+        # Archivos del almacén sin fila (p. ej. un guardado interrumpido) y temporales abandonados
+        cutoff = time.time() - self.gc_grace
+        thumbs_dir = os.path.normpath(self.thumbs_dir)
+        for root, _, files in os.walk(self.store_dir):
+            for filename in files:
+                path = os.path.normpath(os.path.join(root, filename))
+                if path.startswith(thumbs_dir + os.sep):
+                    # Las miniaturas se conservan mientras exista su imagen original
+                    if filename.split('_', 1)[0] in known_hashes:
+                        continue
+                    report['miniaturas'] += 1
+                    report['bytes_liberados'] += os.path.getsize(path)
+                    to_delete.append(path)
+                    continue
+                if path in known or os.path.getmtime(path) > cutoff:
+                    continue
+                if os.path.dirname(path) == os.path.normpath(self.tmp_dir):
+                    report['temporales'] += 1
+                else:
+                    report['archivos_sueltos'] += 1
+                report['bytes_liberados'] += os.path.getsize(path)
+                to_delete.append(path)
+        
+        if not dry_run:
+            for path in to_delete:
+                if os.path.exists(path):
+                    os.remove(path)
+        
+        logger.info(f"🧹 GC de imágenes{' (simulado)' if dry_run else ''}: {report}")
+        return report
+    
+    @staticmethod
+    def _hash_file(path):
+        hasher = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(ImageHandler.CHUNK_SIZE), b''):
+                hasher.update(chunk)
+        return hasher.hexdigest()
+    
+    def import_legacy(self, delete=False):
+        """Pasa al almacén las imágenes antiguas <nombre>_<md5>.<ext>, deduplicando bytes idénticos.
+        La más reciente de cada nombre se asigna a la entidad homónima que aún no tenga imagen."""
+        imported = linked = 0
+        for table, directory in self.LEGACY_DIRS.items():
+            if not os.path.isdir(directory):
+                continue
+            newest = {}  # nombre de entidad -> (mtime, hash)
+            for filename in os.listdir(directory):
+                path = os.path.join(directory, filename)
+                if not os.path.isfile(path):
+                    continue
+                image_hash = self._hash_file(path)
+                ext = os.path.splitext(filename)[1].lstrip('.').lower() or 'bin'
+                _, is_new = self._store_file(path, image_hash, ext, os.path.getsize(path), None, move=False)
+                imported += is_new
+                entity_name = os.path.splitext(filename)[0].rsplit('_', 1)[0]
+                mtime = os.path.getmtime(path)
+                if entity_name not in newest or mtime > newest[entity_name][0]:
+                    newest[entity_name] = (mtime, image_hash)
+                if delete:
+                    os.remove(path)
+            
+            with db.get_connection() as conn:
+                cursor = conn.cursor()
+                for entity_name, (_, image_hash) in newest.items():
+                    cursor.execute(f"UPDATE {table} SET imagen_hash = ? WHERE nombre = ? AND imagen_hash IS NULL",
+                                 (image_hash, entity_name))
+                    if cursor.rowcount:
+                        self.retain(cursor, image_hash)
+                        linked += 1
+                conn.commit()
+        
+        logger.info(f"🖼️ Imágenes antiguas importadas: {imported} únicas, {linked} asignadas a entidades")
+        return imported, linked
 
-image_handler = ImageHandler()
+image_handler = ImageHandler(config.IMAGE_STORE, config.IMAGE_MAX_BYTES, config.IMAGE_GC_GRACE,
+                             config.THUMB_SIZE, config.THUMB_WORKERS)
 
 # ============= GOOGLE SHEETS (OPCIONAL) =============
+class SheetsQuotaError(Exception):
+    """La API de Google Sheets rechazó la escritura por cuota (HTTP 429)"""
+
 class GoogleSheetsManager:
+    SHEET_ROWS = 20
+    SHEET_COLS = 6
+    
     def __init__(self):
         self.client = None
         self.spreadsheet = None
-        self.init_google_sheets()
+        self._worksheets = {}  # título -> Worksheet; se refresca sólo cuando falta alguna hoja
+        self._worksheets_lock = threading.Lock()
+        self._connect_lock = threading.Lock()
+        self._connect_attempted = False
+    
+    def ensure_connected(self):
+        """Conecta una sola vez; gspread y google-auth se importan aquí y no al cargar el bot"""
+        with self._connect_lock:
+            if not self._connect_attempted:
+                self._connect_attempted = True
+                self.init_google_sheets()
+        return self.available
     
     def init_google_sheets(self):
         try:
             if not os.path.exists(config.GOOGLE_CREDENTIALS_FILE):
                 logger.info("ℹ️ Google Sheets no configurado - Usando solo almacenamiento local")
                 return
-                
+            
+            import gspread
+            from google.oauth2.service_account import Credentials
             scope = ['https://spreadsheets.google.com/feeds', 'https://www.googleapis.com/auth/drive']
             creds = Credentials.from_service_account_file(config.GOOGLE_CREDENTIALS_FILE, scopes=scope)
             self.client = gspread.authorize(creds)
@@ -232,173 +1155,1172 @@ class GoogleSheetsManager:
         except Exception as e:
             logger.warning(f"⚠️ Google Sheets no disponible: {e}")
     
-    def sync_character(self, character_name, stats):
-        if not self.client or not self.spreadsheet:
+    @property
+    def available(self):
+        return self.client is not None and self.spreadsheet is not None
+    
+    @staticmethod
+    def character_rows(stats):
+        data = [['ATRIBUTO', 'BASE', 'BONUS', 'TOTAL']]
+        for attr, values in stats.items():
+            data.append([attr.title(), values['base'], values['bonus'], values['total']])
+        return data
+    
+    def get_worksheets(self, titles):
+        """Handles de las hojas pedidas desde la caché; si falta alguna refresca los metadatos una vez
+        y crea las que sigan faltando con un único batch_update (addSheet)"""
+        import gspread
+        with self._worksheets_lock:
+            missing = [title for title in titles if title not in self._worksheets]
+            if missing:
+                self._worksheets = {worksheet.title: worksheet for worksheet in self.spreadsheet.worksheets()}
+                missing = [title for title in missing if title not in self._worksheets]
+            if missing:
+                response = self.spreadsheet.batch_update({'requests': [
+                    {'addSheet': {'properties': {'title': title, 'gridProperties': {
+                        'rowCount': self.SHEET_ROWS, 'columnCount': self.SHEET_COLS}}}}
+                    for title in missing
+                ]})
+                for reply in response.get('replies', []):
+                    properties = reply['addSheet']['properties']
+                    self._worksheets[properties['title']] = gspread.Worksheet(
+                        self.spreadsheet, properties, self.spreadsheet.id, self.spreadsheet.client)
+                logger.info(f"📄 {len(missing)} hojas nuevas creadas en Google Sheets")
+            return {title: self._worksheets[title] for title in titles}
+    
+    def invalidate_worksheets(self):
+        with self._worksheets_lock:
+            self._worksheets = {}
+    
+    def write_characters(self, characters, retry=True):
+        """Escribe varias hojas PJ_<nombre> con un solo values_batch_clear y un solo values_batch_update"""
+        if not self.available:
             return
+        import gspread
+        titles = [f"PJ_{character_name}" for character_name in characters]
         try:
-            worksheet_name = f"PJ_{character_name}"
-            try:
-                worksheet = self.spreadsheet.worksheet(worksheet_name)
-            except gspread.WorksheetNotFound:
-                worksheet = self.spreadsheet.add_worksheet(title=worksheet_name, rows=20, cols=6)
-            
-            data = [['ATRIBUTO', 'BASE', 'BONUS', 'TOTAL']]
-            for attr, values in stats.items():
-                data.append([attr.title(), values['base'], values['bonus'], values['total']])
-            
-            worksheet.clear()
-            worksheet.update('A1', data)
-            logger.info(f"✅ {character_name} sincronizado en Google Sheets")
+            self.get_worksheets(titles)
+            self.spreadsheet.values_batch_clear(body={'ranges': [f"'{title}'!A1:F{self.SHEET_ROWS}" for title in titles]})
+            self.spreadsheet.values_batch_update({
+                'valueInputOption': 'RAW',
+                'data': [{'range': f"'{title}'!A1", 'values': self.character_rows(stats)}
+                         for title, stats in zip(titles, characters.values())]
+            })
+        except gspread.exceptions.APIError as e:
+            if getattr(e, 'code', None) == 429:
+                raise SheetsQuotaError(str(e)) from e
+            if getattr(e, 'code', None) == 400 and retry:
+                # Probablemente alguien borró una hoja a mano: la caché de handles quedó obsoleta
+                self.invalidate_worksheets()
+                return self.write_characters(characters, retry=False)
+            raise
+        logger.info(f"✅ {len(characters)} personajes sincronizados en Google Sheets")
+    
+    def sync_character(self, character_name, stats):
+        try:
+            self.write_characters({character_name: stats})
         except Exception as e:
             logger.warning(f"⚠️ No se pudo sincronizar con Google Sheets: {e}")
 
 google_sheets = GoogleSheetsManager()
 
-# ============= EXCEL MANAGER =============
-class ExcelManager:
+class FakeSheetsBackend:
+    """Backend en memoria con la interfaz de GoogleSheetsManager, para probar la sincronización sin red"""
+    available = True
+    
+    def __init__(self, quota_failures=0):
+        self.sheets = {}         # título de hoja -> filas
+        self.batches = []        # nombres escritos en cada lote
+        self.quota_failures = quota_failures  # próximas escrituras que fallarán con 429
+    
+    def ensure_connected(self):
+        return True
+    
+    def write_characters(self, characters):
+        if self.quota_failures > 0:
+            self.quota_failures -= 1
+            raise SheetsQuotaError("429 simulado")
+        self.batches.append(list(characters))
+        for character_name, stats in characters.items():
+            self.sheets[f"PJ_{character_name}"] = GoogleSheetsManager.character_rows(stats)
+    
+    def sync_character(self, character_name, stats):
+        self.write_characters({character_name: stats})
+
+sheets_backend = FakeSheetsBackend() if config.SHEETS_BACKEND == 'fake' else google_sheets
+
+# ============= CACHE DE ESTADÍSTICAS =============
+class StatCache:
+    """Caché LRU de estadísticas base por personaje, refrescada en cada escritura"""
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()  # nombre -> stats
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+    
+    @staticmethod
+    def _copy(stats):
+        return {attr: dict(values) for attr, values in stats.items()}
+    
+    def get(self, character_name):
+        with self._lock:
+            stats = self._entries.get(character_name)
+            if stats is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(character_name)
+            self.hits += 1
+            return self._copy(stats)
+    
+    def put(self, character_name, stats):
+        with self._lock:
+            self._entries[character_name] = self._copy(stats)
+            self._entries.move_to_end(character_name)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+    
+    def invalidate(self, character_name=None):
+        with self._lock:
+            if character_name is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(character_name, None)
+    
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'max_entries': self.max_entries,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_ratio': self.hits / total if total else 0.0
+            }
+
+stat_cache = StatCache(config.STAT_CACHE_SIZE)
+
+class EmbedCache:
+    """Caché LRU de embeds ya construidos por (tipo, nombre). Cada entidad lleva un contador
+    de versión que sube en cada escritura: un embed construido con una versión anterior
+    (p. ej. mientras otra orden editaba la entidad) nunca se guarda ni se sirve."""
+    KINDS = ('personaje', 'npc', 'inventario')
+    
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()  # (tipo, nombre) -> (versión, embed como dict, imagen_hash, imagen_url)
+        self._versions = {}            # (tipo, nombre) -> versión
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+    
+    def version(self, kind, name):
+        with self._lock:
+            return self._versions.get((kind, name), 0)
+    
+    def bump(self, kind, name):
+        with self._lock:
+            key = (kind, name)
+            self._versions[key] = self._versions.get(key, 0) + 1
+            self._entries.pop(key, None)
+    
+    def bump_character(self, name):
+        """Ficha e inventario de un personaje (equipar cambia ambos)"""
+        self.bump('personaje', name)
+        self.bump('inventario', name)
+    
+    def get(self, kind, name):
+        """(embed, imagen_hash, imagen_url) listos para enviar, o None si no hay versión vigente"""
+        with self._lock:
+            key = (kind, name)
+            entry = self._entries.get(key)
+            if entry is None or entry[0] != self._versions.get(key, 0):
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            _, payload, image_hash, image_url = entry
+        return discord.Embed.from_dict(copy.deepcopy(payload)), image_hash, image_url
+    
+    def put(self, kind, name, version, embed, image_hash=None, image_url=None):
+        with self._lock:
+            key = (kind, name)
+            if version != self._versions.get(key, 0):
+                return  # hubo una escritura mientras se construía
+            self._entries[key] = (version, copy.deepcopy(embed.to_dict()), image_hash, image_url)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+    
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'max_entries': self.max_entries,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_ratio': self.hits / total if total else 0.0
+            }
+
+embed_cache = EmbedCache(config.EMBED_CACHE_SIZE)
+
+# ============= ÍNDICE DE NOMBRES (AUTOCOMPLETADO) =============
+class NameIndex:
+    """Índice en memoria (prefijos + trigramas) de nombres de personajes, NPCs e items"""
+    TABLES = ('personajes', 'npcs', 'items')
+    MAX_CHOICES = 25  # máximo de sugerencias que acepta Discord
+    MIN_SIMILARITY = 0.3
+    
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._sorted = {table: [] for table in self.TABLES}     # [(clave normalizada, nombre)] ordenada
+        self._trigrams = {table: {} for table in self.TABLES}   # trigrama -> {nombres}
+        self._keys = {table: {} for table in self.TABLES}       # nombre -> clave normalizada
+    
+    @staticmethod
+    def normalize(name):
+        """'Fëanor' -> 'feanor': quita acentos, caracteres invisibles (p. ej. U+17B5) y mayúsculas"""
+        decomposed = unicodedata.normalize('NFKD', name)
+        visible = ''.join(ch for ch in decomposed if unicodedata.category(ch) not in ('Mn', 'Me', 'Cf', 'Cc'))
+        return ' '.join(visible.casefold().split())
+    
     @staticmethod
-    def create_character_excel(character_name, user_id, initial_stats=None):
-        if initial_stats is None:
-            initial_stats = {}
+    def _trigrams_of(key):
+        return {key[i:i + 3] for i in range(len(key) - 2)}
+    
+    def _add_locked(self, table, name):
+        if name in self._keys[table]:
+            return
+        key = self.normalize(name)
+        self._keys[table][name] = key
+        insort(self._sorted[table], (key, name))
+        for trigram in self._trigrams_of(key):
+            self._trigrams[table].setdefault(trigram, set()).add(name)
+    
+    def add(self, table, name):
+        with self._lock:
+            self._add_locked(table, name)
+    
+    def remove(self, table, name):
+        with self._lock:
+            key = self._keys[table].pop(name, None)
+            if key is None:
+                return
+            entries = self._sorted[table]
+            i = bisect_left(entries, (key, name))
+            if i < len(entries) and entries[i] == (key, name):
+                del entries[i]
+            for trigram in self._trigrams_of(key):
+                names = self._trigrams[table].get(trigram)
+                if names:
+                    names.discard(name)
+                    if not names:
+                        del self._trigrams[table][trigram]
+    
+    def load(self):
+        """Reconstruye el índice completo desde SQLite (al arrancar)"""
+        rows = {}
+        with db.get_connection(readonly=True) as conn:
+            cursor = conn.cursor()
+            for table in self.TABLES:
+                cursor.execute(f"SELECT nombre FROM {table}")
+                rows[table] = [row[0] for row in cursor.fetchall()]
+        
+        with self._lock:
+            for table in self.TABLES:
+                self._sorted[table] = []
+                self._trigrams[table] = {}
+                self._keys[table] = {}
+                for name in rows[table]:
+                    self._add_locked(table, name)
+        logger.info(f"🔎 Índice de nombres cargado: " +
+                    ", ".join(f"{len(rows[table])} {table}" for table in self.TABLES))
+    
+    def search(self, table, query, limit=MAX_CHOICES):
+        """Primero coincidencias por prefijo, luego por similitud de trigramas"""
+        key = self.normalize(query)
+        with self._lock:
+            entries = self._sorted[table]
+            if not key:
+                return [name for _, name in entries[:limit]]
             
-        file_path = f"{config.EXCEL_DIR}/activos/{character_name}.xlsx"
-        
-        character_data = {
-            'Atributo': config.BASE_ATTRIBUTES,
-            'Valor': [
-                initial_stats.get('fuerza', 10), initial_stats.get('destreza', 10),
-                initial_stats.get('velocidad', 10), initial_stats.get('resistencia', 10),
-                initial_stats.get('inteligencia', 10), initial_stats.get('mana', 10)
-            ]
-        }
-        
-        with pd.ExcelWriter(file_path, engine='openpyxl') as writer:
-            df_stats = pd.DataFrame(character_data)
-            df_stats.to_excel(writer, sheet_name='Estadisticas', index=False)
+            results = []
+            i = bisect_left(entries, (key,))
+            while i < len(entries) and entries[i][0].startswith(key) and len(results) < limit:
+                results.append(entries[i][1])
+                i += 1
             
-            info_data = {
-                'Campo': ['Nombre', 'Usuario_ID', 'Oro'],
-                'Valor': [character_name, str(user_id), 0]
-            }
-            df_info = pd.DataFrame(info_data)
-            df_info.to_excel(writer, sheet_name='Info', index=False)
-        
-        logger.info(f"✅ Excel creado para {character_name}")
-        return file_path
+            query_trigrams = self._trigrams_of(key)
+            if len(results) < limit and query_trigrams:
+                scores = Counter()
+                for trigram in query_trigrams:
+                    scores.update(self._trigrams[table].get(trigram, ()))
+                seen = set(results)
+                ranked = sorted((name for name, hits in scores.items()
+                                 if name not in seen and hits / len(query_trigrams) >= self.MIN_SIMILARITY),
+                                key=lambda name: (-scores[name], self._keys[table][name]))
+                results.extend(ranked[:limit - len(results)])
+        return results
+
+name_index = NameIndex()
+
+def name_autocomplete(table):
+    """Callback de autocompletado servido desde name_index, sin tocar SQLite en cada tecla"""
+    async def autocomplete(interaction: discord.Interaction, current: str):
+        return [app_commands.Choice(name=name[:100], value=name) for name in name_index.search(table, current)]
+    return autocomplete
+
+personaje_autocomplete = name_autocomplete('personajes')
+npc_autocomplete = name_autocomplete('npcs')
+item_autocomplete = name_autocomplete('items')
+
+# ============= ESTADÍSTICAS (SQLITE) =============
+class StatsManager:
+    """Estadísticas base de personajes; la tabla estadisticas_personajes es la fuente de verdad"""
+    ATTRIBUTES = ['fuerza', 'destreza', 'velocidad', 'resistencia', 'inteligencia', 'mana']
+    
+    @staticmethod
+    def _row_to_stats(row):
+        return {attr: {'base': int(value), 'bonus': 0, 'total': int(value)}
+                for attr, value in zip(StatsManager.ATTRIBUTES, row)}
+    
+    @staticmethod
+    def create_character_stats(cursor, character_name, personaje_id, initial_stats=None):
+        """Inserta la fila de stats dentro de la transacción del llamador"""
+        initial_stats = initial_stats or {}
+        values = [int(initial_stats.get(attr, 10)) for attr in StatsManager.ATTRIBUTES]
+        cursor.execute(f"""INSERT OR REPLACE INTO estadisticas_personajes
+                        (personaje_id, {', '.join(StatsManager.ATTRIBUTES)})
+                        VALUES (?, ?, ?, ?, ?, ?, ?)""", (personaje_id, *values))
+        stat_cache.put(character_name, StatsManager._row_to_stats(values))
     
     @staticmethod
     def read_character_stats(character_name):
-        file_path = f"{config.EXCEL_DIR}/activos/{character_name}.xlsx"
-        if not os.path.exists(file_path):
-            return None
-            
+        cached = stat_cache.get(character_name)
+        if cached is not None:
+            return cached
+        
         try:
-            df = pd.read_excel(file_path, sheet_name='Estadisticas')
-            stats = {}
-            for _, row in df.iterrows():
-                attr_name = row['Atributo'].lower()
-                stats[attr_name] = {'base': int(row['Valor']), 'bonus': 0, 'total': int(row['Valor'])}
+            with db.get_connection(readonly=True) as conn:
+                cursor = conn.cursor()
+                cursor.execute(f"""SELECT {', '.join('s.' + attr for attr in StatsManager.ATTRIBUTES)}
+                                FROM estadisticas_personajes s
+                                JOIN personajes p ON s.personaje_id = p.id
+                                WHERE p.nombre = ?""", (character_name,))
+                row = cursor.fetchone()
+            if not row:
+                return None
+            stats = StatsManager._row_to_stats(row)
+            stat_cache.put(character_name, stats)
             return stats
         except Exception as e:
             logger.error(f"❌ Error leyendo stats: {e}")
             return None
     
     @staticmethod
-    def update_character_stats(character_name, new_stats):
-        file_path = f"{config.EXCEL_DIR}/activos/{character_name}.xlsx"
-        if not os.path.exists(file_path):
+    def read_many_character_stats(character_names):
+        """Stats de varios personajes: aciertos de caché más una sola consulta IN para el resto"""
+        result = {}
+        missing = []
+        for name in dict.fromkeys(character_names):
+            cached = stat_cache.get(name)
+            if cached is not None:
+                result[name] = cached
+            else:
+                missing.append(name)
+        
+        if missing:
+            try:
+                with db.get_connection(readonly=True) as conn:
+                    cursor = conn.cursor()
+                    cursor.execute(SQL_STATS_MANY.format(placeholders=', '.join('?' * len(missing))), missing)
+                    rows = cursor.fetchall()
+                for row in rows:
+                    stats = StatsManager._row_to_stats(row[1:])
+                    stat_cache.put(row[0], stats)
+                    result[row[0]] = stats
+            except Exception as e:
+                logger.error(f"❌ Error leyendo stats en lote: {e}")
+        return result
+    
+    @staticmethod
+    def write_character_stats(cursor, character_name, new_stats):
+        """UPDATE de stats dentro de la transacción del llamador; False si no se tocó ninguna fila"""
+        updates = {attr: int(value) for attr, value in new_stats.items() if attr in StatsManager.ATTRIBUTES}
+        if not updates:
             return False
-            
+        assignments = ', '.join(f"{attr} = ?" for attr in updates)
+        cursor.execute(f"""UPDATE estadisticas_personajes SET {assignments}, updated_at = CURRENT_TIMESTAMP
+                        WHERE personaje_id = (SELECT id FROM personajes WHERE nombre = ?)""",
+                     (*updates.values(), character_name))
+        return cursor.rowcount > 0
+    
+    @staticmethod
+    def update_character_stats(character_name, new_stats):
         try:
-            with pd.ExcelFile(file_path) as xls:
-                df_stats = pd.read_excel(xls, sheet_name='Estadisticas')
-                df_info = pd.read_excel(xls, sheet_name='Info')
-            
-            for idx, row in df_stats.iterrows():
-                attr_name = row['Atributo'].lower()
-                if attr_name in new_stats:
-                    df_stats.at[idx, 'Valor'] = new_stats[attr_name]
-            
-            with pd.ExcelWriter(file_path, engine='openpyxl') as writer:
-                df_stats.to_excel(writer, sheet_name='Estadisticas', index=False)
-                df_info.to_excel(writer, sheet_name='Info', index=False)
-            
-            return True
+            with db.get_connection() as conn:
+                updated = StatsManager.write_character_stats(conn.cursor(), character_name, new_stats)
+                conn.commit()
+            stat_cache.invalidate(character_name)
+            embed_cache.bump('personaje', character_name)
+            return updated
         except Exception as e:
+            stat_cache.invalidate(character_name)
+            embed_cache.bump('personaje', character_name)
             logger.error(f"❌ Error actualizando stats: {e}")
             return False
-
-excel_manager = ExcelManager()
-
-# ============= INVENTORY SYSTEM =============
+    
+    @staticmethod
+    def delete_character_stats(cursor, personaje_id, character_name):
+        cursor.execute("DELETE FROM estadisticas_personajes WHERE personaje_id = ?", (personaje_id,))
+        stat_cache.invalidate(character_name)
+        embed_cache.bump_character(character_name)
+    
+    @staticmethod
+    def migrate_from_excel():
+        """Importa los Excel de los personajes que aún no tienen fila de stats.
+        
+        Sin Excel legible el personaje queda pendiente (no se inventan stats base): en el próximo
+        arranque se vuelve a intentar, así que basta con reparar o restaurar el archivo.
+        """
+        with db.get_connection(readonly=True) as conn:
+            cursor = conn.cursor()
+            cursor.execute("""SELECT p.id, p.nombre, p.excel_path FROM personajes p
+                            LEFT JOIN estadisticas_personajes s ON s.personaje_id = p.id
+                            WHERE s.personaje_id IS NULL""")
+            pending = cursor.fetchall()
+        
+        if not pending:
+            return 0
+        
+        rows = []
+        unreadable = []
+        for personaje_id, nombre, excel_path in pending:
+            stats = excel_manager.read_excel_stats(excel_path)
+            if stats is None:
+                unreadable.append(nombre)
+                continue
+            rows.append((personaje_id, *[stats.get(attr, 10) for attr in StatsManager.ATTRIBUTES]))
+        
+        if unreadable:
+            logger.warning(f"⚠️ {len(unreadable)} personajes sin Excel legible quedan sin migrar "
+                           f"(se reintentará): {', '.join(unreadable)}")
+        if not rows:
+            return 0
+        
+        with db.get_connection() as conn:
+            conn.executemany(f"""INSERT OR IGNORE INTO estadisticas_personajes
+                             (personaje_id, {', '.join(StatsManager.ATTRIBUTES)})
+                             VALUES (?, ?, ?, ?, ?, ?, ?)""", rows)
+            conn.commit()
+        
+        logger.info(f"📥 {len(rows)} personajes migrados de Excel a SQLite")
+        return len(rows)
+
+stats_manager = StatsManager()
+
+# ============= EXCEL MANAGER =============
+class ExcelManager:
+    """Excel solo como formato de exportación; las stats viven en SQLite"""
+    @staticmethod
+    def read_excel_stats(file_path):
+        """Lee la hoja Estadisticas de un Excel (usado por la migración)"""
+        if not file_path or not os.path.exists(file_path):
+            return None
+        
+        try:
+            import pandas as pd
+            return ExcelManager.stats_from_frame(pd.read_excel(file_path, sheet_name='Estadisticas'))
+        except Exception as e:
+            logger.error(f"❌ Error leyendo Excel {file_path}: {e}")
+            return None
+    
+    @staticmethod
+    def stats_from_frame(df):
+        stats = {}
+        for _, row in df.iterrows():
+            stats[str(row['Atributo']).lower()] = int(row['Valor'])
+        # Formato antiguo: sin Resistencia, la defensa física hacía ese papel
+        if 'resistencia' not in stats and 'defensa_fisica' in stats:
+            stats['resistencia'] = stats['defensa_fisica']
+        return stats
+    
+    @staticmethod
+    def read_workbook(file_path):
+        """Nombre (hoja Info) y atributos base (hoja Estadisticas) de un libro, para la reconciliación"""
+        import pandas as pd
+        sheets = pd.read_excel(file_path, sheet_name=None)
+        if 'Estadisticas' not in sheets:
+            raise ValueError("sin hoja Estadisticas")
+        stats = ExcelManager.stats_from_frame(sheets['Estadisticas'])
+        info = {}
+        if 'Info' in sheets:
+            info = {str(row['Campo']): row['Valor'] for _, row in sheets['Info'].iterrows()}
+        return {'nombre': str(info['Nombre']) if 'Nombre' in info else None,
+                'stats': {attr: stats[attr] for attr in StatsManager.ATTRIBUTES if attr in stats}}
+    
+    @staticmethod
+    def write_character_excel(file_path, character_name, user_id, oro, stats):
+        import pandas as pd
+        with pd.ExcelWriter(file_path, engine='openpyxl') as writer:
+            df_stats = pd.DataFrame({
+                'Atributo': config.BASE_ATTRIBUTES,
+                'Valor': [stats[attr] for attr in StatsManager.ATTRIBUTES]
+            })
+            df_stats.to_excel(writer, sheet_name='Estadisticas', index=False)
+            
+            df_info = pd.DataFrame({
+                'Campo': ['Nombre', 'Usuario_ID', 'Oro'],
+                'Valor': [character_name, str(user_id), oro]
+            })
+            df_info.to_excel(writer, sheet_name='Info', index=False)
+    
+    @staticmethod
+    def export_characters(character_names=None):
+        """Exporta en lote los personajes activos (o los indicados) a Excel desde una sola consulta"""
+        query = f"""SELECT p.nombre, p.usuario_id, p.excel_path, p.oro,
+                           {', '.join('s.' + attr for attr in StatsManager.ATTRIBUTES)}
+                    FROM personajes p
+                    JOIN estadisticas_personajes s ON s.personaje_id = p.id"""
+        params = []
+        if character_names:
+            query += f" WHERE p.nombre IN ({', '.join('?' for _ in character_names)})"
+            params = list(character_names)
+        else:
+            query += " WHERE p.estado = 'activo'"
+        
+        with db.get_connection(readonly=True) as conn:
+            cursor = conn.cursor()
+            cursor.execute(query, params)
+            rows = cursor.fetchall()
+        
+        exported = []
+        for nombre, usuario_id, excel_path, oro, *values in rows:
+            file_path = excel_path or f"{config.EXCEL_DIR}/activos/{nombre}.xlsx"
+            try:
+                ExcelManager.write_character_excel(file_path, nombre, usuario_id, oro or 0,
+                                                   dict(zip(StatsManager.ATTRIBUTES, values)))
+                exported.append(nombre)
+            except Exception as e:
+                logger.error(f"❌ Error exportando Excel de {nombre}: {e}")
+        
+        logger.info(f"📤 {len(exported)} personajes exportados a Excel")
+        return exported
+
+excel_manager = ExcelManager()
+
+# ============= RESPALDO DE PERSONAJES =============
+def write_workbook(dest_path, sheets):
+    """Trabajador (proceso aparte): escribe un .xlsx con {hoja: (columnas, filas)}"""
+    import pandas as pd
+    
+    with pd.ExcelWriter(dest_path, engine='openpyxl') as writer:
+        for sheet_name, (columns, rows) in sheets.items():
+            pd.DataFrame(rows, columns=columns).to_excel(writer, sheet_name=sheet_name, index=False)
+    return os.path.getsize(dest_path)
+
+class RosterBackup:
+    """Respaldo completo del plantel en un zip: un libro por personaje de SQLite (stats, info,
+    inventario y equipo) más los libros ya archivados por /borrar_personaje.
+    
+    Los personajes se leen por páginas y los libros se escriben en un pool de procesos con un
+    número acotado de trabajos en vuelo; cada libro terminado entra al zip y se borra del disco,
+    así que la memoria no crece con el tamaño del plantel.
+    """
+    STATS_COLUMNS = ['Atributo', 'Valor', 'Bonus', 'Total']  # Atributo/Valor como lee read_excel_stats
+    ITEM_COLUMNS = ['Item', 'Tipo', 'Rareza', 'Slot', 'Cantidad', 'Equipado'] + config.BASE_ATTRIBUTES
+    
+    def __init__(self, backup_dir, workers, page_size):
+        self.backup_dir = backup_dir
+        self.workers = workers
+        self.page_size = page_size
+        self._running = threading.Lock()
+    
+    @staticmethod
+    def safe_filename(name):
+        return re.sub(r'[\\/:*?"<>|\x00-\x1f]', '_', name).strip(' .') or 'sin_nombre'
+    
+    def iter_characters(self):
+        """Páginas de (nombre, estado, {hoja: (columnas, filas)}) leídas por id creciente"""
+        attrs = StatsManager.ATTRIBUTES
+        effects = ', '.join(f"i.efecto_{attr}" for attr in InventorySystem.ATTRIBUTES)
+        last_id = 0
+        while True:
+            with db.get_connection(readonly=True) as conn:
+                cursor = conn.cursor()
+                cursor.execute(f"""SELECT p.id, p.nombre, p.usuario_id, p.oro, p.estado, p.descripcion, p.created_at,
+                                      {', '.join(f'COALESCE(s.{attr}, 10)' for attr in attrs)},
+                                      {', '.join(f'COALESCE(b.{attr}, 0)' for attr in attrs)}
+                               FROM personajes p
+                               LEFT JOIN estadisticas_personajes s ON s.personaje_id = p.id
+                               LEFT JOIN bonos_equipados b ON b.personaje_id = p.id
+                               WHERE p.id > ? ORDER BY p.id LIMIT ?""", (last_id, self.page_size))
+                characters = cursor.fetchall()
+                if not characters:
+                    return
+                ids = [row[0] for row in characters]
+                cursor.execute(f"""SELECT inv.personaje_id, i.nombre, i.tipo, i.rareza, i.slot_equipo, inv.cantidad,
+                                      inv.equipado, {effects}
+                               FROM inventarios inv JOIN items i ON i.id = inv.item_id
+                               WHERE inv.personaje_id IN ({', '.join('?' * len(ids))})
+                               ORDER BY inv.personaje_id, i.nombre""", ids)
+                inventories = {}
+                for personaje_id, *item in cursor.fetchall():
+                    item[5] = 'Sí' if item[5] else 'No'
+                    inventories.setdefault(personaje_id, []).append(item)
+            
+            page = []
+            for personaje_id, nombre, usuario_id, oro, estado, descripcion, created_at, *values in characters:
+                base, bonus = values[:len(attrs)], values[len(attrs):]
+                items = inventories.get(personaje_id, [])
+                page.append((nombre, estado or 'activo', {
+                    'Estadisticas': (self.STATS_COLUMNS, [[label, b, x, b + x] for label, b, x
+                                                          in zip(config.BASE_ATTRIBUTES, base, bonus)]),
+                    'Info': (['Campo', 'Valor'], [['Nombre', nombre], ['Usuario_ID', str(usuario_id)],
+                                                  ['Oro', oro or 0], ['Estado', estado],
+                                                  ['Descripcion', descripcion or ''], ['Creado', created_at]]),
+                    'Inventario': (self.ITEM_COLUMNS, items),
+                    'Equipado': (self.ITEM_COLUMNS, [item for item in items if item[5] == 'Sí']),
+                }))
+            yield page
+            last_id = ids[-1]
+    
+    def archived_files(self):
+        folder = f"{config.EXCEL_DIR}/archivados"
+        return sorted(glob.glob(os.path.join(folder, '*.xlsx')))
+    
+    def run(self, dest_path=None, workers=None):
+        """Escribe el zip y retorna el informe; falla si ya hay un respaldo en curso"""
+        if not self._running.acquire(blocking=False):
+            raise RuntimeError("ya hay un respaldo en curso")
+        try:
+            return self._run(dest_path, workers or self.workers)
+        finally:
+            self._running.release()
+    
+    def _run(self, dest_path, workers):
+        started = time.perf_counter()
+        dest_path = dest_path or os.path.join(
+            self.backup_dir, f"personajes_{datetime.now().strftime('%Y%m%d_%H%M%S')}.zip")
+        work_dir = tempfile.mkdtemp(prefix='respaldo_', dir=self.backup_dir)
+        report = {'personajes': 0, 'archivados': 0, 'errores': [], 'archivo': dest_path}
+        max_in_flight = workers * 2
+        
+        try:
+            with zipfile.ZipFile(f"{dest_path}.part", 'w', compression=zipfile.ZIP_DEFLATED) as archive, \
+                    ProcessPoolExecutor(max_workers=workers) as pool:
+                in_flight = {}  # future -> (nombre, ruta temporal, nombre dentro del zip)
+                used_names = set()
+                
+                def collect(done):
+                    for future in done:
+                        nombre, temp_path, arcname = in_flight.pop(future)
+                        try:
+                            future.result()
+                            archive.write(temp_path, arcname)
+                            report['personajes'] += 1
+                        except Exception as e:
+                            report['errores'].append(f"{nombre}: {e}")
+                            logger.error(f"❌ Error respaldando {nombre}: {e}")
+                        finally:
+                            if os.path.exists(temp_path):
+                                os.remove(temp_path)
+                
+                for page in self.iter_characters():
+                    for nombre, estado, sheets in page:
+                        filename = self.safe_filename(nombre)
+                        arcname = f"{'activos' if estado == 'activo' else self.safe_filename(estado)}/{filename}.xlsx"
+                        if arcname in used_names:  # dos nombres que se sanean igual
+                            arcname = arcname.replace('.xlsx', f"_{len(used_names)}.xlsx")
+                        used_names.add(arcname)
+                        temp_path = os.path.join(work_dir, f"{len(used_names)}.xlsx")
+                        in_flight[pool.submit(write_workbook, temp_path, sheets)] = (nombre, temp_path, arcname)
+                        if len(in_flight) >= max_in_flight:
+                            done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                            collect(done)
+                while in_flight:
+                    done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                    collect(done)
+                
+                for path in self.archived_files():
+                    archive.write(path, f"archivados/{os.path.basename(path)}")
+                    report['archivados'] += 1
+                
+                report['segundos'] = round(time.perf_counter() - started, 2)
+                archive.writestr('manifiesto.json', json.dumps(
+                    dict(report, creado=datetime.now(timezone.utc).isoformat(timespec='seconds')),
+                    ensure_ascii=False, indent=2))
+            os.replace(f"{dest_path}.part", dest_path)
+        finally:
+            shutil.rmtree(work_dir, ignore_errors=True)
+            if os.path.exists(f"{dest_path}.part"):
+                os.remove(f"{dest_path}.part")
+        
+        report['bytes'] = os.path.getsize(dest_path)
+        logger.info(f"🗄️ Respaldo {dest_path}: {report['personajes']} personajes, {report['archivados']} archivados, "
+                    f"{len(report['errores'])} errores en {report['segundos']}s ({workers} procesos)")
+        return report
+
+roster_backup = RosterBackup(config.BACKUP_DIR, config.BACKUP_WORKERS, config.BACKUP_PAGE_SIZE)
+
+# ============= RECONCILIACIÓN DE DATOS =============
+class DataReconciler:
+    """Cruza los Excel de personajes, las filas de SQLite y el almacén de imágenes.
+    
+    Cada archivo se recuerda en manifiesto_archivos por (mtime, tamaño) -> sha256 y datos leídos:
+    sólo se vuelven a hashear y leer los que cambiaron desde la pasada anterior. Reporta huérfanos,
+    nombres duplicados tras normalizar y desajustes; con reparar aplica los arreglos de SQLite en
+    una sola transacción y después regenera o archiva los Excel afectados.
+    """
+    KNOWN_DATABASES = ('unity_master.db',)
+    
+    def __init__(self, full=False):
+        self.full = full  # ignora el manifiesto y vuelve a leer todo
+        self.counters = {'reutilizados': 0, 'analizados': 0}
+    
+    @staticmethod
+    def _key(path):
+        return unicodedata.normalize('NFC', os.path.normpath(path))
+    
+    def scan(self, paths, parse=None):
+        """{ruta: (sha256, datos)} usando el manifiesto; guarda lo nuevo y olvida lo que ya no existe"""
+        keys = {self._key(path): path for path in paths}
+        with db.get_connection(readonly=True) as conn:
+            manifest = {row[0]: row[1:] for row in conn.execute(
+                "SELECT ruta, mtime_ns, tamano, sha256, datos FROM manifiesto_archivos")}
+        
+        results, changed = {}, []
+        for key, path in keys.items():
+            stat = os.stat(path)
+            cached = manifest.get(key)
+            if not self.full and cached and cached[0] == stat.st_mtime_ns and cached[1] == stat.st_size:
+                results[path] = (cached[2], json.loads(cached[3]) if cached[3] else None)
+                self.counters['reutilizados'] += 1
+                continue
+            checksum = ImageHandler._hash_file(path)
+            if not self.full and cached and cached[2] == checksum:
+                data = json.loads(cached[3]) if cached[3] else None  # sólo cambió el mtime
+            else:
+                try:
+                    data = parse(path) if parse else None
+                except Exception as e:
+                    data = {'error': str(e)}
+                self.counters['analizados'] += 1
+            results[path] = (checksum, data)
+            changed.append((key, stat.st_mtime_ns, stat.st_size, checksum,
+                            json.dumps(data, ensure_ascii=False) if data is not None else None))
+        
+        roots = {os.path.dirname(key) for key in keys}
+        stale = [(key,) for key in manifest if key not in keys and os.path.dirname(key) in roots]
+        with db.get_connection() as conn:
+            conn.executemany("""INSERT INTO manifiesto_archivos (ruta, mtime_ns, tamano, sha256, datos)
+                             VALUES (?, ?, ?, ?, ?)
+                             ON CONFLICT(ruta) DO UPDATE SET mtime_ns = excluded.mtime_ns, tamano = excluded.tamano,
+                             sha256 = excluded.sha256, datos = excluded.datos, updated_at = CURRENT_TIMESTAMP""",
+                             changed)
+            conn.executemany("DELETE FROM manifiesto_archivos WHERE ruta = ?", stale)
+            conn.commit()
+        return results
+    
+    @staticmethod
+    def _files(directory, pattern='*'):
+        return sorted(path for path in glob.glob(os.path.join(directory, pattern)) if os.path.isfile(path))
+    
+    @staticmethod
+    def duplicate_groups(names):
+        groups = {}
+        for name in names:
+            groups.setdefault(NameIndex.normalize(name), []).append(name)
+        return [sorted(group) for group in groups.values() if len(group) > 1]
+    
+    def check_excel(self, characters, report):
+        active_dir, archived_dir = f"{config.EXCEL_DIR}/activos", f"{config.EXCEL_DIR}/archivados"
+        active = self.scan(self._files(active_dir, '*.xlsx'), ExcelManager.read_workbook)
+        archived = self.scan(self._files(archived_dir, '*.xlsx'), ExcelManager.read_workbook)
+        by_path = {self._key(path): path for path in active}
+        active_names = {NameIndex.normalize(nombre) for _, nombre, *_ in characters}
+        
+        excel = report['excel']
+        claimed = set()
+        for personaje_id, nombre, excel_path, estado, stats in characters:
+            path = by_path.get(self._key(excel_path)) if excel_path else None
+            data = (active[path][1] or {}) if path else {}
+            if not stats:
+                # Sin fila de stats: se completa desde el Excel si se puede leer, o con valores base
+                excel['sin_estadisticas'].append({'personaje': nombre, 'id': personaje_id,
+                                                  'stats': data.get('stats') or {}})
+            if path is None:
+                if estado == 'activo':
+                    excel['faltantes'].append(nombre)
+                continue
+            claimed.add(path)
+            if 'error' in data:
+                excel['ilegibles'].append({'archivo': path, 'error': data['error']})
+                continue
+            if data.get('nombre') and data['nombre'] != nombre:
+                excel['desajustes'].append({'personaje': nombre, 'campo': 'nombre',
+                                            'excel': data['nombre'], 'sqlite': nombre})
+            for attr, value in (data.get('stats') or {}).items():
+                if attr in stats and stats[attr] != value:
+                    excel['desajustes'].append({'personaje': nombre, 'campo': attr, 'excel': value, 'sqlite': stats[attr]})
+        
+        for path, (_, data) in active.items():
+            if path not in claimed:
+                excel['huerfanos'].append(path)
+                if data and 'error' in data:
+                    excel['ilegibles'].append({'archivo': path, 'error': data['error']})
+        for path in archived:
+            stem = os.path.splitext(os.path.basename(path))[0]
+            if NameIndex.normalize(stem) in active_names:
+                excel['archivados_con_activo'].append(path)
+        
+        stems = [os.path.splitext(os.path.basename(path))[0] for path in active]
+        report['duplicados']['excel'] = self.duplicate_groups(stems)
+    
+    def check_images(self, report):
+        images = report['imagenes']
+        store_files = [os.path.join(root, filename)
+                       for root, dirs, files in os.walk(image_handler.store_dir)
+                       if not self._key(root).startswith(self._key(image_handler.thumbs_dir))
+                       and self._key(root) != self._key(image_handler.tmp_dir)
+                       for filename in files]
+        store = self.scan(store_files)
+        with db.get_connection(readonly=True) as conn:
+            rows = conn.execute("SELECT hash, ruta FROM imagenes").fetchall()
+            references = conn.execute(" UNION ALL ".join(
+                f"SELECT '{table}', nombre, imagen_hash FROM {table} WHERE imagen_hash IS NOT NULL"
+                for table in ImageHandler.ENTITY_TABLES)).fetchall()
+        
+        known_paths = {self._key(ruta) for _, ruta in rows}
+        known_hashes = {image_hash for image_hash, _ in rows}
+        for image_hash, ruta in rows:
+            if not os.path.exists(ruta):
+                images['filas_sin_archivo'].append(image_hash)
+        for path, (checksum, _) in store.items():
+            if self._key(path) not in known_paths:
+                images['archivos_sin_fila'].append(path)
+            elif not os.path.basename(path).startswith(checksum):
+                images['checksum_incorrecto'].append(path)
+        for table, nombre, image_hash in references:
+            if image_hash not in known_hashes:
+                images['referencias_rotas'].append({'tabla': table, 'nombre': nombre, 'hash': image_hash})
+        
+        store_hashes = {checksum for checksum, _ in store.values()}
+        legacy = [path for directory in ImageHandler.LEGACY_DIRS.values() for path in self._files(directory)]
+        images['sin_importar'] = sum(1 for checksum, _ in self.scan(legacy).values() if checksum not in store_hashes)
+    
+    def check_databases(self, report):
+        """Bases .db sobrantes junto a la principal (p. ej. unity_advanced.db de versiones viejas)"""
+        with db.get_connection(readonly=True) as conn:
+            current = {NameIndex.normalize(row[0]) for row in conn.execute("SELECT nombre FROM personajes")}
+        for path in self._files(config.DATA_DIR, '*.db'):
+            if os.path.basename(path) in self.KNOWN_DATABASES or self._key(path) == self._key(config.DB_PATH):
+                continue
+            entry = {'archivo': path, 'tablas': {}, 'personajes_ausentes': []}
+            try:
+                with closing(sqlite3.connect(f"file:{path}?mode=ro", uri=True)) as legacy:
+                    tables = [row[0] for row in legacy.execute(
+                        "SELECT name FROM sqlite_master WHERE type = 'table' AND name NOT LIKE 'sqlite_%'")]
+                    for table in tables:
+                        entry['tablas'][table] = legacy.execute(f'SELECT COUNT(*) FROM "{table}"').fetchone()[0]
+                    if 'personajes' in tables:
+                        entry['personajes_ausentes'] = sorted(
+                            row[0] for row in legacy.execute("SELECT nombre FROM personajes")
+                            if NameIndex.normalize(row[0]) not in current)
+            except sqlite3.Error as e:
+                entry['error'] = str(e)
+            report['bases_sobrantes'].append(entry)
+    
+    def run(self, repair=False):
+        report = {
+            'excel': {'huerfanos': [], 'faltantes': [], 'desajustes': [], 'sin_estadisticas': [],
+                      'archivados_con_activo': [], 'ilegibles': []},
+            'duplicados': {},
+            'imagenes': {'filas_sin_archivo': [], 'archivos_sin_fila': [], 'checksum_incorrecto': [],
+                         'referencias_rotas': [], 'sin_importar': 0},
+            'bases_sobrantes': [],
+        }
+        with db.get_connection(readonly=True) as conn:
+            cursor = conn.cursor()
+            cursor.execute(f"""SELECT p.id, p.nombre, p.excel_path, p.estado,
+                                     {', '.join('s.' + attr for attr in StatsManager.ATTRIBUTES)}
+                             FROM personajes p LEFT JOIN estadisticas_personajes s ON s.personaje_id = p.id""")
+            characters = [(personaje_id, nombre, excel_path, estado,
+                           dict(zip(StatsManager.ATTRIBUTES, values)) if values[0] is not None else {})
+                          for personaje_id, nombre, excel_path, estado, *values in cursor.fetchall()]
+            for table in NameIndex.TABLES:
+                names = [row[0] for row in cursor.execute(f"SELECT nombre FROM {table}")]
+                report['duplicados'][table] = self.duplicate_groups(names)
+        
+        self.check_excel(characters, report)
+        self.check_images(report)
+        self.check_databases(report)
+        report['manifiesto'] = dict(self.counters)
+        if repair:
+            report['reparado'] = self.repair(report)
+        return report
+    
+    def repair(self, report):
+        """Arreglos de SQLite en una transacción; luego regenera los Excel desde SQLite y archiva los huérfanos.
+        Duplicados, bases sobrantes y archivos del almacén quedan para revisión manual o limpiar_imagenes."""
+        images = report['imagenes']
+        missing = images['filas_sin_archivo']
+        broken = [(ref['hash'],) for ref in images['referencias_rotas']]
+        excel = report['excel']
+        done = {'filas_imagen_borradas': len(missing), 'referencias_limpiadas': 0,
+                'estadisticas_creadas': len(excel['sin_estadisticas']), 'excel_regenerados': 0, 'excel_archivados': 0}
+        
+        with db.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.executemany(f"""INSERT OR IGNORE INTO estadisticas_personajes
+                               (personaje_id, {', '.join(StatsManager.ATTRIBUTES)}) VALUES (?, ?, ?, ?, ?, ?, ?)""",
+                               [(entry['id'], *[entry['stats'].get(attr, 10) for attr in StatsManager.ATTRIBUTES])
+                                for entry in excel['sin_estadisticas']])
+            cursor.executemany("DELETE FROM imagenes WHERE hash = ?", [(image_hash,) for image_hash in missing])
+            for table in ImageHandler.ENTITY_TABLES:
+                cursor.executemany(f"UPDATE {table} SET imagen_hash = NULL WHERE imagen_hash = ?",
+                                   broken + [(image_hash,) for image_hash in missing])
+                done['referencias_limpiadas'] += max(cursor.rowcount, 0)
+            conn.commit()
+        for entry in excel['sin_estadisticas']:
+            stat_cache.invalidate(entry['personaje'])
+            embed_cache.bump('personaje', entry['personaje'])
+        
+        to_export = sorted(set(excel['faltantes']) | {entry['personaje'] for entry in excel['desajustes']})
+        if to_export:
+            done['excel_regenerados'] = len(ExcelManager.export_characters(to_export))
+        
+        archived_dir = f"{config.EXCEL_DIR}/archivados"
+        for path in excel['huerfanos']:
+            target = os.path.join(archived_dir, os.path.basename(path))
+            if os.path.exists(target):
+                stem, ext = os.path.splitext(target)
+                target = f"{stem}_{datetime.now().strftime('%Y%m%d%H%M%S')}{ext}"
+            shutil.move(path, target)
+            done['excel_archivados'] += 1
+        
+        logger.info(f"🛠️ Reconciliación reparada: {done}")
+        return done
+
+# ============= INVENTORY SYSTEM =============
 class InventorySystem:
+    ATTRIBUTES = ['fuerza', 'destreza', 'velocidad', 'resistencia', 'inteligencia', 'mana']
+    
     @staticmethod
     def calculate_equipped_bonuses(character_name):
-        bonuses = {attr: 0 for attr in ['fuerza', 'destreza', 'velocidad', 'resistencia', 'inteligencia', 'mana']}
+        """Lee el vector de bonos materializado (una fila) en lugar de sumar items en cada tirada"""
+        bonuses = {attr: 0 for attr in InventorySystem.ATTRIBUTES}
         try:
-            with db.get_connection() as conn:
+            with db.get_connection(readonly=True) as conn:
                 cursor = conn.cursor()
-                cursor.execute("""
-                    SELECT i.efecto_fuerza, i.efecto_destreza, i.efecto_velocidad,
-                           i.efecto_resistencia, i.efecto_inteligencia, i.efecto_mana
-                    FROM inventarios inv
-                    JOIN items i ON inv.item_id = i.id
-                    JOIN personajes p ON inv.personaje_id = p.id
-                    WHERE p.nombre = ? AND inv.equipado = TRUE
-                """, (character_name,))
+                cursor.execute(SQL_EQUIPPED_BONUSES, (character_name,))
+                row = cursor.fetchone()
                 
-                for row in cursor.fetchall():
-                    attrs = ['fuerza', 'destreza', 'velocidad', 'resistencia', 'inteligencia', 'mana']
-                    for i, attr in enumerate(attrs):
-                        bonuses[attr] += row[i] or 0
+                if row:
+                    for attr, value in zip(InventorySystem.ATTRIBUTES, row):
+                        bonuses[attr] = value or 0
         except Exception as e:
             logger.error(f"❌ Error calculando bonuses: {e}")
         return bonuses
+    
+    @staticmethod
+    def calculate_many_equipped_bonuses(character_names):
+        """Bonos materializados de varios personajes en una sola consulta IN"""
+        names = list(dict.fromkeys(character_names))
+        bonuses = {name: {attr: 0 for attr in InventorySystem.ATTRIBUTES} for name in names}
+        if not names:
+            return bonuses
+        try:
+            with db.get_connection(readonly=True) as conn:
+                cursor = conn.cursor()
+                cursor.execute(SQL_EQUIPPED_BONUSES_MANY.format(placeholders=', '.join('?' * len(names))), names)
+                for row in cursor.fetchall():
+                    bonuses[row[0]] = {attr: value or 0 for attr, value in zip(InventorySystem.ATTRIBUTES, row[1:])}
+        except Exception as e:
+            logger.error(f"❌ Error calculando bonuses en lote: {e}")
+        return bonuses
+    
+    @staticmethod
+    def apply_equip_delta(cursor, personaje_id, item_id, sign):
+        """Actualiza el total materializado al equipar (+1) o desequipar (-1) un item"""
+        cursor.execute(SQL_APPLY_ITEM_BONUS, (personaje_id, *[sign] * len(InventorySystem.ATTRIBUTES), item_id))
+    
+    @staticmethod
+    def recompute_bonuses(cursor, personaje_ids):
+        """Recalcula desde cero los totales de los personajes indicados"""
+        for personaje_id in personaje_ids:
+            cursor.execute("DELETE FROM bonos_equipados WHERE personaje_id = ?", (personaje_id,))
+            cursor.execute(f"""INSERT INTO bonos_equipados
+                            (personaje_id, fuerza, destreza, velocidad, resistencia, inteligencia, mana)
+                            {SQL_RECOMPUTE_BONUSES} AND inv.personaje_id = ? GROUP BY inv.personaje_id""",
+                         (personaje_id,))
+    
+    @staticmethod
+    def refresh_item_holders(cursor, item_id):
+        """Tras cambiar los efectos de un item, recalcula a quienes lo tienen equipado"""
+        cursor.execute("SELECT DISTINCT personaje_id FROM inventarios WHERE item_id = ? AND equipado = TRUE", (item_id,))
+        InventorySystem.recompute_bonuses(cursor, [row[0] for row in cursor.fetchall()])
+    
+    @staticmethod
+    def check_bonus_consistency(repair=False):
+        """Compara los totales materializados con un recálculo completo y reporta (o corrige) la deriva"""
+        with db.get_connection(readonly=not repair) as conn:
+            cursor = conn.cursor()
+            cursor.execute(SQL_RECOMPUTE_BONUSES + " GROUP BY inv.personaje_id")
+            expected = {row[0]: list(row[1:]) for row in cursor.fetchall()}
+            cursor.execute(f"SELECT personaje_id, {', '.join(InventorySystem.ATTRIBUTES)} FROM bonos_equipados")
+            stored = {row[0]: list(row[1:]) for row in cursor.fetchall()}
+            
+            zero = [0] * len(InventorySystem.ATTRIBUTES)
+            drift = {}
+            for personaje_id in set(expected) | set(stored):
+                esperado = expected.get(personaje_id, zero)
+                actual = stored.get(personaje_id, zero)
+                if esperado != actual:
+                    drift[personaje_id] = {'esperado': dict(zip(InventorySystem.ATTRIBUTES, esperado)),
+                                           'materializado': dict(zip(InventorySystem.ATTRIBUTES, actual))}
+            
+            if drift and repair:
+                InventorySystem.recompute_bonuses(cursor, list(drift))
+                conn.commit()
+        
+        if drift:
+            logger.warning(f"⚠️ Bonos materializados con deriva en {len(drift)} personajes"
+                           f"{' (reparados)' if repair else ''}")
+        return drift
 
 inventory_system = InventorySystem()
 
 # ============= DICE SYSTEM MEJORADO =============
+class DiceEngine:
+    """Dados con NumPy: un generador con semilla por sesión (canal) y distribuciones exactas
+    
+    NumPy se importa en la primera tirada, como pandas, para no pagarlo al arrancar.
+    """
+    def __init__(self, seed=None):
+        self._seed = seed
+        self._seed_sequence = None
+        self._generators = {}  # sesión -> np.random.Generator
+        self._lock = threading.Lock()  # Generator no es thread-safe y las tiradas corren en el executor
+    
+    def _generator(self, session):
+        generator = self._generators.get(session)
+        if generator is None:
+            import numpy as np
+            if self._seed_sequence is None:
+                self._seed_sequence = np.random.SeedSequence(self._seed)
+            # Flujo independiente por canal, reproducible a partir de la semilla global y el id del canal
+            generator = np.random.default_rng(
+                np.random.SeedSequence(self._seed_sequence.entropy, spawn_key=(int(session or 0),)))
+            self._generators[session] = generator
+        return generator
+    
+    def roll(self, dice_count, dice_type, session=None):
+        with self._lock:
+            return self._generator(session).integers(1, dice_type, size=dice_count, endpoint=True)
+    
+    def roll_many(self, specs, session=None):
+        """Tira todos los dados de [(cantidad, caras)] en una sola llamada y los reparte por tirada"""
+        import numpy as np
+        counts = np.array([dice_count for dice_count, _ in specs], dtype=np.int64)
+        sides = np.repeat(np.array([dice_type for _, dice_type in specs], dtype=np.int64), counts)
+        with self._lock:
+            pool = self._generator(session).integers(1, sides, endpoint=True) if sides.size else sides
+        return np.split(pool, np.cumsum(counts)[:-1]) if specs else []
+    
+    @staticmethod
+    @functools.lru_cache(maxsize=None)
+    def sum_counts(dice_count, dice_type):
+        """Número exacto de combinaciones para cada suma de XdY (índice 0 = suma X); memoizado por (X, Y)"""
+        import numpy as np
+        counts = np.ones(1, dtype=np.int64)
+        face = np.ones(dice_type, dtype=np.int64)
+        for _ in range(dice_count):
+            counts = np.convolve(counts, face)
+        counts.setflags(write=False)
+        return counts
+    
+    @staticmethod
+    def distribution(dice_count, dice_type, modifier=0):
+        """{total: probabilidad} exacta de XdY + modificador"""
+        counts = DiceEngine.sum_counts(dice_count, dice_type)
+        outcomes = dice_type ** dice_count
+        return {dice_count + modifier + i: int(c) / outcomes for i, c in enumerate(counts)}
+    
+    @staticmethod
+    def probability_at_least(dice_count, dice_type, modifier, target):
+        """P(XdY + modificador >= objetivo), calculada con enteros exactos"""
+        counts = DiceEngine.sum_counts(dice_count, dice_type)
+        first = min(max(target - modifier - dice_count, 0), len(counts))
+        return int(counts[first:].sum()) / dice_type ** dice_count
+    
+    @staticmethod
+    def summary(dice_count, dice_type, modifier=0):
+        """Media, mínimo, máximo y probabilidad de crítico (algún dado máximo) y pifia (algún 1)"""
+        miss_one_face = ((dice_type - 1) / dice_type) ** dice_count
+        return {
+            'mean': dice_count * (dice_type + 1) / 2 + modifier,
+            'min': dice_count + modifier,
+            'max': dice_count * dice_type + modifier,
+            'critical': 1 - miss_one_face,
+            'fumble': 1 - miss_one_face
+        }
+
+dice_engine = DiceEngine(config.DICE_SEED)
+
 class DiceSystem:
+    # Acción de personaje -> atributo que suma
+    ACTION_MAPPING = {
+        'ataque_fisico': 'fuerza',
+        'ataque_magico': 'mana', 
+        'ataque_distancia': 'destreza',
+        'defensa_fisica': 'resistencia',
+        'defensa_magica': 'destreza',
+        'defensa_esquive': 'velocidad'
+    }
+    
+    # Acción de NPC -> columna de npcs con su valor fijo
+    NPC_ACTION_MAPPING = {
+        'fisico': 'ataq_fisic',
+        'distancia': 'ataq_dist', 
+        'magico': 'ataq_magic',
+        'defensa_fisica': 'res_fisica',
+        'defensa_magica': 'res_magica',
+        'esquivar': 'velocidad'
+    }
+    NPC_COLUMNS = ['ataq_fisic', 'ataq_dist', 'ataq_magic', 'res_fisica', 'res_magica', 'velocidad',
+                   'sincronizado', 'cantidad', 'imagen_url', 'imagen_hash']
+    
     @staticmethod
-    def roll_multiple_dice(dice_count, dice_type):
+    def roll_multiple_dice(dice_count, dice_type, session=None):
         """Tira múltiples dados del mismo tipo"""
-        rolls = [random.randint(1, dice_type) for _ in range(dice_count)]
+        rolls = dice_engine.roll(dice_count, dice_type, session).tolist()
         return {'rolls': rolls, 'total': sum(rolls)}
     
     @staticmethod
-    def roll_action(character_name, action_type, dice_count=1, dice_type=20, bonificador=0):
-        base_stats = excel_manager.read_character_stats(character_name)
-        if not base_stats:
+    def roll_dice_batch(specs, session=None):
+        """Tira todos los dados de varias tiradas [(cantidad, caras)] en una sola llamada"""
+        return [{'rolls': rolls.tolist(), 'total': int(rolls.sum())}
+                for rolls in dice_engine.roll_many(specs, session)]
+    
+    @staticmethod
+    def combine_stats(base_stats, item_bonuses):
+        return {attr: {'base': base_stats[attr]['base'],
+                       'bonus': item_bonuses.get(attr, 0),
+                       'total': base_stats[attr]['base'] + item_bonuses.get(attr, 0)}
+                for attr in base_stats}
+    
+    @staticmethod
+    def resolve_action(character_name, action_type, combined_stats, dice_result, dice_type, bonificador=0,
+                       session=None):
+        """Aplica atributo, bonificador, críticos y pifias a dados ya tirados (sin E/S)"""
+        if action_type not in DiceSystem.ACTION_MAPPING:
             return None
         
-        item_bonuses = inventory_system.calculate_equipped_bonuses(character_name)
-        
-        combined_stats = {}
-        for attr in base_stats:
-            combined_stats[attr] = {
-                'base': base_stats[attr]['base'],
-                'bonus': item_bonuses.get(attr, 0),
-                'total': base_stats[attr]['base'] + item_bonuses.get(attr, 0)
-            }
-        
-        # Tirar dados múltiples
-        dice_result = DiceSystem.roll_multiple_dice(dice_count, dice_type)
         dice_total = dice_result['total']
-        
-        # Mapeo de acciones a atributos
-        action_mapping = {
-            'ataque_fisico': 'fuerza',
-            'ataque_magico': 'mana', 
-            'ataque_distancia': 'destreza',
-            'defensa_fisica': 'resistencia',
-            'defensa_magica': 'destreza',
-            'defensa_esquive': 'velocidad'
-        }
-        
-        if action_type not in action_mapping:
-            return None
-            
-        attr_key = action_mapping[action_type]
+        dice_count = len(dice_result['rolls'])
+        attr_key = DiceSystem.ACTION_MAPPING[action_type]
         attr_value = combined_stats[attr_key]['total']
         total = dice_total + attr_value + bonificador
         
@@ -406,7 +2328,17 @@ class DiceSystem:
         is_critical = any(roll == dice_type for roll in dice_result['rolls'])
         is_fumble = any(roll == 1 for roll in dice_result['rolls'])
         
-        logger.info(f"[DADOS] {character_name} - {action_type}: {dice_count}d{dice_type}({dice_result['rolls']}) + {attr_key.title()}({attr_value}) + Bonus({bonificador}) = {total}")
+        roll_logger.info(
+            f"[DADOS] {character_name} - {action_type}: {dice_count}d{dice_type}({dice_result['rolls']}) + {attr_key.title()}({attr_value}) + Bonus({bonificador}) = {total}",
+            extra={'data': {'personaje': character_name, 'accion': action_type, 'cantidad': dice_count,
+                            'caras': dice_type, 'dados': dice_result['rolls'], 'atributo': attr_key,
+                            'valor_atributo': attr_value, 'bonificador': bonificador, 'total': total,
+                            'critico': is_critical, 'pifia': is_fumble}}
+        )
+        roll_history.record('personaje', character_name, action_type, total, session,
+                            dice_count=dice_count, dice_type=dice_type, dice=dice_result['rolls'],
+                            attribute=attr_key, attribute_value=attr_value, bonificador=bonificador,
+                            critical=is_critical, fumble=is_fumble)
         
         return {
             'dice_rolls': dice_result['rolls'], 
@@ -423,65 +2355,1591 @@ class DiceSystem:
         }
     
     @staticmethod
-    def npc_action(npc_name, action_type):
-        """Acción de NPC (ataque o defensa) con stats fijas"""
+    def action_attribute(character_name, action_type):
+        """(nombre del atributo, total base + bonos) que suma la acción, o None"""
+        base_stats = stats_manager.read_character_stats(character_name)
+        if not base_stats or action_type not in DiceSystem.ACTION_MAPPING:
+            return None
+        
+        item_bonuses = inventory_system.calculate_equipped_bonuses(character_name)
+        attr_key = DiceSystem.ACTION_MAPPING[action_type]
+        return attr_key.title(), DiceSystem.combine_stats(base_stats, item_bonuses)[attr_key]['total']
+    
+    @staticmethod
+    def roll_action(character_name, action_type, dice_count=1, dice_type=20, bonificador=0, session=None):
+        base_stats = stats_manager.read_character_stats(character_name)
+        if not base_stats or action_type not in DiceSystem.ACTION_MAPPING:
+            return None
+        
+        item_bonuses = inventory_system.calculate_equipped_bonuses(character_name)
+        combined_stats = DiceSystem.combine_stats(base_stats, item_bonuses)
+        dice_result = DiceSystem.roll_multiple_dice(dice_count, dice_type, session)
+        return DiceSystem.resolve_action(character_name, action_type, combined_stats, dice_result,
+                                         dice_type, bonificador, session)
+    
+    @staticmethod
+    def npc_action_value(npc, action_type):
+        """(valor base, valor efectivo) de una acción de NPC; sincronizado multiplica por cantidad"""
+        base_value = npc[DiceSystem.NPC_ACTION_MAPPING[action_type]]
+        return base_value, base_value * npc['cantidad'] if npc['sincronizado'] else base_value
+    
+    @staticmethod
+    def resolve_npc_action(npc_name, action_type, npc_row, session=None):
+        """Valor fijo de la acción de un NPC a partir de su fila (columnas NPC_COLUMNS)"""
+        if action_type not in DiceSystem.NPC_ACTION_MAPPING:
+            return None
+        
+        npc = dict(zip(DiceSystem.NPC_COLUMNS, npc_row))
+        base_value, total_value = DiceSystem.npc_action_value(npc, action_type)
+        sincronizado, cantidad = npc['sincronizado'], npc['cantidad']
+        
+        if sincronizado:
+            action_description = f"{cantidad} {npc_name}s sincronizados"
+        else:
+            action_description = f"{npc_name}"
+        
+        # Determinar si es ataque o defensa
+        is_attack = action_type in ['fisico', 'distancia', 'magico']
+        action_category = "ataque" if is_attack else "defensa"
+        
+        combat_logger.info(
+            f"[NPC {action_category.upper()}] {action_description} - {action_type}: {total_value}",
+            extra={'data': {'npc': npc_name, 'accion': action_type, 'categoria': action_category,
+                            'valor_base': base_value, 'total': total_value,
+                            'sincronizado': bool(sincronizado), 'cantidad': cantidad}}
+        )
+        roll_history.record('npc', npc_name, action_type, total_value, session)
+        
+        return {
+            'npc_name': npc_name,
+            'action_type': action_type,
+            'action_category': action_category,
+            'base_value': base_value,
+            'total_value': total_value,
+            'sincronizado': sincronizado,
+            'cantidad': cantidad,
+            'action_description': action_description,
+            'imagen_url': npc['imagen_url'],
+            'imagen_hash': npc['imagen_hash']
+        }
+    
+    @staticmethod
+    def npc_action(npc_name, action_type, session=None):
+        """Acción de NPC (ataque o defensa) con stats fijas"""
+        try:
+            with db.get_connection(readonly=True) as conn:
+                cursor = conn.cursor()
+                cursor.execute(f"SELECT {', '.join(DiceSystem.NPC_COLUMNS)} FROM npcs WHERE nombre = ?", (npc_name,))
+                result = cursor.fetchone()
+            
+            if not result:
+                return None
+            return DiceSystem.resolve_npc_action(npc_name, action_type, result, session)
+        except Exception as e:
+            logger.error(f"❌ Error en acción NPC: {e}")
+            return None
+    
+    @staticmethod
+    def parse_dice(text):
+        """'2d6' -> (2, 6); 'd20' -> (1, 20). ValueError si no es NdM o se sale de los límites"""
+        count_text, _, type_text = text.strip().lower().partition('d')
+        if not type_text.isdigit() or (count_text and not count_text.isdigit()):
+            raise ValueError(f"Dados inválidos `{text}` (usa NdM, p. ej. 2d6)")
+        dice_count, dice_type = int(count_text or 1), int(type_text)
+        DiceSystem.check_dice(dice_count, dice_type)
+        return dice_count, dice_type
+    
+    @staticmethod
+    def check_dice(dice_count, dice_type):
+        if dice_type not in config.DICE_TYPES:
+            raise ValueError(f"d{dice_type} no es válido. Usa: {', '.join(map(str, config.DICE_TYPES))}")
+        if not 1 <= dice_count <= config.MAX_DICE_COUNT:
+            raise ValueError(f"Cantidad de dados debe ser entre 1 y {config.MAX_DICE_COUNT}")
+    
+    @staticmethod
+    def parse_group_actions(text, default_count, default_type):
+        """'Finn:ataque_fisico, Goblin:fisico:2d6' -> [(nombre, acción, cantidad, caras)]"""
+        entries = []
+        for chunk in text.replace(';', ',').replace('\n', ',').split(','):
+            if not chunk.strip():
+                continue
+            parts = [part.strip() for part in chunk.split(':')]
+            if len(parts) not in (2, 3) or not parts[0] or not parts[1]:
+                raise ValueError(f"Entrada inválida `{chunk.strip()}` (usa Nombre:acción[:NdM])")
+            
+            if len(parts) == 3:
+                dice_count, dice_type = DiceSystem.parse_dice(parts[2])
+            else:
+                dice_count, dice_type = default_count, default_type
+                DiceSystem.check_dice(dice_count, dice_type)
+            entries.append((parts[0], parts[1].lower(), dice_count, dice_type))
+        
+        if not entries:
+            raise ValueError("No se indicó ninguna acción")
+        if len(entries) > config.MAX_GROUP_ROLLS:
+            raise ValueError(f"Máximo {config.MAX_GROUP_ROLLS} acciones por tirada grupal")
+        return entries
+    
+    @staticmethod
+    def roll_group(entries, bonificador=0, session=None):
+        """Resuelve varias acciones con una consulta por tabla y una sola pasada de dados"""
+        names = [entry[0] for entry in entries]
+        base_stats = stats_manager.read_many_character_stats(names)
+        item_bonuses = inventory_system.calculate_many_equipped_bonuses(list(base_stats))
+        
+        npc_names = list(dict.fromkeys(name for name in names if name not in base_stats))
+        npc_rows = {}
+        if npc_names:
+            with db.get_connection(readonly=True) as conn:
+                cursor = conn.cursor()
+                cursor.execute(SQL_NPCS_MANY.format(placeholders=', '.join('?' * len(npc_names))), npc_names)
+                npc_rows = {row[0]: row[1:] for row in cursor.fetchall()}
+        
+        character_entries = [entry for entry in entries
+                             if entry[0] in base_stats and entry[1] in DiceSystem.ACTION_MAPPING]
+        dice_results = iter(DiceSystem.roll_dice_batch([(count, sides) for _, _, count, sides in character_entries],
+                                                       session))
+        
+        results = []
+        for name, action_type, dice_count, dice_type in entries:
+            if name in base_stats:
+                if action_type not in DiceSystem.ACTION_MAPPING:
+                    results.append({'kind': 'error', 'name': name, 'error': f"acción `{action_type}` inválida"})
+                    continue
+                combined_stats = DiceSystem.combine_stats(base_stats[name], item_bonuses[name])
+                result = DiceSystem.resolve_action(name, action_type, combined_stats, next(dice_results),
+                                                   dice_type, bonificador, session)
+                results.append({'kind': 'personaje', 'name': name, **result})
+            elif name in npc_rows:
+                result = DiceSystem.resolve_npc_action(name, action_type, npc_rows[name], session)
+                if result is None:
+                    results.append({'kind': 'error', 'name': name, 'error': f"acción de NPC `{action_type}` inválida"})
+                else:
+                    results.append({'kind': 'npc', 'name': name, **result})
+            else:
+                results.append({'kind': 'error', 'name': name, 'error': "no existe"})
+        return results
+
+dice_system = DiceSystem()
+
+# ============= SIMULADOR DE COMBATE =============
+def simulate_matchups(matchups, seed, trials, max_rounds, dice_count, dice_type):
+    """Trabajador (proceso aparte): simula en bloque cada enfrentamiento personaje vs NPC.
+    
+    Reglas (las de /tirar y /tirada_npc): el personaje tira XdY + atributo contra el valor fijo
+    de defensa del NPC y se defiende con XdY + atributo del valor fijo de ataque del NPC; el
+    atacante impacta si iguala o supera la defensa. Crítico (algún dado máximo) impacta siempre
+    y pifia (algún 1 sin crítico) falla siempre, en ambos sentidos.
+    
+    Daño (no existe en el juego, es un supuesto del simulador): cada impacto quita 1 PG y un
+    crítico del personaje quita 2. El NPC no tira dados, así que nunca hace críticos. Cada ronda
+    ambos atacan una vez; si caen en la misma ronda gana el más rápido (velocidad, empate al
+    personaje). Un combate sin derrota tras max_rounds rondas cuenta como tablas.
+    """
+    import numpy as np
+    rng = np.random.default_rng(seed)
+    results = []
+    for m in matchups:
+        shape = (trials, max_rounds, dice_count)
+        
+        # Ataque del personaje contra la defensa fija del NPC
+        attack = rng.integers(1, dice_type, size=shape, endpoint=True, dtype=np.int16)
+        attack_crit = (attack == dice_type).any(axis=2)
+        attack_fumble = (attack == 1).any(axis=2) & ~attack_crit
+        char_hit = attack_crit | (~attack_fumble & (attack.sum(axis=2) + m['attack'] >= m['npc_defense']))
+        char_damage = np.where(attack_crit, 2, char_hit.astype(np.int16))
+        
+        # Defensa del personaje contra el ataque fijo del NPC
+        defense = rng.integers(1, dice_type, size=shape, endpoint=True, dtype=np.int16)
+        defense_crit = (defense == dice_type).any(axis=2)
+        defense_fumble = (defense == 1).any(axis=2) & ~defense_crit
+        npc_hit = defense_fumble | (~defense_crit & (m['npc_attack'] >= defense.sum(axis=2) + m['defense']))
+        
+        def rounds_to_defeat(damage, hp):
+            reached = np.cumsum(damage, axis=1) >= hp
+            return np.where(reached.any(axis=1), reached.argmax(axis=1) + 1, max_rounds + 1)
+        
+        npc_rounds = rounds_to_defeat(char_damage, m['npc_hp'])
+        char_rounds = rounds_to_defeat(npc_hit, m['hp'])
+        npc_defeated = npc_rounds <= max_rounds
+        char_defeated = char_rounds <= max_rounds
+        
+        if m['char_first']:
+            wins = npc_defeated & (npc_rounds <= char_rounds)
+            losses = char_defeated & (char_rounds < npc_rounds)
+        else:
+            wins = npc_defeated & (npc_rounds < char_rounds)
+            losses = char_defeated & (char_rounds <= npc_rounds)
+        
+        results.append({
+            'personaje': m['personaje'],
+            'npc': m['npc'],
+            'hit_rate': float(char_hit.mean()),
+            'crit_rate': float(attack_crit.mean()),
+            'fumble_rate': float(attack_fumble.mean()),
+            'npc_hit_rate': float(npc_hit.mean()),
+            'rounds_to_defeat_npc': float(npc_rounds[npc_defeated].mean()) if npc_defeated.any() else None,
+            'rounds_to_defeat_character': float(char_rounds[char_defeated].mean()) if char_defeated.any() else None,
+            'win_rate': float(wins.mean()),
+            'loss_rate': float(losses.mean())
+        })
+    return results
+
+class CombatSimulator:
+    """Matriz personajes vs NPCs repartida entre procesos; cada proceso simula con NumPy"""
+    # Ataque del personaje -> acción de defensa del NPC
+    NPC_DEFENSE_FOR = {'ataque_fisico': 'defensa_fisica', 'ataque_magico': 'defensa_magica',
+                       'ataque_distancia': 'esquivar'}
+    # Ataque del NPC -> acción de defensa del personaje
+    CHARACTER_DEFENSE_FOR = {'fisico': 'defensa_fisica', 'magico': 'defensa_magica',
+                             'distancia': 'defensa_esquive'}
+    
+    def __init__(self, workers):
+        self.workers = workers
+        self._executor = None
+        self._lock = threading.Lock()
+    
+    def _pool(self):
+        with self._lock:
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(max_workers=self.workers)
+            return self._executor
+    
+    def load_roster(self, character_names=None, npc_names=None):
+        """Stats combinadas (base + bonos equipados) de personajes y filas de NPCs, en lote"""
+        with db.get_connection(readonly=True) as conn:
+            cursor = conn.cursor()
+            if character_names is None:
+                cursor.execute("SELECT nombre FROM personajes ORDER BY nombre")
+                character_names = [row[0] for row in cursor.fetchall()]
+            if npc_names is None:
+                cursor.execute(f"SELECT nombre, {', '.join(DiceSystem.NPC_COLUMNS)} FROM npcs ORDER BY nombre")
+            else:
+                cursor.execute(SQL_NPCS_MANY.format(placeholders=', '.join('?' * len(npc_names))), npc_names)
+            npcs = {row[0]: dict(zip(DiceSystem.NPC_COLUMNS, row[1:])) for row in cursor.fetchall()}
+        
+        base_stats = stats_manager.read_many_character_stats(character_names)
+        bonuses = inventory_system.calculate_many_equipped_bonuses(list(base_stats))
+        characters = {name: DiceSystem.combine_stats(stats, bonuses[name]) for name, stats in base_stats.items()}
+        return characters, npcs
+    
+    def build_matchups(self, characters, npcs, character_action, npc_action):
+        matchups = []
+        attack_attr = DiceSystem.ACTION_MAPPING[character_action]
+        defense_attr = DiceSystem.ACTION_MAPPING[self.CHARACTER_DEFENSE_FOR[npc_action]]
+        for char_name, stats in characters.items():
+            for npc_name, npc in npcs.items():
+                cantidad = npc['cantidad'] if npc['sincronizado'] else 1
+                matchups.append({
+                    'personaje': char_name,
+                    'npc': npc_name,
+                    'attack': stats[attack_attr]['total'],
+                    'defense': stats[defense_attr]['total'],
+                    'hp': config.FIXED_HP,
+                    'npc_attack': DiceSystem.npc_action_value(npc, npc_action)[1],
+                    'npc_defense': DiceSystem.npc_action_value(npc, self.NPC_DEFENSE_FOR[character_action])[1],
+                    'npc_hp': config.FIXED_HP * cantidad,
+                    'char_first': stats['velocidad']['total'] >= npc['velocidad']
+                })
+        return matchups
+    
+    def run(self, character_names=None, npc_names=None, trials=1000, dice_count=1, dice_type=20,
+            character_action='ataque_fisico', npc_action='fisico', roster=None):
+        """Simula todos los enfrentamientos y devuelve una fila de métricas por par
+        
+        roster: (personajes, npcs) ya cargados con load_roster, para no volver a consultarlos.
+        """
+        trials = max(1, min(trials, config.SIM_MAX_TRIALS))
+        characters, npcs = roster if roster is not None else self.load_roster(character_names, npc_names)
+        matchups = self.build_matchups(characters, npcs, character_action, npc_action)
+        if not matchups:
+            return []
+        
+        start = time.perf_counter()
+        chunks = [matchups[i::self.workers] for i in range(min(self.workers, len(matchups)))]
+        import numpy as np
+        seeds = np.random.SeedSequence(config.DICE_SEED).spawn(len(chunks))
+        futures = [self._pool().submit(simulate_matchups, chunk, seed, trials, config.SIM_MAX_ROUNDS,
+                                       dice_count, dice_type)
+                   for chunk, seed in zip(chunks, seeds)]
+        results = [row for future in futures for row in future.result()]
+        results.sort(key=lambda row: (row['personaje'], row['npc']))
+        
+        logger.info(f"🧪 Simulados {len(matchups)} enfrentamientos x {trials} combates "
+                    f"en {time.perf_counter() - start:.2f}s ({len(chunks)} procesos)")
+        return results
+    
+    def shutdown(self):
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=False, cancel_futures=True)
+                self._executor = None
+    
+    @staticmethod
+    def format_row(row):
+        def rounds(value):
+            return f"{value:.1f}" if value is not None else "-"
+        return (f"{row['personaje'][:14]:<14} {row['npc'][:14]:<14} {row['hit_rate']:>5.0%} "
+                f"{row['crit_rate']:>4.0%} {row['fumble_rate']:>4.0%} {row['npc_hit_rate']:>5.0%} "
+                f"{rounds(row['rounds_to_defeat_npc']):>5} {rounds(row['rounds_to_defeat_character']):>5} "
+                f"{row['win_rate']:>5.0%}")
+    
+    TABLE_HEADER = f"{'Personaje':<14} {'NPC':<14} {'Imp':>5} {'Crít':>4} {'Pif':>4} {'ImpN':>5} {'R→N':>5} {'R→P':>5} {'Gana':>5}"
+
+combat_simulator = CombatSimulator(config.SIM_WORKERS)
+
+# ============= ACCESO A DATOS ASÍNCRONO =============
+class AsyncDataAccess:
+    """Ejecuta E/S bloqueante (SQLite, Excel, Google Sheets) en un pool de hilos acotado"""
+    def __init__(self, max_workers, timeout):
+        self.max_workers = max_workers
+        self.timeout = timeout
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="unity-io")
+        self._semaphore = asyncio.Semaphore(max_workers)
+        self._stats_lock = threading.Lock()
+        self._calls = {}  # etiqueta -> contadores de latencia
+        self._in_flight = 0
+        self._abandoned = 0  # hilos que siguen corriendo después de que su llamada diera timeout
+    
+    def _record(self, label, elapsed, error=False, timed_out=False):
+        with self._stats_lock:
+            entry = self._calls.setdefault(label, {'count': 0, 'errors': 0, 'timeouts': 0,
+                                                   'total_time': 0.0, 'max_time': 0.0})
+            entry['count'] += 1
+            entry['total_time'] += elapsed
+            entry['max_time'] = max(entry['max_time'], elapsed)
+            if timed_out:
+                entry['timeouts'] += 1
+            elif error:
+                entry['errors'] += 1
+    
+    def _release(self, state=None):
+        """Libera el hueco cuando el hilo termina de verdad, no cuando el que espera se rinde"""
+        with self._stats_lock:
+            self._in_flight -= 1
+            if state and state['abandoned']:
+                self._abandoned -= 1
+        self._semaphore.release()
+    
+    async def run(self, label, func, *args, timeout=None, **kwargs):
+        """Espera func(*args, **kwargs) en el pool; la etiqueta agrupa latencias (p. ej. 'db.tirar')
+        
+        Un timeout solo deja de esperar: el hilo sigue ocupando su hueco del semáforo hasta que
+        termina, así que tras varios timeouts las llamadas nuevas esperan en vez de apilarse.
+        """
+        loop = asyncio.get_running_loop()
+        await self._semaphore.acquire()
+        with self._stats_lock:
+            self._in_flight += 1
+        start = time.perf_counter()
+        try:
+            # Copia del contexto: el hilo ve el comando en curso (fases y errores se le atribuyen)
+            future = self.executor.submit(contextvars.copy_context().run,
+                                          functools.partial(func, *args, **kwargs))
+        except BaseException:
+            self._release()
+            raise
+        state = {'abandoned': False}
+        
+        def on_done(_):
+            try:
+                loop.call_soon_threadsafe(self._release, state)
+            except RuntimeError:
+                # El loop ya está cerrado (apagado): nadie más espera el semáforo
+                with self._stats_lock:
+                    self._in_flight -= 1
+        
+        future.add_done_callback(on_done)
+        error = timed_out = False
+        try:
+            # Al vencer se cancela el futuro: si aún estaba en cola no llega a correr, si ya corre sigue
+            return await asyncio.wait_for(asyncio.wrap_future(future), timeout or self.timeout)
+        except asyncio.TimeoutError:
+            timed_out = True
+            with self._stats_lock:
+                if not future.done():
+                    state['abandoned'] = True
+                    self._abandoned += 1
+            logger.error(f"⏱️ Operación bloqueante '{label}' excedió {timeout or self.timeout}s "
+                         f"(el hilo sigue ocupado hasta que termine)")
+            raise
+        except Exception:
+            error = True
+            raise
+        finally:
+            elapsed = time.perf_counter() - start
+            self._record(label, elapsed, error, timed_out)
+            command_metrics.add_phase(label.split('.', 1)[0], elapsed)
+    
+    def stats(self):
+        with self._stats_lock:
+            calls = {label: dict(entry, avg_time=entry['total_time'] / entry['count'])
+                     for label, entry in self._calls.items()}
+            return {'max_workers': self.max_workers, 'in_flight': self._in_flight,
+                    'abandoned': self._abandoned, 'calls': calls}
+    
+    def shutdown(self):
+        self.executor.shutdown(wait=True, cancel_futures=True)
+
+data_access = AsyncDataAccess(config.IO_WORKERS, config.IO_TIMEOUT)
+
+# ============= MÉTRICAS =============
+# Mediciones del comando en curso: {'start': perf_counter, 'phases': {fase: segundos}}
+_current_command = contextvars.ContextVar('current_command', default=None)
+
+class Histogram:
+    """Histograma acumulativo con cubetas fijas, al estilo de Prometheus"""
+    BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+    
+    def __init__(self):
+        self.counts = [0] * (len(self.BUCKETS) + 1)  # la última cubeta es +Inf
+        self.sum = 0.0
+        self.count = 0
+    
+    def observe(self, value):
+        self.counts[bisect_left(self.BUCKETS, value)] += 1
+        self.sum += value
+        self.count += 1
+    
+    def quantile(self, q):
+        """Cota superior de la cubeta donde cae el cuantil q (None si no hay datos)"""
+        if not self.count:
+            return None
+        target = q * self.count
+        cumulative = 0
+        for bound, count in zip(self.BUCKETS, self.counts):
+            cumulative += count
+            if cumulative >= target:
+                return bound
+        return float('inf')
+
+class CommandMetrics:
+    """Latencia por comando y fase (primera respuesta, db, excel, sheets, ..., total) y errores"""
+    FIRST_RESPONSE = 'respuesta'
+    TOTAL = 'total'
+    
+    def __init__(self, file_path, interval, host, port):
+        self.file_path = file_path
+        self.interval = interval
+        self.host = host
+        self.port = port
+        self._lock = threading.Lock()
+        self._histograms = {}  # (comando, fase) -> Histogram
+        self._calls = Counter()
+        self._errors = Counter()
+        self._task = None
+        self._runner = None
+    
+    def instrument(self, func):
+        """Decorador para comandos y callbacks de UI: mide el manejador completo y sus fases"""
+        name = func.__qualname__
+        
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            current = {'start': time.perf_counter(), 'phases': {}, 'error': False}
+            interaction = next((arg for arg in args if isinstance(arg, discord.Interaction)), None)
+            if interaction is not None and type(interaction.response) is discord.InteractionResponse:
+                interaction.response.__class__ = _TimedInteractionResponse
+            token = _current_command.set(current)
+            try:
+                return await func(*args, **kwargs)
+            except Exception:
+                current['error'] = True
+                raise
+            finally:
+                _current_command.reset(token)
+                current['phases'][self.TOTAL] = time.perf_counter() - current['start']
+                self._record(name, current['phases'], current['error'])
+        return wrapper
+    
+    @staticmethod
+    def add_phase(phase, elapsed):
+        """Suma tiempo a una fase del comando en curso (no hace nada fuera de un comando)"""
+        current = _current_command.get()
+        if current is not None:
+            current['phases'][phase] = current['phases'].get(phase, 0.0) + elapsed
+    
+    @staticmethod
+    def mark_first_response():
+        current = _current_command.get()
+        if current is not None and CommandMetrics.FIRST_RESPONSE not in current['phases']:
+            current['phases'][CommandMetrics.FIRST_RESPONSE] = time.perf_counter() - current['start']
+    
+    @staticmethod
+    def mark_error():
+        current = _current_command.get()
+        if current is not None:
+            current['error'] = True
+    
+    def _record(self, name, phases, error):
+        with self._lock:
+            self._calls[name] += 1
+            if error:
+                self._errors[name] += 1
+            for phase, elapsed in phases.items():
+                self._histograms.setdefault((name, phase), Histogram()).observe(elapsed)
+    
+    def summary(self):
+        """{comando: {'calls', 'errors', 'phases': {fase: {'count', 'avg', 'p50', 'p95'}}}}"""
+        with self._lock:
+            result = {name: {'calls': calls, 'errors': self._errors[name], 'phases': {}}
+                      for name, calls in self._calls.items()}
+            for (name, phase), histogram in self._histograms.items():
+                result[name]['phases'][phase] = {
+                    'count': histogram.count,
+                    'avg': histogram.sum / histogram.count,
+                    'p50': histogram.quantile(0.5),
+                    'p95': histogram.quantile(0.95)
+                }
+        return result
+    
+    def render_prometheus(self):
+        lines = ["# HELP unity_command_seconds Latencia de comandos por fase",
+                 "# TYPE unity_command_seconds histogram"]
+        with self._lock:
+            for (name, phase), histogram in sorted(self._histograms.items()):
+                labels = f'command="{name}",phase="{phase}"'
+                cumulative = 0
+                for bound, count in zip(Histogram.BUCKETS, histogram.counts):
+                    cumulative += count
+                    lines.append(f'unity_command_seconds_bucket{{{labels},le="{bound}"}} {cumulative}')
+                lines.append(f'unity_command_seconds_bucket{{{labels},le="+Inf"}} {histogram.count}')
+                lines.append(f'unity_command_seconds_sum{{{labels}}} {histogram.sum:.6f}')
+                lines.append(f'unity_command_seconds_count{{{labels}}} {histogram.count}')
+            lines += ["# HELP unity_command_calls_total Invocaciones por comando",
+                      "# TYPE unity_command_calls_total counter"]
+            lines += [f'unity_command_calls_total{{command="{name}"}} {count}'
+                      for name, count in sorted(self._calls.items())]
+            lines += ["# HELP unity_command_errors_total Invocaciones terminadas en excepción",
+                      "# TYPE unity_command_errors_total counter"]
+            lines += [f'unity_command_errors_total{{command="{name}"}} {self._errors[name]}'
+                      for name in sorted(self._calls)]
+        
+        lines += ["# HELP unity_io_seconds_total Tiempo acumulado de E/S bloqueante por etiqueta",
+                  "# TYPE unity_io_seconds_total counter"]
+        io_stats = data_access.stats()
+        for label, entry in sorted(io_stats['calls'].items()):
+            lines.append(f'unity_io_seconds_total{{label="{label}"}} {entry["total_time"]:.6f}')
+            lines.append(f'unity_io_calls_total{{label="{label}"}} {entry["count"]}')
+            lines.append(f'unity_io_errors_total{{label="{label}"}} {entry["errors"]}')
+            lines.append(f'unity_io_timeouts_total{{label="{label}"}} {entry["timeouts"]}')
+        lines += ["# HELP unity_io_in_flight Hilos de E/S ocupados (incluye los que ya dieron timeout)",
+                  "# TYPE unity_io_in_flight gauge",
+                  f"unity_io_in_flight {io_stats['in_flight']}",
+                  f"unity_io_abandoned {io_stats['abandoned']}"]
+        
+        pool = db.pool.stats()
+        lines += ["# HELP unity_db_waits_total Esperas por el escritor o por un hueco de lector SQLite",
+                  "# TYPE unity_db_waits_total counter",
+                  f'unity_db_waits_total{{role="writer"}} {pool["writer_waits"]}',
+                  f'unity_db_waits_total{{role="reader"}} {pool["reader_waits"]}',
+                  "# HELP unity_db_wait_seconds_total Tiempo acumulado esperando conexión SQLite",
+                  "# TYPE unity_db_wait_seconds_total counter",
+                  f'unity_db_wait_seconds_total{{role="writer"}} {pool["writer_wait_time"]:.6f}',
+                  f'unity_db_wait_seconds_total{{role="reader"}} {pool["reader_wait_time"]:.6f}',
+                  "# HELP unity_db_connections Conexiones SQLite del pool",
+                  "# TYPE unity_db_connections gauge",
+                  f'unity_db_connections{{state="open"}} {pool["open"]}',
+                  f'unity_db_connections{{state="readers_in_use"}} {pool["readers_in_use"]}',
+                  f'unity_db_connections{{state="readers_idle"}} {pool["readers_idle"]}',
+                  f'unity_db_connections{{state="readers_peak"}} {pool["readers_peak"]}',
+                  f'unity_db_connections{{state="max_readers"}} {pool["max_readers"]}',
+                  f'unity_db_checkouts_total {pool["checkouts"]}']
+        
+        lines += ["# HELP unity_cache_hit_ratio Aciertos / consultas de cada caché",
+                  "# TYPE unity_cache_hit_ratio gauge"]
+        for cache_name, cache in (('stats', stat_cache), ('embeds', embed_cache)):
+            cache_stats = cache.stats()
+            lines.append(f'unity_cache_hit_ratio{{cache="{cache_name}"}} {cache_stats["hit_ratio"]:.4f}')
+            lines.append(f'unity_cache_entries{{cache="{cache_name}"}} {cache_stats["entries"]}')
+        return '\n'.join(lines) + '\n'
+    
+    def write_file(self, text):
+        tmp_path = f"{self.file_path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.write(text)
+        os.replace(tmp_path, self.file_path)
+    
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await data_access.run("metricas.archivo", self.write_file, self.render_prometheus())
+            except Exception as e:
+                logger.warning(f"⚠️ No se pudo escribir {self.file_path}: {e}")
+    
+    async def start(self):
+        if self._task is not None:
+            return
+        self._task = asyncio.get_running_loop().create_task(self._run())
+        if self.port:
+            from aiohttp import web
+            
+            async def handle(request):
+                return web.Response(text=self.render_prometheus(), content_type='text/plain', charset='utf-8')
+            
+            app = web.Application()
+            app.router.add_get('/metrics', handle)
+            self._runner = web.AppRunner(app, access_log=None)
+            await self._runner.setup()
+            await web.TCPSite(self._runner, self.host, self.port).start()
+            logger.info(f"📈 Métricas en http://{self.host}:{self.port}/metrics")
+    
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+        try:
+            self.write_file(self.render_prometheus())
+        except Exception as e:
+            logger.warning(f"⚠️ No se pudo escribir {self.file_path}: {e}")
+
+command_metrics = CommandMetrics(config.METRICS_FILE, config.METRICS_INTERVAL,
+                                 config.METRICS_HOST, config.METRICS_PORT)
+instrumented = command_metrics.instrument
+
+class _CommandErrorHandler(logging.Handler):
+    """Los comandos capturan sus excepciones y las registran con logger.error: eso cuenta como error"""
+    def emit(self, record):
+        if record.levelno >= logging.ERROR:
+            CommandMetrics.mark_error()
+
+logger.addHandler(_CommandErrorHandler())
+
+class _TimedInteractionResponse(discord.InteractionResponse):
+    """La primera respuesta a Discord (defer, mensaje o edición) marca el tiempo hasta responder
+    
+    instrument cambia la clase solo de la respuesta de la interacción que mide; la clase de
+    discord.py queda intacta para el resto del proceso.
+    """
+    __slots__ = ()
+    
+    async def defer(self, *args, **kwargs):
+        CommandMetrics.mark_first_response()
+        return await super().defer(*args, **kwargs)
+    
+    async def send_message(self, *args, **kwargs):
+        CommandMetrics.mark_first_response()
+        return await super().send_message(*args, **kwargs)
+    
+    async def edit_message(self, *args, **kwargs):
+        CommandMetrics.mark_first_response()
+        return await super().edit_message(*args, **kwargs)
+
+# ============= HISTORIAL DE TIRADAS =============
+class RollHistory:
+    """Búfer de tiradas que se escribe en lotes: un executemany y un commit por lote, no por tirada"""
+    def __init__(self, batch_size, flush_interval, max_pending):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self._buffer = []
+        self._lock = threading.Lock()
+        self._loop = None
+        self._wakeup = None
+        self._task = None
+        self.counters = {'recorded': 0, 'written': 0, 'batches': 0, 'dropped': 0, 'errors': 0}
+    
+    @staticmethod
+    def make_row(origin, name, action, total, session=None, dice_count=None, dice_type=None, dice=None,
+                 attribute=None, attribute_value=None, bonificador=0, critical=False, fumble=False,
+                 created_at=None):
+        """Fila para SQL_INSERT_ROLL; created_at en UTC con el formato de CURRENT_TIMESTAMP (por defecto, ahora)"""
+        return (origin, name, action, dice_count, dice_type, json.dumps(dice) if dice is not None else None,
+                attribute, attribute_value, bonificador, total, bool(critical), bool(fumble),
+                str(session) if session is not None else None,
+                created_at or time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime()))
+    
+    def record(self, origin, name, action, total, session=None, **details):
+        """Apunta una tirada; seguro desde el event loop y desde hilos del executor"""
+        row = self.make_row(origin, name, action, total, session, **details)
+        with self._lock:
+            self._buffer.append(row)
+            self.counters['recorded'] += 1
+            if len(self._buffer) > self.max_pending:
+                del self._buffer[0]
+                self.counters['dropped'] += 1
+            full = len(self._buffer) >= self.batch_size
+        if full and self._loop is not None:
+            self._loop.call_soon_threadsafe(self._wakeup.set)
+    
+    def _take(self):
+        with self._lock:
+            rows, self._buffer = self._buffer[:self.batch_size], self._buffer[self.batch_size:]
+            return rows
+    
+    def _requeue(self, rows):
+        with self._lock:
+            self._buffer[:0] = rows
+            overflow = len(self._buffer) - self.max_pending
+            if overflow > 0:
+                del self._buffer[:overflow]
+                self.counters['dropped'] += overflow
+    
+    @staticmethod
+    def _write(rows):
+        with db.get_connection() as conn:
+            conn.cursor().executemany(SQL_INSERT_ROLL, rows)
+            conn.commit()
+    
+    def _written(self, rows):
+        self.counters['written'] += len(rows)
+        self.counters['batches'] += 1
+    
+    async def flush(self):
+        """Escribe todo lo pendiente; si falla, las filas vuelven al búfer para el siguiente intento"""
+        while True:
+            rows = self._take()
+            if not rows:
+                return
+            try:
+                await data_access.run("db.tiradas_guardar", self._write, rows)
+                self._written(rows)
+            except Exception as e:
+                self.counters['errors'] += 1
+                self._requeue(rows)
+                logger.warning(f"⚠️ No se pudo guardar el historial de tiradas ({len(rows)} filas): {e}")
+                return
+    
+    def flush_sync(self):
+        """Vaciado sin event loop (línea de comandos y cierre)"""
+        while True:
+            rows = self._take()
+            if not rows:
+                return
+            self._write(rows)
+            self._written(rows)
+    
+    async def _run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            await self.flush()
+    
+    def start(self):
+        if self._task is not None:
+            return
+        self._loop = asyncio.get_running_loop()
+        self._wakeup = asyncio.Event()
+        self._task = self._loop.create_task(self._run())
+    
+    async def stop(self):
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+        self._loop = None
+        await self.flush()
+    
+    def stats(self):
+        with self._lock:
+            return dict(self.counters, pending=len(self._buffer))
+    
+    @staticmethod
+    def history(name, limit):
+        with db.get_connection(readonly=True) as conn:
+            return conn.execute(SQL_ROLL_HISTORY, (name, limit)).fetchall()
+    
+    @staticmethod
+    def action_stats(name=None, channel_id=None, days=30):
+        """Agregados por acción: (accion, tiradas, media, mín, máx, críticos, pifias, tiradas con dados)"""
+        if name:
+            where, params = "nombre = ?", [name]
+        elif channel_id:
+            where, params = "canal_id = ?", [str(channel_id)]
+        else:
+            where, params = "origen = 'personaje'", []
+        with db.get_connection(readonly=True) as conn:
+            return conn.execute(SQL_ROLL_STATS.format(where=where), (*params, f"-{int(days)} days")).fetchall()
+
+roll_history = RollHistory(config.ROLL_BATCH_SIZE, config.ROLL_FLUSH_INTERVAL, config.ROLL_MAX_PENDING)
+
+# ============= IMPORTACIÓN DE LOGS ANTIGUOS =============
+class LogBackfill:
+    """Lee logs de texto línea a línea y pasa sus tiradas a la tabla tiradas en lotes.
+    
+    Cada archivo se identifica por el hash de su primera línea, así que unity.log renombrado
+    a unity.log.1 por una rotación conserva su avance. El offset en bytes se guarda en la
+    misma transacción que cada lote, de modo que una importación cortada se retoma sin
+    duplicar ni perder filas. Las horas del log son locales y se guardan en UTC.
+    """
+    PREFIX = r'^(?P<ts>\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2}),\d+ - (?:\S+ - )?INFO - '
+    ROLL_RE = re.compile(PREFIX + r'\[DADOS\] (?P<name>.+?) - (?P<action>[^:]+): (?P<dice>D\d+\(\d+\)|\d+d\d+\(\[[\d, ]*\]\)) '
+                         r'\+ (?P<attr>\w+)\((?P<attr_value>-?\d+)\) \+ Bonus\((?P<bonus>-?\d+)\) = (?P<total>-?\d+)\s*$')
+    NPC_RE = re.compile(PREFIX + r'\[NPC (?:ATAQUE|DEFENSA)\] (?P<desc>.+) - (?P<action>\w+): (?P<total>-?\d+)(?: daño)?\s*$')
+    # Líneas con etiqueta de tirada que ningún patrón reconoce: se cuentan en el informe
+    TAGGED_RE = re.compile(PREFIX + r'\[(?:DADOS|NPC ATAQUE|NPC DEFENSA)\] ')
+    MAX_MISSED_SAMPLES = 5
+    # D20(17) en el formato antiguo, 2d20([3, 17]) en el actual
+    OLD_DICE_RE = re.compile(r'^D(?P<sides>\d+)\((?P<roll>\d+)\)$')
+    NEW_DICE_RE = re.compile(r'^(?P<count>\d+)d(?P<sides>\d+)\(\[(?P<rolls>[\d, ]*)\]\)$')
+    SYNCED_RE = re.compile(r'^(?P<count>\d+) (?P<name>.+)s sincronizados$')
+    
+    def __init__(self, batch_size):
+        self.batch_size = batch_size
+    
+    @staticmethod
+    def default_files():
+        """unity.log y sus hermanos rotados (unity.log.1, .2, ...), del más antiguo al más nuevo"""
+        rotated = [path for path in glob.glob(f"{config.LEGACY_LOG}.*") if path.rsplit('.', 1)[1].isdigit()]
+        rotated.sort(key=lambda path: int(path.rsplit('.', 1)[1]), reverse=True)
+        return rotated + ([config.LEGACY_LOG] if os.path.exists(config.LEGACY_LOG) else [])
+    
+    @staticmethod
+    def _utc(timestamp):
+        local = datetime.strptime(timestamp, '%Y-%m-%d %H:%M:%S').astimezone()
+        return local.astimezone(timezone.utc).strftime('%Y-%m-%d %H:%M:%S')
+    
+    @classmethod
+    def parse_line(cls, line):
+        """Fila para SQL_INSERT_ROLL, o None si la línea no es una tirada"""
+        match = cls.ROLL_RE.match(line)
+        if match:
+            dice = cls.OLD_DICE_RE.match(match['dice'])
+            if dice:
+                sides, rolls = int(dice['sides']), [int(dice['roll'])]
+            else:
+                dice = cls.NEW_DICE_RE.match(match['dice'])
+                if not dice:
+                    return None
+                sides = int(dice['sides'])
+                rolls = [int(roll) for roll in dice['rolls'].split(',') if roll.strip()]
+            return RollHistory.make_row(
+                'personaje', match['name'], match['action'].strip().lower().replace(' ', '_'), int(match['total']),
+                dice_count=len(rolls), dice_type=sides, dice=rolls, attribute=match['attr'].lower(),
+                attribute_value=int(match['attr_value']), bonificador=int(match['bonus']),
+                critical=any(roll == sides for roll in rolls), fumble=any(roll == 1 for roll in rolls),
+                created_at=cls._utc(match['ts']))
+        
+        match = cls.NPC_RE.match(line)
+        if match:
+            synced = cls.SYNCED_RE.match(match['desc'])
+            name = synced['name'] if synced else match['desc']
+            return RollHistory.make_row('npc', name, match['action'], int(match['total']),
+                                        created_at=cls._utc(match['ts']))
+        return None
+    
+    @staticmethod
+    def fingerprint(path):
+        with open(path, 'rb') as f:
+            first_line = f.readline()
+        return hashlib.sha256(first_line).hexdigest() if first_line.endswith(b'\n') else None
+    
+    def _save_batch(self, rows, key, path, offset):
+        with db.get_connection() as conn:
+            cursor = conn.cursor()
+            if rows:
+                cursor.executemany(SQL_INSERT_ROLL, rows)
+            cursor.execute("""INSERT INTO importaciones_logs (huella, archivo, offset, tiradas) VALUES (?, ?, ?, ?)
+                            ON CONFLICT(huella) DO UPDATE SET archivo = excluded.archivo, offset = excluded.offset,
+                            tiradas = tiradas + excluded.tiradas, updated_at = CURRENT_TIMESTAMP""",
+                         (key, path, offset, len(rows)))
+            conn.commit()
+    
+    def import_file(self, path, restart=False):
+        """Importa desde el último offset guardado; solo procesa líneas completas (terminadas en \\n)"""
+        key = self.fingerprint(path)
+        if key is None:
+            return {'lineas': 0, 'tiradas': 0, 'sin_reconocer': 0, 'ejemplos_sin_reconocer': []}
+        
+        offset = 0
+        if not restart:
+            with db.get_connection(readonly=True) as conn:
+                row = conn.execute("SELECT offset FROM importaciones_logs WHERE huella = ?", (key,)).fetchone()
+            offset = row[0] if row else 0
+        
+        lines = imported = 0
+        rows = []
+        missed = []
+        with open(path, 'rb') as f:
+            f.seek(offset)
+            for raw in iter(f.readline, b''):
+                if not raw.endswith(b'\n'):
+                    break  # línea a medio escribir: se retoma en la próxima importación
+                offset += len(raw)
+                lines += 1
+                line = raw.decode('utf-8', errors='replace')
+                row = self.parse_line(line)
+                if row:
+                    rows.append(row)
+                elif self.TAGGED_RE.match(line):
+                    missed.append(line.rstrip('\n'))
+                if len(rows) >= self.batch_size:
+                    self._save_batch(rows, key, path, offset)
+                    imported += len(rows)
+                    rows = []
+        self._save_batch(rows, key, path, offset)
+        imported += len(rows)
+        
+        logger.info(f"📜 {path}: {lines} líneas nuevas, {imported} tiradas importadas (offset {offset})")
+        if missed:
+            logger.warning(f"⚠️ {path}: {len(missed)} líneas de tiradas sin reconocer, p. ej. {missed[0]!r}")
+        return {'lineas': lines, 'tiradas': imported, 'sin_reconocer': len(missed),
+                'ejemplos_sin_reconocer': missed[:self.MAX_MISSED_SAMPLES]}
+    
+    def run(self, paths=None, restart=False):
+        paths = paths or self.default_files()
+        report = {'archivos': 0, 'lineas': 0, 'tiradas': 0, 'sin_reconocer': 0, 'ejemplos_sin_reconocer': []}
+        for path in paths:
+            result = self.import_file(path, restart)
+            report['archivos'] += 1
+            report['lineas'] += result['lineas']
+            report['tiradas'] += result['tiradas']
+            report['sin_reconocer'] += result['sin_reconocer']
+            room = self.MAX_MISSED_SAMPLES - len(report['ejemplos_sin_reconocer'])
+            report['ejemplos_sin_reconocer'] += result['ejemplos_sin_reconocer'][:room]
+        return report
+
+log_backfill = LogBackfill(config.LOG_IMPORT_BATCH)
+
+# ============= CATÁLOGO: BESTIARIO E ITEMS =============
+class CatalogError(Exception):
+    """El archivo de catálogo no se pudo leer o tiene filas inválidas; no se escribe nada"""
+
+class CatalogManager:
+    """Carga y exporta en bloque el bestiario (npcs) y el catálogo de items en CSV, JSON o YAML.
+    
+    La importación valida todo el archivo antes de escribir y hace un único upsert por nombre
+    con executemany en una transacción. Las columnas que no aparecen en el archivo conservan
+    su valor en las filas existentes; la exportación recorre la tabla por bloques.
+    """
+    # columna -> (tipo, valor por defecto); None como defecto en 'nombre'/'tipo' = obligatorio
+    FIELDS = {
+        'npcs': {
+            'nombre': (str, None), 'tipo': (str, 'general'),
+            'ataq_fisic': (int, 10), 'ataq_dist': (int, 10), 'ataq_magic': (int, 10),
+            'res_fisica': (int, 10), 'res_magica': (int, 10), 'velocidad': (int, 10), 'mana': (int, 10),
+            'descripcion': (str, "Un ser del universo Unity"), 'sincronizado': (bool, False),
+            'cantidad': (int, 1), 'imagen_url': (str, None),
+        },
+        'items': {
+            'nombre': (str, None), 'tipo': (str, None), 'subtipo': (str, None), 'rareza': (str, 'comun'),
+            'descripcion': (str, ''), 'efecto_fuerza': (int, 0), 'efecto_destreza': (int, 0),
+            'efecto_velocidad': (int, 0), 'efecto_resistencia': (int, 0), 'efecto_inteligencia': (int, 0),
+            'efecto_mana': (int, 0), 'precio': (int, 0), 'es_equipable': (bool, True),
+            'slot_equipo': (str, 'general'), 'imagen_url': (str, None),
+        },
+    }
+    REQUIRED = {'npcs': ('nombre',), 'items': ('nombre', 'tipo')}
+    EMBED_KIND = {'npcs': 'npc'}  # los items no tienen embed propio: se invalida a quien los tiene
+    FORMATS = ('csv', 'json', 'yaml')
+    TRUE_VALUES = ('1', 'true', 'si', 'sí', 'yes', 'x')
+    FALSE_VALUES = ('0', 'false', 'no', '')
+    MAX_REPORTED_ERRORS = 10
+    
+    def __init__(self, chunk_size):
+        self.chunk_size = chunk_size
+    
+    @classmethod
+    def detect_format(cls, filename):
+        ext = os.path.splitext(filename)[1].lstrip('.').lower()
+        fmt = 'yaml' if ext == 'yml' else ext
+        if fmt not in cls.FORMATS:
+            raise CatalogError(f"formato '{ext}' no soportado (usa {', '.join(cls.FORMATS)})")
+        return fmt
+    
+    @staticmethod
+    def _yaml():
+        try:
+            import yaml
+        except ImportError:
+            raise CatalogError("PyYAML no está instalado (pip install pyyaml)") from None
+        return yaml
+    
+    @classmethod
+    def read_records(cls, kind, stream, fmt):
+        """Registros (dicts) de un flujo de texto; JSON/YAML aceptan una lista o {'npcs': [...]}"""
+        if fmt == 'csv':
+            return list(csv.DictReader(stream))
+        try:
+            data = json.load(stream) if fmt == 'json' else cls._yaml().safe_load(stream)
+        except CatalogError:
+            raise
+        except Exception as e:
+            raise CatalogError(f"{fmt.upper()} inválido: {e}") from e
+        if isinstance(data, dict):
+            data = data.get(kind)
+        if not isinstance(data, list) or not all(isinstance(record, dict) for record in data):
+            raise CatalogError(f"se esperaba una lista de objetos (o {{'{kind}': [...]}})")
+        return data
+    
+    @classmethod
+    def _coerce(cls, column, kind_of, value):
+        if kind_of is bool:
+            if isinstance(value, bool):
+                return value
+            text = str(value).strip().lower()
+            if text in cls.TRUE_VALUES:
+                return True
+            if text in cls.FALSE_VALUES:
+                return False
+            raise ValueError(f"{column}: '{value}' no es sí/no")
+        if kind_of is int:
+            if isinstance(value, bool):
+                raise ValueError(f"{column}: '{value}' no es un entero")
+            try:
+                return int(str(value).strip())
+            except ValueError:
+                raise ValueError(f"{column}: '{value}' no es un entero") from None
+        return str(value).strip()
+    
+    @classmethod
+    def validate(cls, kind, records):
+        """(columnas presentes, filas como tuplas, errores); con un solo error no se importa nada"""
+        fields = cls.FIELDS[kind]
+        present = set()
+        for record in records:
+            present.update(str(key).strip().lower() for key in record if key is not None)
+        unknown = present - set(fields)
+        errors = [f"columnas desconocidas: {', '.join(sorted(unknown))}"] if unknown else []
+        missing = [column for column in cls.REQUIRED[kind] if column not in present]
+        if missing:
+            errors.append(f"faltan columnas obligatorias: {', '.join(missing)}")
+        if errors:
+            return [], [], errors
+        
+        columns = [column for column in fields if column in present]
+        rows, seen = [], {}
+        for line, record in enumerate(records, start=1):
+            record = {str(key).strip().lower(): value for key, value in record.items() if key is not None}
+            values = []
+            try:
+                for column in columns:
+                    kind_of, default = fields[column]
+                    value = record.get(column)
+                    if value is None or (isinstance(value, str) and not value.strip()):
+                        if column in cls.REQUIRED[kind]:
+                            raise ValueError(f"{column} es obligatorio")
+                        values.append(default)
+                        continue
+                    values.append(cls._coerce(column, kind_of, value))
+                row = dict(zip(columns, values))
+                if any(not row[column] for column in cls.REQUIRED[kind]):
+                    raise ValueError(f"{' y '.join(cls.REQUIRED[kind])} no pueden estar vacíos")
+                if 'cantidad' in row and row['cantidad'] < 1:
+                    raise ValueError("cantidad debe ser al menos 1")
+                if 'precio' in row and row['precio'] < 0:
+                    raise ValueError("precio no puede ser negativo")
+                key = NameIndex.normalize(row['nombre'])
+                if key in seen:
+                    raise ValueError(f"'{row['nombre']}' repite el nombre de la fila {seen[key]}")
+                seen[key] = line
+            except ValueError as e:
+                errors.append(f"fila {line}: {e}")
+                continue
+            rows.append(tuple(values))
+        return columns, rows, errors
+    
+    def _upsert(self, kind, columns, rows, dry_run):
+        updatable = [column for column in columns if column != 'nombre']
+        effects = ([f"efecto_{attr}" for attr in InventorySystem.ATTRIBUTES if f"efecto_{attr}" in columns]
+                   if kind == 'items' else [])
+        names = [row[0] for row in rows]
+        with db.get_connection(readonly=dry_run) as conn:
+            cursor = conn.cursor()
+            existing = {}
+            for start in range(0, len(names), self.chunk_size):
+                chunk = names[start:start + self.chunk_size]
+                cursor.execute(f"SELECT nombre, id {''.join(', ' + column for column in effects)} FROM {kind} "
+                               f"WHERE nombre IN ({', '.join('?' * len(chunk))})", chunk)
+                existing.update((row[0], row[1:]) for row in cursor.fetchall())
+            report = {'creados': len(names) - len(existing), 'actualizados': len(existing), 'equipos_recalculados': 0}
+            if dry_run:
+                return report, [], [], set()
+            
+            assignments = ', '.join(f"{column} = excluded.{column}" for column in updatable)
+            cursor.executemany(f"""INSERT INTO {kind} ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))})
+                               ON CONFLICT(nombre) DO {'UPDATE SET ' + assignments if assignments else 'NOTHING'}""",
+                               rows)
+            
+            # Items cuyos efectos cambiaron: recalcula los bonos de quien los tiene equipados
+            holders = set()
+            if effects:
+                positions = [columns.index(column) for column in effects]
+                recalculated = set()
+                for row in rows:
+                    old = existing.get(row[0])
+                    if old is not None and tuple(row[i] for i in positions) != tuple(old[1:]):
+                        cursor.execute("""SELECT DISTINCT p.nombre FROM inventarios inv
+                                        JOIN personajes p ON p.id = inv.personaje_id
+                                        WHERE inv.item_id = ? AND inv.equipado = TRUE""", (old[0],))
+                        recalculated.update(r[0] for r in cursor.fetchall())
+                        InventorySystem.refresh_item_holders(cursor, old[0])
+                report['equipos_recalculados'] = len(recalculated)
+            
+            # El inventario muestra nombre, tipo y rareza de cada item: cualquiera que tenga
+            # un item actualizado (equipado o no) necesita ficha e inventario nuevos
+            if kind == 'items' and existing:
+                item_ids = [old[0] for old in existing.values()]
+                for start in range(0, len(item_ids), self.chunk_size):
+                    chunk = item_ids[start:start + self.chunk_size]
+                    cursor.execute(f"""SELECT DISTINCT p.nombre FROM inventarios inv
+                                    JOIN personajes p ON p.id = inv.personaje_id
+                                    WHERE inv.item_id IN ({', '.join('?' * len(chunk))})""", chunk)
+                    holders.update(r[0] for r in cursor.fetchall())
+            conn.commit()
+        created = [name for name in names if name not in existing]
+        updated = [name for name in names if name in existing]
+        return report, created, updated, holders
+    
+    def import_records(self, kind, records, dry_run=False):
+        columns, rows, errors = self.validate(kind, records)
+        if errors:
+            shown = errors[:self.MAX_REPORTED_ERRORS]
+            if len(errors) > len(shown):
+                shown.append(f"... y {len(errors) - len(shown)} errores más")
+            raise CatalogError('\n'.join(shown))
+        if not rows:
+            raise CatalogError("el archivo no tiene filas")
+        
+        report, created, updated, holders = self._upsert(kind, columns, rows, dry_run)
+        for name in created:
+            name_index.add(kind, name)
+        for name in updated:
+            if kind in self.EMBED_KIND:
+                embed_cache.bump(self.EMBED_KIND[kind], name)
+        for name in holders:
+            embed_cache.bump_character(name)
+        logger.info(f"📚 Catálogo {kind}{' (simulado)' if dry_run else ''}: {report}")
+        return report
+    
+    def import_file(self, kind, path, dry_run=False):
+        fmt = self.detect_format(path)
+        with open(path, encoding='utf-8-sig', newline='') as f:
+            records = self.read_records(kind, f, fmt)
+        return self.import_records(kind, records, dry_run)
+    
+    def import_bytes(self, kind, filename, data, dry_run=False):
+        fmt = self.detect_format(filename)
+        try:
+            text = data.decode('utf-8-sig')
+        except UnicodeDecodeError:
+            raise CatalogError("el archivo debe estar en UTF-8") from None
+        return self.import_records(kind, self.read_records(kind, io.StringIO(text, newline=''), fmt), dry_run)
+    
+    def iter_rows(self, kind):
+        """Filas de la tabla como dicts, leídas por bloques de chunk_size"""
+        columns = list(self.FIELDS[kind])
+        with db.get_connection(readonly=True) as conn:
+            cursor = conn.execute(f"SELECT {', '.join(columns)} FROM {kind} ORDER BY nombre")
+            while True:
+                chunk = cursor.fetchmany(self.chunk_size)
+                if not chunk:
+                    break
+                for row in chunk:
+                    record = dict(zip(columns, row))
+                    for column, (kind_of, _) in self.FIELDS[kind].items():
+                        if kind_of is bool and record[column] is not None:
+                            record[column] = bool(record[column])
+                    yield record
+    
+    def export(self, kind, fmt, path):
+        """Escribe el catálogo en path sin cargar la tabla entera en memoria; retorna el número de filas"""
+        yaml = self._yaml() if fmt == 'yaml' else None
+        count = 0
+        temp_path = f"{path}.tmp"
+        with open(temp_path, 'w', encoding='utf-8', newline='') as f:
+            if fmt == 'csv':
+                writer = csv.DictWriter(f, fieldnames=list(self.FIELDS[kind]))
+                writer.writeheader()
+            elif fmt == 'json':
+                f.write('[')
+            for record in self.iter_rows(kind):
+                if fmt == 'csv':
+                    writer.writerow(record)
+                elif fmt == 'json':
+                    f.write((',\n ' if count else '\n ') + json.dumps(record, ensure_ascii=False))
+                else:
+                    f.write(yaml.safe_dump([record], allow_unicode=True, sort_keys=False))
+                count += 1
+            if fmt == 'json':
+                f.write('\n]\n' if count else ']\n')
+            elif fmt == 'yaml' and not count:
+                f.write('[]\n')
+        os.replace(temp_path, path)
+        logger.info(f"📤 Catálogo {kind} exportado a {path}: {count} filas")
+        return count
+
+catalog = CatalogManager(config.CATALOG_CHUNK_SIZE)
+
+# ============= ESCENAS DE COMBATE =============
+class Combatant:
+    """Participante de una escena; __slots__ mantiene compactas las escenas con muchos NPCs"""
+    __slots__ = ('name', 'kind', 'hp', 'max_hp', 'speed', 'initiative', 'conditions', 'count')
+    
+    def __init__(self, name, kind, hp, max_hp, speed, initiative, conditions=(), count=1):
+        self.name = name
+        self.kind = kind  # 'personaje' o 'npc'
+        self.hp = hp
+        self.max_hp = max_hp
+        self.speed = speed
+        self.initiative = initiative
+        self.conditions = list(conditions)
+        self.count = count  # unidades de un NPC sincronizado; comparten PG (FIXED_HP por unidad)
+    
+    @property
+    def down(self):
+        return self.hp <= 0
+    
+    @property
+    def units_standing(self):
+        return -(-self.hp // config.FIXED_HP) if self.hp > 0 else 0
+    
+    def as_row(self, channel_id, position):
+        return (channel_id, self.name, self.kind, self.hp, self.max_hp, self.speed, self.initiative,
+                json.dumps(self.conditions, ensure_ascii=False), self.count, position)
+
+class Scene:
+    """Escena de un canal: participantes por iniciativa (empate: personajes primero), ronda y turno"""
+    def __init__(self, channel_id, round_number=1, turn=0):
+        self.channel_id = channel_id
+        self.round = round_number
+        self.turn = turn
+        self.order = []
+    
+    @property
+    def current(self):
+        return self.order[self.turn] if self.order else None
+    
+    def find(self, name):
+        key = NameIndex.normalize(name)
+        return next((c for c in self.order if NameIndex.normalize(c.name) == key), None)
+    
+    def add(self, combatant):
+        current = self.current
+        self.order.append(combatant)
+        self.order.sort(key=lambda c: (-c.initiative, c.kind != 'personaje', c.name))
+        if current is not None:
+            self.turn = self.order.index(current)
+    
+    def remove(self, combatant):
+        index = self.order.index(combatant)
+        self.order.pop(index)
+        if index < self.turn:
+            self.turn -= 1
+        if self.turn >= len(self.order):
+            self.turn = 0
+    
+    def advance(self):
+        """Pasa al siguiente participante en pie; al dar la vuelta empieza una ronda nueva"""
+        if all(c.down for c in self.order):
+            return None
+        while True:
+            self.turn += 1
+            if self.turn >= len(self.order):
+                self.turn = 0
+                self.round += 1
+            if not self.current.down:
+                return self.current
+
+class EncounterManager:
+    """Escenas vivas por canal. Cada cambio solo marca la escena; un volcado periódico escribe en
+    SQLite todas las marcadas en una transacción. Las escenas solo se modifican desde el event loop
+    (comandos), así que no llevan lock: el volcado copia las filas antes de pasar al executor."""
+    def __init__(self, flush_interval, max_participants):
+        self.flush_interval = flush_interval
+        self.max_participants = max_participants
+        self.scenes = {}  # canal_id (str) -> Scene
+        self._dirty = set()
+        self._task = None
+        self.counters = {'changes': 0, 'flushes': 0, 'errors': 0}
+    
+    def get(self, channel_id):
+        return self.scenes.get(str(channel_id))
+    
+    def get_or_create(self, channel_id):
+        channel_id = str(channel_id)
+        if channel_id not in self.scenes:
+            self.scenes[channel_id] = Scene(channel_id)
+        return self.scenes[channel_id]
+    
+    def touch(self, scene):
+        self._dirty.add(scene.channel_id)
+        self.counters['changes'] += 1
+    
+    def end(self, channel_id):
+        scene = self.scenes.pop(str(channel_id), None)
+        if scene is not None:
+            self._dirty.add(scene.channel_id)
+        return scene
+    
+    @staticmethod
+    def load_participant(name, session=None):
+        """Personaje: iniciativa 1d20 + velocidad (con bonos). NPC: su velocidad fija, sin dados.
+        Los NPC sincronizados suman FIXED_HP por unidad."""
+        base_stats = stats_manager.read_character_stats(name)
+        if base_stats:
+            bonuses = inventory_system.calculate_equipped_bonuses(name)
+            speed = DiceSystem.combine_stats(base_stats, bonuses)['velocidad']['total']
+            roll = int(dice_engine.roll(1, 20, session)[0])
+            roll_history.record('personaje', name, 'iniciativa', roll + speed, session, dice_count=1, dice_type=20,
+                                dice=[roll], attribute='velocidad', attribute_value=speed,
+                                critical=roll == 20, fumble=roll == 1)
+            return Combatant(name, 'personaje', config.FIXED_HP, config.FIXED_HP, speed, roll + speed)
+        
+        with db.get_connection(readonly=True) as conn:
+            row = conn.execute("SELECT velocidad, sincronizado, cantidad FROM npcs WHERE nombre = ?", (name,)).fetchone()
+        if not row:
+            return None
+        speed, synced, count = row
+        count = count if synced and count else 1
+        return Combatant(name, 'npc', config.FIXED_HP * count, config.FIXED_HP * count, speed, speed, count=count)
+    
+    def _snapshot(self):
+        dirty, self._dirty = self._dirty, set()
+        snapshot = []
+        for channel_id in dirty:
+            scene = self.scenes.get(channel_id)
+            if scene is None:
+                snapshot.append((channel_id, None, []))
+            else:
+                snapshot.append((channel_id, (scene.round, scene.turn),
+                                 [c.as_row(channel_id, position) for position, c in enumerate(scene.order)]))
+        return snapshot
+    
+    @staticmethod
+    def _write(snapshot):
+        with db.get_connection() as conn:
+            cursor = conn.cursor()
+            for channel_id, state, rows in snapshot:
+                cursor.execute("DELETE FROM escena_participantes WHERE canal_id = ?", (channel_id,))
+                if state is None:
+                    cursor.execute("DELETE FROM escenas WHERE canal_id = ?", (channel_id,))
+                    continue
+                cursor.execute("""INSERT INTO escenas (canal_id, ronda, turno) VALUES (?, ?, ?)
+                                ON CONFLICT(canal_id) DO UPDATE SET ronda = excluded.ronda, turno = excluded.turno,
+                                updated_at = CURRENT_TIMESTAMP""", (channel_id, *state))
+                cursor.executemany(SQL_INSERT_SCENE_PARTICIPANT, rows)
+            conn.commit()
+    
+    async def flush(self):
+        if not self._dirty:
+            return
+        snapshot = self._snapshot()
+        try:
+            await data_access.run("db.escenas_guardar", self._write, snapshot)
+            self.counters['flushes'] += 1
+        except Exception as e:
+            self.counters['errors'] += 1
+            self._dirty.update(channel_id for channel_id, _, _ in snapshot)
+            logger.warning(f"⚠️ No se pudieron guardar {len(snapshot)} escenas: {e}")
+    
+    def flush_sync(self):
+        if self._dirty:
+            self._write(self._snapshot())
+    
+    def load(self):
+        """Restaura las escenas guardadas al arrancar"""
+        with db.get_connection(readonly=True) as conn:
+            scenes = conn.execute("SELECT canal_id, ronda, turno FROM escenas").fetchall()
+            participants = conn.execute("""SELECT canal_id, nombre, tipo, pg, pg_max, velocidad, iniciativa,
+                                        condiciones, cantidad FROM escena_participantes
+                                        ORDER BY canal_id, orden""").fetchall()
+        self.scenes = {channel_id: Scene(channel_id, round_number, turn) for channel_id, round_number, turn in scenes}
+        for channel_id, name, kind, hp, max_hp, speed, initiative, conditions, count in participants:
+            scene = self.scenes.get(channel_id)
+            if scene is not None:
+                scene.order.append(Combatant(name, kind, hp, max_hp, speed, initiative,
+                                             json.loads(conditions or '[]'), count or 1))
+        for scene in self.scenes.values():
+            scene.turn = min(scene.turn, max(len(scene.order) - 1, 0))
+        if self.scenes:
+            logger.info(f"⚔️ {len(self.scenes)} escenas restauradas")
+    
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            await self.flush()
+    
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self._run())
+    
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()
+    
+    @staticmethod
+    def render(scene):
+        embed = discord.Embed(title=f"⚔️ Escena · Ronda {scene.round}", color=0xcc3333)
+        lines = []
+        for position, c in enumerate(scene.order):
+            marker = "▶️" if position == scene.turn else "💀" if c.down else "▫️"
+            units = f" x{c.units_standing}/{c.count}" if c.count > 1 else ""
+            conditions = f" · _{', '.join(c.conditions)}_" if c.conditions else ""
+            icon = "🎭" if c.kind == 'personaje' else "👹"
+            lines.append(f"{marker} `{c.initiative:>3}` {icon} **{c.name}**{units} ❤️ {max(c.hp, 0)}/{c.max_hp}{conditions}")
+        embed.description = '\n'.join(lines)[:4096] if lines else "Sin participantes: usa /escena_unir"
+        if scene.current is not None:
+            embed.set_footer(text=f"Turno de {scene.current.name}")
+        return embed
+
+encounters = EncounterManager(config.SCENE_FLUSH_INTERVAL, config.MAX_SCENE_PARTICIPANTS)
+
+async def scene_participant_autocomplete(interaction: discord.Interaction, current: str):
+    scene = encounters.get(interaction.channel_id)
+    if scene is None:
+        return []
+    key = NameIndex.normalize(current)
+    return [app_commands.Choice(name=c.name[:100], value=c.name)
+            for c in scene.order if key in NameIndex.normalize(c.name)][:NameIndex.MAX_CHOICES]
+
+# ============= SINCRONIZACIÓN CON SHEETS EN SEGUNDO PLANO =============
+class SheetsSyncQueue:
+    """Conjunto acotado de personajes pendientes; varios cambios de uno se fusionan en una escritura"""
+    def __init__(self, backend, batch_size, max_pending, flush_interval, max_backoff):
+        self.backend = backend
+        self.batch_size = batch_size
+        self.max_pending = max_pending
+        self.flush_interval = flush_interval
+        self.max_backoff = max_backoff
+        self.backoff = 0.0
+        self._pending = OrderedDict()  # nombre -> None, en orden de llegada
+        self._lock = threading.Lock()
+        self._loop = None
+        self._wakeup = None
+        self._task = None
+        self._jitter = random.Random()
+        self.counters = {'marked': 0, 'coalesced': 0, 'dropped': 0, 'synced': 0,
+                         'batches': 0, 'quota_errors': 0, 'errors': 0}
+    
+    def mark_dirty(self, character_name):
+        """Apunta un personaje para sincronizar; seguro desde el event loop y desde hilos del executor"""
+        if not self.backend.available:
+            return
+        with self._lock:
+            self.counters['marked'] += 1
+            if character_name in self._pending:
+                self.counters['coalesced'] += 1
+            else:
+                self._pending[character_name] = None
+                while len(self._pending) > self.max_pending:
+                    self._pending.popitem(last=False)
+                    self.counters['dropped'] += 1
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(self._wakeup.set)
+    
+    def _take_batch(self):
+        with self._lock:
+            names = []
+            while self._pending and len(names) < self.batch_size:
+                names.append(self._pending.popitem(last=False)[0])
+            return names
+    
+    def _requeue(self, names):
+        with self._lock:
+            for name in reversed(names):
+                if name not in self._pending:
+                    self._pending[name] = None
+                    self._pending.move_to_end(name, last=False)
+    
+    def _write_batch(self, names):
+        """Lee stats y bonos del lote en bloque y los escribe con una sola llamada al backend"""
+        base_stats = stats_manager.read_many_character_stats(names)
+        bonuses = inventory_system.calculate_many_equipped_bonuses(list(base_stats))
+        characters = {name: DiceSystem.combine_stats(stats, bonuses[name]) for name, stats in base_stats.items()}
+        if characters:
+            self.backend.write_characters(characters)
+        return len(characters)
+    
+    async def flush(self):
+        """Vacía la cola en lotes; ante un 429 reencola el lote y espera con backoff exponencial"""
+        while True:
+            names = self._take_batch()
+            if not names:
+                return
+            try:
+                written = await data_access.run("sheets.sync_lote", self._write_batch, names)
+                self.counters['synced'] += written
+                self.counters['batches'] += 1 if written else 0
+                self.backoff = 0.0
+            except SheetsQuotaError:
+                self.counters['quota_errors'] += 1
+                self._requeue(names)
+                self.backoff = min(max(self.backoff * 2, 1.0), self.max_backoff)
+                delay = self.backoff * (1 + self._jitter.random() / 4)
+                logger.warning(f"⏳ Cuota de Google Sheets agotada, reintento en {delay:.1f}s")
+                await asyncio.sleep(delay)
+            except Exception as e:
+                # El siguiente cambio del personaje lo vuelve a marcar; no se reintenta indefinidamente
+                self.counters['errors'] += 1
+                logger.warning(f"⚠️ No se pudo sincronizar con Google Sheets ({len(names)} personajes): {e}")
+    
+    async def _run(self):
+        while True:
+            await self._wakeup.wait()
+            await asyncio.sleep(self.flush_interval)  # ventana para fusionar cambios repetidos
+            self._wakeup.clear()
+            await self.flush()
+    
+    def start(self):
+        if self._task is not None or not self.backend.available:
+            return
+        self._loop = asyncio.get_running_loop()
+        self._wakeup = asyncio.Event()
+        if self._pending:
+            self._wakeup.set()
+        self._task = self._loop.create_task(self._run())
+    
+    async def stop(self):
+        """Detiene el trabajador e intenta un último vaciado de lo pendiente"""
+        if self._task is None:
+            return
+        self._task.cancel()
         try:
-            with db.get_connection() as conn:
-                cursor = conn.cursor()
-                cursor.execute("""SELECT ataq_fisic, ataq_dist, ataq_magic, res_fisica, res_magica, velocidad,
-                                sincronizado, cantidad, imagen_url FROM npcs WHERE nombre = ?""", (npc_name,))
-                result = cursor.fetchone()
-                
-                if not result:
-                    return None
-                
-                ataq_fisic, ataq_dist, ataq_magic, res_fisica, res_magica, velocidad, sincronizado, cantidad, imagen_url = result
-                
-                # Mapeo de acciones para NPCs
-                action_mapping = {
-                    'fisico': ataq_fisic,
-                    'distancia': ataq_dist, 
-                    'magico': ataq_magic,
-                    'defensa_fisica': res_fisica,
-                    'defensa_magica': res_magica,
-                    'esquivar': velocidad
-                }
-                
-                if action_type not in action_mapping:
-                    return None
-                
-                base_value = action_mapping[action_type]
-                
-                # Si está sincronizado, multiplica por cantidad
-                if sincronizado:
-                    total_value = base_value * cantidad
-                    action_description = f"{cantidad} {npc_name}s sincronizados"
-                else:
-                    total_value = base_value
-                    action_description = f"{npc_name}"
-                
-                # Determinar si es ataque o defensa
-                is_attack = action_type in ['fisico', 'distancia', 'magico']
-                action_category = "ataque" if is_attack else "defensa"
-                
-                logger.info(f"[NPC {action_category.upper()}] {action_description} - {action_type}: {total_value}")
-                
-                return {
-                    'npc_name': npc_name,
-                    'action_type': action_type,
-                    'action_category': action_category,
-                    'base_value': base_value,
-                    'total_value': total_value,
-                    'sincronizado': sincronizado,
-                    'cantidad': cantidad,
-                    'action_description': action_description,
-                    'imagen_url': imagen_url
-                }
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+        try:
+            await asyncio.wait_for(self.flush(), timeout=config.IO_TIMEOUT)
         except Exception as e:
-            logger.error(f"❌ Error en acción NPC: {e}")
-            return None
+            logger.warning(f"⚠️ Sincronización pendiente descartada al cerrar: {e}")
+    
+    @staticmethod
+    def active_character_names():
+        with db.get_connection(readonly=True) as conn:
+            cursor = conn.cursor()
+            cursor.execute("SELECT nombre FROM personajes WHERE estado = 'activo' ORDER BY nombre")
+            return [row[0] for row in cursor.fetchall()]
+    
+    def mark_all_active(self):
+        """Encola todos los personajes activos (sincronización inicial en segundo plano)"""
+        for character_name in self.active_character_names():
+            self.mark_dirty(character_name)
+    
+    def sync_all_active(self):
+        """Resincroniza en una sola escritura todos los activos: metadatos, addSheet, clear y update"""
+        if not self.backend.available:
+            return 0
+        return self._write_batch(self.active_character_names())
+    
+    def stats(self):
+        with self._lock:
+            return dict(self.counters, pending=len(self._pending), backoff=self.backoff)
 
-dice_system = DiceSystem()
+sheets_sync = SheetsSyncQueue(sheets_backend, config.SHEETS_BATCH_SIZE, config.SHEETS_MAX_PENDING,
+                              config.SHEETS_FLUSH_INTERVAL, config.SHEETS_MAX_BACKOFF)
 
 # ============= INTERACTIVE MENUS =============
 
@@ -502,8 +3960,10 @@ class NPCActionSelect(discord.ui.Select):
         
         super().__init__(placeholder="🎯 Selecciona la acción del NPC...", options=options)
     
+    @instrumented
     async def callback(self, interaction: discord.Interaction):
-        result = dice_system.npc_action(self.npc_name, self.values[0])
+        result = await data_access.run("db.npc_accion", dice_system.npc_action, self.npc_name, self.values[0],
+                                       interaction.channel_id)
         
         if not result:
             await interaction.response.send_message(f"❌ NPC **{self.npc_name}** no encontrado", ephemeral=True)
@@ -559,10 +4019,8 @@ class NPCActionSelect(discord.ui.Select):
             value_name = "🏆 **DAÑO**" if result['action_category'] == 'ataque' else "🛡️ **DEFENSA**"
             embed.add_field(name=value_name, value=f"**`{result['total_value']}`**", inline=True)
         
-        if result['imagen_url']:
-            embed.set_thumbnail(url=result['imagen_url'])
-        
-        await interaction.response.edit_message(embed=embed, view=None)
+        files = await image_handler.attach_thumbnail(embed, result['imagen_hash'], result['imagen_url'])
+        await interaction.response.edit_message(embed=embed, attachments=files, view=None)
 
 class EquipItemSelect(discord.ui.Select):
     def __init__(self, character_name, items):
@@ -582,37 +4040,43 @@ class EquipItemSelect(discord.ui.Select):
         
         super().__init__(placeholder="🎒 Selecciona un item para equipar/desequipar...", options=options)
     
+    @instrumented
     async def callback(self, interaction: discord.Interaction):
         item_name = self.values[0]
         
         try:
-            with db.get_connection() as conn:
-                cursor = conn.cursor()
-                
-                cursor.execute("""SELECT inv.id, inv.equipado FROM inventarios inv
-                                JOIN personajes p ON inv.personaje_id = p.id
-                                JOIN items i ON inv.item_id = i.id
-                                WHERE p.nombre = ? AND i.nombre = ?""", (self.character_name, item_name))
-                result = cursor.fetchone()
-                
-                if not result:
-                    await interaction.response.send_message(f"❌ **{self.character_name}** no tiene el item **{item_name}**", ephemeral=True)
-                    return
-                
-                inv_id, equipado = result
-                
-                if equipado:
-                    cursor.execute("UPDATE inventarios SET equipado = FALSE WHERE id = ?", (inv_id,))
-                    status = "desequipado"
-                    color = 0xff6600
-                    emoji = "📤"
-                else:
-                    cursor.execute("UPDATE inventarios SET equipado = TRUE WHERE id = ?", (inv_id,))
-                    status = "equipado"
-                    color = 0x00ff00
-                    emoji = "⚔️"
-                
-                conn.commit()
+            def toggle_equipped():
+                with db.get_connection() as conn:
+                    cursor = conn.cursor()
+                    
+                    cursor.execute(SQL_EQUIP_LOOKUP, (self.character_name, item_name))
+                    result = cursor.fetchone()
+                    
+                    if result:
+                        inv_id, equipado, personaje_id, item_id = result
+                        cursor.execute("UPDATE inventarios SET equipado = ? WHERE id = ?", (not equipado, inv_id))
+                        inventory_system.apply_equip_delta(cursor, personaje_id, item_id, -1 if equipado else 1)
+                        conn.commit()
+                        embed_cache.bump_character(self.character_name)
+                    return result
+            
+            result = await data_access.run("db.equipar_item", toggle_equipped)
+            
+            if not result:
+                await interaction.response.send_message(f"❌ **{self.character_name}** no tiene el item **{item_name}**", ephemeral=True)
+                return
+            
+            sheets_sync.mark_dirty(self.character_name)
+            
+            equipado = result[1]
+            if equipado:
+                status = "desequipado"
+                color = 0xff6600
+                emoji = "📤"
+            else:
+                status = "equipado"
+                color = 0x00ff00
+                emoji = "⚔️"
             
             embed = discord.Embed(title=f"{emoji} Item {status.title()}", 
                                 description=f"**{item_name}** {status} por **{self.character_name}**", 
@@ -641,39 +4105,119 @@ intents.message_content = True
 client = discord.Client(intents=intents)
 tree = app_commands.CommandTree(client)
 
+# ============= SINCRONIZACIÓN DE COMANDOS =============
+class CommandTreeSync:
+    """Sube el árbol de comandos sólo cuando cambia su JSON; reconexiones y RESUME no gastan cuota de Discord"""
+    def __init__(self, state_file, dev_guild_id=None, force=False):
+        self.state_file = state_file
+        self.guild = discord.Object(id=dev_guild_id) if dev_guild_id else None
+        self.force = force
+        self.checked = False  # el árbol no cambia dentro del proceso: basta con comprobarlo una vez
+        self._lock = asyncio.Lock()
+    
+    def scope(self, application_id):
+        return f"{application_id}:{self.guild.id if self.guild else 'global'}"
+    
+    def digest(self, tree):
+        payload = sorted((command.to_dict(tree) for command in tree.get_commands(guild=self.guild)),
+                         key=lambda command: (command.get('type', 1), command['name']))
+        return hashlib.sha256(json.dumps(payload, sort_keys=True, ensure_ascii=False).encode('utf-8')).hexdigest()
+    
+    def load_hashes(self):
+        try:
+            with open(self.state_file, encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+    
+    def save_hashes(self, hashes):
+        temp_path = f"{self.state_file}.tmp"
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            json.dump(hashes, f, indent=2)
+        os.replace(temp_path, self.state_file)
+    
+    async def sync(self, tree, application_id):
+        """Devuelve los comandos sincronizados, o None si el hash guardado coincide"""
+        async with self._lock:
+            if self.checked:
+                return None
+            if self.guild is not None:
+                tree.copy_global_to(guild=self.guild)
+            key = self.scope(application_id)
+            digest = self.digest(tree)
+            hashes = self.load_hashes()
+            if not self.force and hashes.get(key) == digest:
+                self.checked = True
+                logger.info(f"📡 Árbol de comandos sin cambios ({digest[:12]}); se omite la sincronización")
+                return None
+            synced = await tree.sync(guild=self.guild)
+            hashes[key] = digest
+            self.save_hashes(hashes)
+            self.checked = True
+            return synced
+
+command_sync = CommandTreeSync(config.COMMAND_HASH_FILE, config.DEV_GUILD_ID, config.FORCE_COMMAND_SYNC)
+
+sheets_startup = None  # conexión diferida a Sheets; se lanza una sola vez aunque on_ready se repita
+
+async def start_sheets_sync():
+    """Conecta Google Sheets fuera del camino crítico y encola la sincronización inicial"""
+    started = time.perf_counter()
+    try:
+        if not await data_access.run("sheets.conectar", sheets_backend.ensure_connected):
+            return
+    except Exception as e:
+        logger.warning(f"⚠️ Google Sheets no disponible: {e}")
+        return
+    logger.info(f"📄 Google Sheets listo en segundo plano ({time.perf_counter() - started:.2f}s)")
+    sheets_sync.start()
+    sheets_sync.mark_all_active()
+
 @client.event
 async def on_ready():
+    global sheets_startup
     logger.info(f"✅ {config.BOT_NAME} conectado como {client.user}")
+    if sheets_startup is None:
+        logger.info(f"⏱️ Listo en {time.perf_counter() - BOOT_STARTED:.2f}s desde el inicio del proceso")
+        sheets_startup = asyncio.create_task(start_sheets_sync())
     try:
-        synced = await tree.sync()
-        logger.info(f"📡 {len(synced)} comandos sincronizados")
+        synced = await command_sync.sync(tree, client.application_id)
+        if synced is not None:
+            target = f"el servidor {config.DEV_GUILD_ID}" if config.DEV_GUILD_ID else "global"
+            logger.info(f"📡 {len(synced)} comandos sincronizados ({target})")
     except Exception as e:
         logger.error(f"❌ Error sincronizando: {e}")
 
 # ============= COMANDOS PRINCIPALES =============
 
 @tree.command(name="crear_personaje", description="Crea un personaje con 10 PG fijos")
+@instrumented
 async def create_character(interaction: discord.Interaction, nombre: str, fuerza: int = 10, destreza: int = 10, 
                          velocidad: int = 10, resistencia: int = 10, inteligencia: int = 10, mana: int = 10,
                          descripcion: str = "Un aventurero misterioso", imagen: discord.Attachment = None):
     await interaction.response.defer()
     
     try:
-        imagen_url = None
-        if imagen:
-            imagen_url = await image_handler.save_image(imagen, 'personaje', nombre)
+        imagen_url, imagen_hash = await image_handler.save_image(imagen, 'personaje', nombre)
         
         initial_stats = {'fuerza': fuerza, 'destreza': destreza, 'velocidad': velocidad, 
                         'resistencia': resistencia, 'inteligencia': inteligencia, 'mana': mana}
         
-        excel_path = excel_manager.create_character_excel(nombre, interaction.user.id, initial_stats)
+        excel_path = f"{config.EXCEL_DIR}/activos/{nombre}.xlsx"
         
-        with db.get_connection() as conn:
-            cursor = conn.cursor()
-            cursor.execute("""INSERT INTO personajes (nombre, usuario_id, excel_path, descripcion, imagen_url) 
-                         VALUES (?, ?, ?, ?, ?)""",
-                         (nombre, str(interaction.user.id), excel_path, descripcion, imagen_url))
-            conn.commit()
+        def insert_character():
+            with db.get_connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute("""INSERT INTO personajes (nombre, usuario_id, excel_path, descripcion, imagen_url, imagen_hash) 
+                             VALUES (?, ?, ?, ?, ?, ?)""",
+                             (nombre, str(interaction.user.id), excel_path, descripcion, imagen_url, imagen_hash))
+                stats_manager.create_character_stats(cursor, nombre, cursor.lastrowid, initial_stats)
+                image_handler.retain(cursor, imagen_hash)
+                conn.commit()
+            name_index.add('personajes', nombre)
+        
+        await data_access.run("db.crear_personaje", insert_character)
+        sheets_sync.mark_dirty(nombre)
         
         embed = discord.Embed(title="🎭 ¡Personaje Creado!", description=f"**{nombre}** ha despertado en Unity", color=0x00ff00)
         embed.add_field(name="📝 Descripción", value=descripcion, inline=False)
@@ -686,10 +4230,8 @@ async def create_character(interaction: discord.Interaction, nombre: str, fuerza
                        value="**Ataques:**\n⚔️ Físico (Fuerza)\n🏹 Distancia (Destreza)\n🔮 Mágico (Maná)\n\n**Defensas:**\n🏃 Esquive (Velocidad)\n🛡️ Física (Resistencia)\n✨ Mágica (Destreza)", 
                        inline=True)
         
-        if imagen_url:
-            embed.set_thumbnail(url=imagen_url)
-        
-        await interaction.followup.send(embed=embed)
+        files = await image_handler.attach_thumbnail(embed, imagen_hash, imagen_url)
+        await interaction.followup.send(embed=embed, files=files)
         
     except sqlite3.IntegrityError:
         await interaction.followup.send(f"❌ El personaje **{nombre}** ya existe")
@@ -698,6 +4240,7 @@ async def create_character(interaction: discord.Interaction, nombre: str, fuerza
         await interaction.followup.send(f"❌ Error interno al crear **{nombre}**")
 
 @tree.command(name="crear_npc", description="Crea un NPC con las nuevas estadísticas")
+@instrumented
 async def create_npc(interaction: discord.Interaction, nombre: str, tipo: str = "general",
                     ataq_fisic: int = 10, ataq_dist: int = 10, ataq_magic: int = 10,
                     res_fisica: int = 10, res_magica: int = 10, velocidad: int = 10, mana: int = 10,
@@ -706,19 +4249,22 @@ async def create_npc(interaction: discord.Interaction, nombre: str, tipo: str =
     await interaction.response.defer()
     
     try:
-        imagen_url = None
-        if imagen:
-            imagen_url = await image_handler.save_image(imagen, 'npc', nombre)
+        imagen_url, imagen_hash = await image_handler.save_image(imagen, 'npc', nombre)
         
-        with db.get_connection() as conn:
-            cursor = conn.cursor()
-            cursor.execute("""INSERT INTO npcs (nombre, tipo, ataq_fisic, ataq_dist, ataq_magic,
-                            res_fisica, res_magica, velocidad, mana, descripcion, 
-                            sincronizado, cantidad, imagen_url) 
-                            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)""",
-                         (nombre, tipo, ataq_fisic, ataq_dist, ataq_magic, res_fisica, res_magica,
-                          velocidad, mana, descripcion, sincronizado, cantidad, imagen_url))
-            conn.commit()
+        def insert_npc():
+            with db.get_connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute("""INSERT INTO npcs (nombre, tipo, ataq_fisic, ataq_dist, ataq_magic,
+                                res_fisica, res_magica, velocidad, mana, descripcion, 
+                                sincronizado, cantidad, imagen_url, imagen_hash) 
+                                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)""",
+                             (nombre, tipo, ataq_fisic, ataq_dist, ataq_magic, res_fisica, res_magica,
+                              velocidad, mana, descripcion, sincronizado, cantidad, imagen_url, imagen_hash))
+                image_handler.retain(cursor, imagen_hash)
+                conn.commit()
+            name_index.add('npcs', nombre)
+        
+        await data_access.run("db.crear_npc", insert_npc)
         
         embed = discord.Embed(title="👹 ¡NPC Creado!", description=f"**{nombre}** añadido al universo", color=0xff4444)
         embed.add_field(name="🏷️ Tipo", value=tipo.title(), inline=True)
@@ -744,10 +4290,8 @@ async def create_npc(interaction: discord.Interaction, nombre: str, tipo: str =
         embed.add_field(name="💥 Ataques", value=damage_text, inline=True)
         embed.add_field(name="🛡️ Defensas", value=defense_text, inline=True)
         
-        if imagen_url:
-            embed.set_thumbnail(url=imagen_url)
-        
-        await interaction.followup.send(embed=embed)
+        files = await image_handler.attach_thumbnail(embed, imagen_hash, imagen_url)
+        await interaction.followup.send(embed=embed, files=files)
         
     except sqlite3.IntegrityError:
         await interaction.followup.send(f"❌ El NPC **{nombre}** ya existe")
@@ -756,6 +4300,7 @@ async def create_npc(interaction: discord.Interaction, nombre: str, tipo: str =
         await interaction.followup.send(f"❌ Error interno al crear NPC **{nombre}**")
 
 @tree.command(name="crear_item", description="Crea un item equipable con efectos")
+@instrumented
 async def create_item(interaction: discord.Interaction, nombre: str, tipo: str, descripcion: str = "",
                      efecto_fuerza: int = 0, efecto_destreza: int = 0, efecto_velocidad: int = 0,
                      efecto_resistencia: int = 0, efecto_inteligencia: int = 0, efecto_mana: int = 0,
@@ -763,19 +4308,23 @@ async def create_item(interaction: discord.Interaction, nombre: str, tipo: str,
     await interaction.response.defer()
     
     try:
-        imagen_url = None
-        if imagen:
-            imagen_url = await image_handler.save_image(imagen, 'item', nombre)
+        imagen_url, imagen_hash = await image_handler.save_image(imagen, 'item', nombre)
         
-        with db.get_connection() as conn:
-            cursor = conn.cursor()
-            cursor.execute("""INSERT INTO items (nombre, tipo, descripcion, efecto_fuerza, efecto_destreza,
-                            efecto_velocidad, efecto_resistencia, efecto_inteligencia, efecto_mana,
-                            rareza, precio, imagen_url)
-                            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)""",
-                         (nombre, tipo, descripcion, efecto_fuerza, efecto_destreza, efecto_velocidad,
-                          efecto_resistencia, efecto_inteligencia, efecto_mana, rareza, precio, imagen_url))
-            conn.commit()
+        def insert_item():
+            with db.get_connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute("""INSERT INTO items (nombre, tipo, descripcion, efecto_fuerza, efecto_destreza,
+                                efecto_velocidad, efecto_resistencia, efecto_inteligencia, efecto_mana,
+                                rareza, precio, imagen_url, imagen_hash)
+                                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)""",
+                             (nombre, tipo, descripcion, efecto_fuerza, efecto_destreza, efecto_velocidad,
+                              efecto_resistencia, efecto_inteligencia, efecto_mana, rareza, precio, imagen_url,
+                              imagen_hash))
+                image_handler.retain(cursor, imagen_hash)
+                conn.commit()
+            name_index.add('items', nombre)
+        
+        await data_access.run("db.crear_item", insert_item)
         
         embed = discord.Embed(title="✨ ¡Item Creado!", description=f"**{nombre}** ha sido forjado", color=0x9932cc)
         embed.add_field(name="🏷️ Tipo", value=tipo.title(), inline=True)
@@ -803,10 +4352,8 @@ async def create_item(interaction: discord.Interaction, nombre: str, tipo: str,
         if effects:
             embed.add_field(name="⚡ Efectos", value='\n'.join(effects), inline=False)
         
-        if imagen_url:
-            embed.set_thumbnail(url=imagen_url)
-        
-        await interaction.followup.send(embed=embed)
+        files = await image_handler.attach_thumbnail(embed, imagen_hash, imagen_url)
+        await interaction.followup.send(embed=embed, files=files)
         
     except sqlite3.IntegrityError:
         await interaction.followup.send(f"❌ El item **{nombre}** ya existe")
@@ -817,43 +4364,59 @@ async def create_item(interaction: discord.Interaction, nombre: str, tipo: str,
 # ============= COMANDOS DE BORRADO (NUEVOS) =============
 
 @tree.command(name="borrar_personaje", description="Borra tu personaje (solo el creador puede borrarlo)")
+@app_commands.autocomplete(personaje=personaje_autocomplete)
+@instrumented
 async def delete_character(interaction: discord.Interaction, personaje: str):
     await interaction.response.defer()
     
     try:
-        with db.get_connection() as conn:
-            cursor = conn.cursor()
-            
-            # Verificar que el personaje existe y pertenece al usuario
-            cursor.execute("SELECT id, usuario_id, excel_path FROM personajes WHERE nombre = ?", (personaje,))
-            result = cursor.fetchone()
-            
-            if not result:
-                await interaction.followup.send(f"❌ Personaje **{personaje}** no encontrado")
-                return
-            
-            char_id, owner_id, excel_path = result
-            
-            if owner_id != str(interaction.user.id):
-                await interaction.followup.send("❌ Solo puedes borrar tus propios personajes")
-                return
-            
-            # Borrar inventario del personaje
-            cursor.execute("DELETE FROM inventarios WHERE personaje_id = ?", (char_id,))
-            
-            # Borrar personaje de la base de datos
-            cursor.execute("DELETE FROM personajes WHERE id = ?", (char_id,))
-            conn.commit()
-            
-            # Mover archivo Excel a carpeta de archivados
-            try:
-                import shutil
-                if os.path.exists(excel_path):
-                    archived_path = excel_path.replace('/activos/', '/archivados/')
-                    shutil.move(excel_path, archived_path)
-                    logger.info(f"📁 Excel movido a archivados: {archived_path}")
-            except Exception as e:
-                logger.warning(f"⚠️ No se pudo mover Excel: {e}")
+        def delete_rows():
+            with db.get_connection() as conn:
+                cursor = conn.cursor()
+                
+                # Verificar que el personaje existe y pertenece al usuario
+                cursor.execute("SELECT id, usuario_id, excel_path FROM personajes WHERE nombre = ?", (personaje,))
+                result = cursor.fetchone()
+                
+                if result and result[1] == str(interaction.user.id):
+                    char_id = result[0]
+                    
+                    # Borrar inventario y estadísticas del personaje
+                    cursor.execute("DELETE FROM inventarios WHERE personaje_id = ?", (char_id,))
+                    cursor.execute("DELETE FROM bonos_equipados WHERE personaje_id = ?", (char_id,))
+                    stats_manager.delete_character_stats(cursor, char_id, personaje)
+                    image_handler.release_entity(cursor, 'personajes', char_id)
+                    
+                    # Borrar personaje de la base de datos
+                    cursor.execute("DELETE FROM personajes WHERE id = ?", (char_id,))
+                    conn.commit()
+                    name_index.remove('personajes', personaje)
+                return result
+        
+        result = await data_access.run("db.borrar_personaje", delete_rows)
+        
+        if not result:
+            await interaction.followup.send(f"❌ Personaje **{personaje}** no encontrado")
+            return
+        
+        char_id, owner_id, excel_path = result
+        
+        if owner_id != str(interaction.user.id):
+            await interaction.followup.send("❌ Solo puedes borrar tus propios personajes")
+            return
+        
+        # Mover archivo Excel a carpeta de archivados
+        def archive_excel():
+            import shutil
+            if os.path.exists(excel_path):
+                archived_path = excel_path.replace('/activos/', '/archivados/')
+                shutil.move(excel_path, archived_path)
+                logger.info(f"📁 Excel movido a archivados: {archived_path}")
+        
+        try:
+            await data_access.run("excel.archivar", archive_excel)
+        except Exception as e:
+            logger.warning(f"⚠️ No se pudo mover Excel: {e}")
         
         embed = discord.Embed(
             title="🗑️ Personaje Borrado", 
@@ -870,24 +4433,34 @@ async def delete_character(interaction: discord.Interaction, personaje: str):
         await interaction.followup.send("❌ Error interno al borrar personaje")
 
 @tree.command(name="borrar_npc", description="Borra un NPC del universo")
+@app_commands.autocomplete(npc=npc_autocomplete)
+@instrumented
 async def delete_npc(interaction: discord.Interaction, npc: str):
     await interaction.response.defer()
     
     try:
-        with db.get_connection() as conn:
-            cursor = conn.cursor()
-            
-            # Verificar que el NPC existe
-            cursor.execute("SELECT id FROM npcs WHERE nombre = ?", (npc,))
-            result = cursor.fetchone()
-            
-            if not result:
-                await interaction.followup.send(f"❌ NPC **{npc}** no encontrado")
-                return
-            
-            # Borrar NPC
-            cursor.execute("DELETE FROM npcs WHERE nombre = ?", (npc,))
-            conn.commit()
+        def delete_row():
+            with db.get_connection() as conn:
+                cursor = conn.cursor()
+                
+                # Verificar que el NPC existe
+                cursor.execute("SELECT id FROM npcs WHERE nombre = ?", (npc,))
+                result = cursor.fetchone()
+                
+                if result:
+                    # Borrar NPC
+                    image_handler.release_entity(cursor, 'npcs', result[0])
+                    cursor.execute("DELETE FROM npcs WHERE nombre = ?", (npc,))
+                    conn.commit()
+                    name_index.remove('npcs', npc)
+                    embed_cache.bump('npc', npc)
+                return result
+        
+        result = await data_access.run("db.borrar_npc", delete_row)
+        
+        if not result:
+            await interaction.followup.send(f"❌ NPC **{npc}** no encontrado")
+            return
         
         embed = discord.Embed(
             title="🗑️ NPC Borrado", 
@@ -935,6 +4508,8 @@ async def delete_npc(interaction: discord.Interaction, npc: str):
     app_commands.Choice(name="Defensa Mágica", value="defensa_magica"),
     app_commands.Choice(name="Defensa Esquive", value="defensa_esquive")
 ])
+@app_commands.autocomplete(personaje=personaje_autocomplete)
+@instrumented
 async def roll_dice(interaction: discord.Interaction, personaje: str, tipo_dado: int, cantidad: int, accion: str, bonificador: int = 0):
     await interaction.response.defer()
     
@@ -949,7 +4524,8 @@ async def roll_dice(interaction: discord.Interaction, personaje: str, tipo_dado:
             return
         
         # Ejecutar tirada
-        result = dice_system.roll_action(personaje, accion, cantidad, tipo_dado, bonificador)
+        result = await data_access.run("db.tirar", dice_system.roll_action, 
+                                       personaje, accion, cantidad, tipo_dado, bonificador, interaction.channel_id)
         
         if not result:
             await interaction.followup.send(f"❌ Personaje **{personaje}** no encontrado")
@@ -957,13 +4533,15 @@ async def roll_dice(interaction: discord.Interaction, personaje: str, tipo_dado:
         
         # Obtener imagen del personaje
         try:
-            with db.get_connection() as conn:
-                cursor = conn.cursor()
-                cursor.execute("SELECT imagen_url FROM personajes WHERE nombre = ?", (personaje,))
-                imagen_result = cursor.fetchone()
-                imagen_url = imagen_result[0] if imagen_result else None
+            def fetch_image():
+                with db.get_connection(readonly=True) as conn:
+                    cursor = conn.cursor()
+                    cursor.execute("SELECT imagen_url, imagen_hash FROM personajes WHERE nombre = ?", (personaje,))
+                    return cursor.fetchone() or (None, None)
+            
+            imagen_url, imagen_hash = await data_access.run("db.tirar_imagen", fetch_image)
         except:
-            imagen_url = None
+            imagen_url, imagen_hash = None, None
         
         # Determinar color y descripción
         if 'ataque' in result['action_type']:
@@ -997,29 +4575,218 @@ async def roll_dice(interaction: discord.Interaction, personaje: str, tipo_dado:
             embed.add_field(name="➕ Bonus", value=f"`{bonificador}`", inline=True)
         embed.add_field(name="🏆 **TOTAL**", value=f"**`{result['total']}`**", inline=False)
         
-        if imagen_url:
-            embed.set_thumbnail(url=imagen_url)
+        files = await image_handler.attach_thumbnail(embed, imagen_hash, imagen_url)
+        await interaction.followup.send(embed=embed, files=files)
+        
+    except Exception as e:
+        logger.error(f"❌ Error en tirada: {e}")
+        await interaction.followup.send("❌ Error interno")
+
+@tree.command(name="tirada_grupal", description="Tiradas de varios personajes y NPCs en un solo mensaje")
+@app_commands.describe(
+    acciones="Nombre:acción[:NdM] separados por comas, p. ej. Finn:ataque_fisico, Goblin:fisico",
+    tipo_dado="Tipo de dado por defecto",
+    cantidad="Cantidad de dados por defecto (1-5)",
+    bonificador="Bonificador para todas las tiradas de personajes"
+)
+@app_commands.choices(tipo_dado=[
+    app_commands.Choice(name="d3", value=3),
+    app_commands.Choice(name="d6", value=6),
+    app_commands.Choice(name="d8", value=8),
+    app_commands.Choice(name="d10", value=10),
+    app_commands.Choice(name="d12", value=12),
+    app_commands.Choice(name="d20", value=20)
+])
+@instrumented
+async def group_roll(interaction: discord.Interaction, acciones: str, tipo_dado: int = 20, cantidad: int = 1,
+                     bonificador: int = 0):
+    await interaction.response.defer()
+    
+    try:
+        try:
+            entries = dice_system.parse_group_actions(acciones, cantidad, tipo_dado)
+        except ValueError as e:
+            await interaction.followup.send(f"❌ {e}")
+            return
+        
+        results = await data_access.run("db.tirada_grupal", dice_system.roll_group, entries, bonificador,
+                                        interaction.channel_id)
+        
+        embed = discord.Embed(title="⚔️ Tirada Grupal", color=0x7289da)
+        for result in results:
+            if result['kind'] == 'personaje':
+                dice_display = ' + '.join(map(str, result['dice_rolls']))
+                value = (f"🎲 {result['dice_count']}d{result['dice_type']} `{dice_display}` + "
+                         f"{result['attribute_name']} `{result['attribute']}`")
+                if bonificador != 0:
+                    value += f" + Bonus `{bonificador}`"
+                value += f" = **`{result['total']}`**"
+                if result['is_critical']:
+                    value += "\n🎯 **¡CRÍTICO!**"
+                elif result['is_fumble']:
+                    value += "\n💥 **¡PIFIA!**"
+                title = f"{result['name']} - {result['action_type'].replace('_', ' ').title()}"
+            elif result['kind'] == 'npc':
+                value = f"👹 {result['action_description']}: **`{result['total_value']}`**"
+                title = f"{result['name']} - {result['action_type'].replace('_', ' ').title()}"
+            else:
+                value = f"❌ {result['error']}"
+                title = result['name']
+            embed.add_field(name=title[:256], value=value, inline=False)
+        
+        embed.set_footer(text=f"{len(results)} acciones resueltas")
+        await interaction.followup.send(embed=embed)
+        
+    except Exception as e:
+        logger.error(f"❌ Error en tirada grupal: {e}")
+        await interaction.followup.send("❌ Error interno")
+
+@tree.command(name="probabilidad", description="Probabilidad exacta de que una tirada alcance un objetivo")
+@app_commands.describe(
+    personaje="Nombre del personaje",
+    accion="Tipo de acción",
+    objetivo="Total a igualar o superar",
+    tipo_dado="Tipo de dado",
+    cantidad="Cantidad de dados (1-5)",
+    bonificador="Bonificador adicional"
+)
+@app_commands.choices(tipo_dado=[
+    app_commands.Choice(name="d3", value=3),
+    app_commands.Choice(name="d6", value=6),
+    app_commands.Choice(name="d8", value=8),
+    app_commands.Choice(name="d10", value=10),
+    app_commands.Choice(name="d12", value=12),
+    app_commands.Choice(name="d20", value=20)
+])
+@app_commands.choices(accion=[
+    app_commands.Choice(name="Ataque Físico", value="ataque_fisico"),
+    app_commands.Choice(name="Ataque Mágico", value="ataque_magico"),
+    app_commands.Choice(name="Ataque Distancia", value="ataque_distancia"),
+    app_commands.Choice(name="Defensa Física", value="defensa_fisica"),
+    app_commands.Choice(name="Defensa Mágica", value="defensa_magica"),
+    app_commands.Choice(name="Defensa Esquive", value="defensa_esquive")
+])
+@app_commands.autocomplete(personaje=personaje_autocomplete)
+@instrumented
+async def roll_probability(interaction: discord.Interaction, personaje: str, accion: str, objetivo: int,
+                           tipo_dado: int = 20, cantidad: int = 1, bonificador: int = 0):
+    await interaction.response.defer()
+    
+    try:
+        if cantidad < 1 or cantidad > config.MAX_DICE_COUNT:
+            await interaction.followup.send(f"❌ Cantidad de dados debe ser entre 1 y {config.MAX_DICE_COUNT}")
+            return
+        
+        attribute = await data_access.run("db.probabilidad", dice_system.action_attribute, personaje, accion)
+        if not attribute:
+            await interaction.followup.send(f"❌ Personaje **{personaje}** no encontrado")
+            return
+        
+        attr_name, attr_value = attribute
+        modifier = attr_value + bonificador
+        chance = dice_engine.probability_at_least(cantidad, tipo_dado, modifier, objetivo)
+        summary = dice_engine.summary(cantidad, tipo_dado, modifier)
+        
+        formula = f"{cantidad}d{tipo_dado} + {attr_name}({attr_value})"
+        if bonificador != 0:
+            formula += f" + Bonus({bonificador})"
+        
+        embed = discord.Embed(title=f"📈 Probabilidad - {personaje}",
+                              description=f"`{formula}` ≥ **{objetivo}**", color=0x0099ff)
+        embed.add_field(name="🎯 Probabilidad", value=f"**{chance:.2%}**", inline=True)
+        embed.add_field(name="📊 Media", value=f"`{summary['mean']:.1f}`", inline=True)
+        embed.add_field(name="↕️ Rango", value=f"`{summary['min']}` - `{summary['max']}`", inline=True)
+        embed.add_field(name="🌟 Crítico", value=f"`{summary['critical']:.2%}`", inline=True)
+        embed.add_field(name="💥 Pifia", value=f"`{summary['fumble']:.2%}`", inline=True)
+        
+        await interaction.followup.send(embed=embed)
+        
+    except Exception as e:
+        logger.error(f"❌ Error calculando probabilidad: {e}")
+        await interaction.followup.send("❌ Error interno")
+
+@tree.command(name="simular", description="Simula miles de combates entre personajes y NPCs")
+@app_commands.describe(
+    personaje="Personaje a simular (vacío = todos)",
+    npc="NPC rival (vacío = todo el bestiario)",
+    combates="Combates por enfrentamiento",
+    ataque="Ataque del personaje",
+    ataque_npc="Ataque del NPC",
+    tipo_dado="Tipo de dado",
+    cantidad="Cantidad de dados (1-5)"
+)
+@app_commands.choices(ataque=[
+    app_commands.Choice(name="Ataque Físico", value="ataque_fisico"),
+    app_commands.Choice(name="Ataque Mágico", value="ataque_magico"),
+    app_commands.Choice(name="Ataque Distancia", value="ataque_distancia")
+])
+@app_commands.choices(ataque_npc=[
+    app_commands.Choice(name="Físico", value="fisico"),
+    app_commands.Choice(name="Mágico", value="magico"),
+    app_commands.Choice(name="Distancia", value="distancia")
+])
+@app_commands.choices(tipo_dado=[
+    app_commands.Choice(name="d3", value=3),
+    app_commands.Choice(name="d6", value=6),
+    app_commands.Choice(name="d8", value=8),
+    app_commands.Choice(name="d10", value=10),
+    app_commands.Choice(name="d12", value=12),
+    app_commands.Choice(name="d20", value=20)
+])
+@app_commands.autocomplete(personaje=personaje_autocomplete, npc=npc_autocomplete)
+@instrumented
+async def simulate_combat(interaction: discord.Interaction, personaje: str = None, npc: str = None,
+                          combates: int = 1000, ataque: str = "ataque_fisico", ataque_npc: str = "fisico",
+                          tipo_dado: int = 20, cantidad: int = 1):
+    await interaction.response.defer()
+    
+    try:
+        if cantidad < 1 or cantidad > config.MAX_DICE_COUNT:
+            await interaction.followup.send(f"❌ Cantidad de dados debe ser entre 1 y {config.MAX_DICE_COUNT}")
+            return
+        
+        results = await data_access.run("sim.simular", combat_simulator.run,
+                                        [personaje] if personaje else None, [npc] if npc else None,
+                                        combates, cantidad, tipo_dado, ataque, ataque_npc, timeout=120)
+        if not results:
+            await interaction.followup.send("❌ No hay personajes o NPCs que coincidan")
+            return
         
+        shown = results[:20]
+        table = '\n'.join([combat_simulator.TABLE_HEADER] + [combat_simulator.format_row(row) for row in shown])
+        embed = discord.Embed(title="🧪 Simulación de Combate",
+                              description=f"```\n{table}\n```", color=0x9932cc)
+        embed.add_field(name="⚙️ Parámetros",
+                        value=f"{min(combates, config.SIM_MAX_TRIALS)} combates · {cantidad}d{tipo_dado} · "
+                              f"{ataque.replace('_', ' ')} vs {ataque_npc} · {config.FIXED_HP} PG (x cantidad si sincronizado)",
+                        inline=False)
+        embed.set_footer(text=f"Mostrando {len(shown)} de {len(results)} enfrentamientos · "
+                              "Imp/ImpN: impactos propios/del NPC · R→N/R→P: rondas hasta derrotar al NPC/al personaje")
         await interaction.followup.send(embed=embed)
         
     except Exception as e:
-        logger.error(f"❌ Error en tirada: {e}")
+        logger.error(f"❌ Error simulando combate: {e}")
         await interaction.followup.send("❌ Error interno")
 
 @tree.command(name="tirada_npc", description="Ejecuta ataques y defensas de NPCs con stats fijas")
+@app_commands.autocomplete(npc=npc_autocomplete)
+@instrumented
 async def npc_roll(interaction: discord.Interaction, npc: str):
     try:
         # Verificar que el NPC existe
-        with db.get_connection() as conn:
-            cursor = conn.cursor()
-            cursor.execute("SELECT nombre, sincronizado, cantidad FROM npcs WHERE nombre = ?", (npc,))
-            result = cursor.fetchone()
-            
-            if not result:
-                await interaction.response.send_message(f"❌ NPC **{npc}** no encontrado", ephemeral=True)
-                return
-            
-            nombre, sincronizado, cantidad = result
+        def fetch_npc():
+            with db.get_connection(readonly=True) as conn:
+                cursor = conn.cursor()
+                cursor.execute("SELECT nombre, sincronizado, cantidad FROM npcs WHERE nombre = ?", (npc,))
+                return cursor.fetchone()
+        
+        result = await data_access.run("db.tirada_npc", fetch_npc)
+        
+        if not result:
+            await interaction.response.send_message(f"❌ NPC **{npc}** no encontrado", ephemeral=True)
+            return
+        
+        nombre, sincronizado, cantidad = result
         
         embed = discord.Embed(title=f"👹 {npc} - Seleccionar Acción", 
                             description="Elige el tipo de acción del NPC:", color=0xff4444)
@@ -1044,6 +4811,8 @@ async def npc_roll(interaction: discord.Interaction, npc: str):
 # ============= COMANDOS DE EDICIÓN =============
 
 @tree.command(name="editar_personaje", description="Edita las estadísticas e imagen de tu personaje")
+@app_commands.autocomplete(personaje=personaje_autocomplete)
+@instrumented
 async def edit_character(interaction: discord.Interaction, personaje: str, 
                         fuerza: int = None, destreza: int = None, velocidad: int = None,
                         resistencia: int = None, inteligencia: int = None, mana: int = None,
@@ -1051,27 +4820,24 @@ async def edit_character(interaction: discord.Interaction, personaje: str,
     await interaction.response.defer()
     
     try:
-        with db.get_connection() as conn:
-            cursor = conn.cursor()
-            cursor.execute("SELECT usuario_id FROM personajes WHERE nombre = ?", (personaje,))
-            result = cursor.fetchone()
+        def fetch_owner():
+            with db.get_connection(readonly=True) as conn:
+                cursor = conn.cursor()
+                cursor.execute("SELECT usuario_id FROM personajes WHERE nombre = ?", (personaje,))
+                return cursor.fetchone()
+        
+        result = await data_access.run("db.editar_personaje_permiso", fetch_owner)
+        
+        if not result:
+            await interaction.followup.send(f"❌ Personaje **{personaje}** no encontrado")
+            return
             
-            if not result:
-                await interaction.followup.send(f"❌ Personaje **{personaje}** no encontrado")
-                return
-                
-            if result[0] != str(interaction.user.id):
-                await interaction.followup.send("❌ Solo puedes editar tus propios personajes")
-                return
+        if result[0] != str(interaction.user.id):
+            await interaction.followup.send("❌ Solo puedes editar tus propios personajes")
+            return
         
         # Actualizar imagen si se proporciona
-        imagen_url = None
-        if imagen:
-            imagen_url = await image_handler.save_image(imagen, 'personaje', personaje)
-            with db.get_connection() as conn:
-                cursor = conn.cursor()
-                cursor.execute("UPDATE personajes SET imagen_url = ? WHERE nombre = ?", (imagen_url, personaje))
-                conn.commit()
+        imagen_url, imagen_hash = await image_handler.save_image(imagen, 'personaje', personaje)
         
         new_stats = {}
         if fuerza is not None: new_stats['fuerza'] = fuerza
@@ -1081,14 +4847,37 @@ async def edit_character(interaction: discord.Interaction, personaje: str,
         if inteligencia is not None: new_stats['inteligencia'] = inteligencia
         if mana is not None: new_stats['mana'] = mana
         
-        if new_stats:
-            excel_manager.update_character_stats(personaje, new_stats)
-        
-        if oro is not None:
-            with db.get_connection() as conn:
-                cursor = conn.cursor()
-                cursor.execute("UPDATE personajes SET oro = ? WHERE nombre = ?", (oro, personaje))
-                conn.commit()
+        def apply_updates():
+            """Stats, imagen y oro en una sola transacción: o se aplican todos o ninguno.
+            Retorna un mensaje de error para el usuario, o None si todo se aplicó."""
+            try:
+                with db.get_connection() as conn:
+                    cursor = conn.cursor()
+                    cursor.execute("SELECT id FROM personajes WHERE nombre = ?", (personaje,))
+                    row = cursor.fetchone()
+                    if row is None:
+                        return f"❌ Personaje **{personaje}** no encontrado"
+                    if new_stats and not StatsManager.write_character_stats(cursor, personaje, new_stats):
+                        conn.rollback()
+                        return f"❌ **{personaje}** no tiene estadísticas guardadas; no se aplicó ningún cambio"
+                    if imagen:
+                        image_handler.release_entity(cursor, 'personajes', row[0])
+                        cursor.execute("UPDATE personajes SET imagen_url = ?, imagen_hash = ? WHERE id = ?",
+                                     (imagen_url, imagen_hash, row[0]))
+                        image_handler.retain(cursor, imagen_hash)
+                    if oro is not None:
+                        cursor.execute("UPDATE personajes SET oro = ? WHERE id = ?", (oro, row[0]))
+                    conn.commit()
+                return None
+            finally:
+                stat_cache.invalidate(personaje)
+                embed_cache.bump('personaje', personaje)
+        
+        error = await data_access.run("db.editar_personaje", apply_updates)
+        if error:
+            await interaction.followup.send(error)
+            return
+        sheets_sync.mark_dirty(personaje)
         
         embed = discord.Embed(title="✏️ Personaje Editado", 
                             description=f"**{personaje}** actualizado exitosamente", 
@@ -1098,18 +4887,20 @@ async def edit_character(interaction: discord.Interaction, personaje: str,
             stats_text = '\n'.join([f"• **{k.title()}:** {v}" for k, v in new_stats.items()])
             embed.add_field(name="📊 Estadísticas Actualizadas", value=stats_text[:1024], inline=False)
         
+        files = []
         if imagen:
             embed.add_field(name="🖼️ Imagen", value="Actualizada", inline=True)
-            if imagen_url:
-                embed.set_thumbnail(url=imagen_url)
+            files = await image_handler.attach_thumbnail(embed, imagen_hash, imagen_url)
         
-        await interaction.followup.send(embed=embed)
+        await interaction.followup.send(embed=embed, files=files)
         
     except Exception as e:
         logger.error(f"❌ Error editando personaje: {e}")
         await interaction.followup.send("❌ Error interno")
 
 @tree.command(name="editar_npc", description="Edita las estadísticas de un NPC")
+@app_commands.autocomplete(npc=npc_autocomplete)
+@instrumented
 async def edit_npc(interaction: discord.Interaction, npc: str,
                   ataq_fisic: int = None, ataq_dist: int = None, ataq_magic: int = None,
                   res_fisica: int = None, res_magica: int = None, velocidad: int = None, mana: int = None,
@@ -1117,50 +4908,57 @@ async def edit_npc(interaction: discord.Interaction, npc: str,
     await interaction.response.defer()
     
     try:
-        with db.get_connection() as conn:
-            cursor = conn.cursor()
-            
-            cursor.execute("SELECT id FROM npcs WHERE nombre = ?", (npc,))
-            if not cursor.fetchone():
-                await interaction.followup.send(f"❌ NPC **{npc}** no encontrado")
-                return
-            
-            updates = []
-            params = []
-            
-            if ataq_fisic is not None:
-                updates.append("ataq_fisic = ?")
-                params.append(ataq_fisic)
-            if ataq_dist is not None:
-                updates.append("ataq_dist = ?")
-                params.append(ataq_dist)
-            if ataq_magic is not None:
-                updates.append("ataq_magic = ?")
-                params.append(ataq_magic)
-            if res_fisica is not None:
-                updates.append("res_fisica = ?")
-                params.append(res_fisica)
-            if res_magica is not None:
-                updates.append("res_magica = ?")
-                params.append(res_magica)
-            if velocidad is not None:
-                updates.append("velocidad = ?")
-                params.append(velocidad)
-            if mana is not None:
-                updates.append("mana = ?")
-                params.append(mana)
-            if sincronizado is not None:
-                updates.append("sincronizado = ?")
-                params.append(sincronizado)
-            if cantidad is not None:
-                updates.append("cantidad = ?")
-                params.append(cantidad)
-            
-            if updates:
-                params.append(npc)
-                query = f"UPDATE npcs SET {', '.join(updates)} WHERE nombre = ?"
-                cursor.execute(query, params)
-                conn.commit()
+        updates = []
+        params = []
+        
+        if ataq_fisic is not None:
+            updates.append("ataq_fisic = ?")
+            params.append(ataq_fisic)
+        if ataq_dist is not None:
+            updates.append("ataq_dist = ?")
+            params.append(ataq_dist)
+        if ataq_magic is not None:
+            updates.append("ataq_magic = ?")
+            params.append(ataq_magic)
+        if res_fisica is not None:
+            updates.append("res_fisica = ?")
+            params.append(res_fisica)
+        if res_magica is not None:
+            updates.append("res_magica = ?")
+            params.append(res_magica)
+        if velocidad is not None:
+            updates.append("velocidad = ?")
+            params.append(velocidad)
+        if mana is not None:
+            updates.append("mana = ?")
+            params.append(mana)
+        if sincronizado is not None:
+            updates.append("sincronizado = ?")
+            params.append(sincronizado)
+        if cantidad is not None:
+            updates.append("cantidad = ?")
+            params.append(cantidad)
+        
+        def update_npc():
+            with db.get_connection() as conn:
+                cursor = conn.cursor()
+                
+                cursor.execute("SELECT id FROM npcs WHERE nombre = ?", (npc,))
+                npc_exists = cursor.fetchone()
+                
+                if npc_exists and updates:
+                    params.append(npc)
+                    query = f"UPDATE npcs SET {', '.join(updates)} WHERE nombre = ?"
+                    cursor.execute(query, params)
+                    conn.commit()
+                    embed_cache.bump('npc', npc)
+                return npc_exists
+        
+        npc_exists = await data_access.run("db.editar_npc", update_npc)
+        
+        if not npc_exists:
+            await interaction.followup.send(f"❌ NPC **{npc}** no encontrado")
+            return
         
         embed = discord.Embed(title="✏️ NPC Editado", 
                             description=f"**{npc}** actualizado exitosamente", 
@@ -1175,21 +4973,19 @@ async def edit_npc(interaction: discord.Interaction, npc: str,
 # ============= COMANDOS DE INVENTARIO =============
 
 @tree.command(name="equipar_menu", description="Menú interactivo para equipar/desequipar items")
+@app_commands.autocomplete(personaje=personaje_autocomplete)
+@instrumented
 async def equip_menu(interaction: discord.Interaction, personaje: str):
     await interaction.response.defer()
     
     try:
-        with db.get_connection() as conn:
-            cursor = conn.cursor()
-            cursor.execute("""
-                SELECT i.nombre, inv.equipado, i.rareza
-                FROM inventarios inv
-                JOIN items i ON inv.item_id = i.id
-                JOIN personajes p ON inv.personaje_id = p.id
-                WHERE p.nombre = ? AND i.es_equipable = TRUE
-                ORDER BY inv.equipado DESC, i.nombre
-            """, (personaje,))
-            items = cursor.fetchall()
+        def fetch_items():
+            with db.get_connection(readonly=True) as conn:
+                cursor = conn.cursor()
+                cursor.execute(SQL_EQUIP_MENU, (personaje,))
+                return cursor.fetchall()
+        
+        items = await data_access.run("db.equipar_menu", fetch_items)
         
         if not items:
             await interaction.followup.send(f"❌ **{personaje}** no tiene items equipables")
@@ -1207,41 +5003,44 @@ async def equip_menu(interaction: discord.Interaction, personaje: str):
         await interaction.followup.send("❌ Error interno")
 
 @tree.command(name="dar_item", description="Entrega un item a un personaje")
+@app_commands.autocomplete(personaje=personaje_autocomplete, item=item_autocomplete)
+@instrumented
 async def give_item(interaction: discord.Interaction, personaje: str, item: str, cantidad: int = 1):
     await interaction.response.defer()
     
     try:
-        with db.get_connection() as conn:
-            cursor = conn.cursor()
-            
-            cursor.execute("SELECT id FROM personajes WHERE nombre = ?", (personaje,))
-            char_result = cursor.fetchone()
-            if not char_result:
-                await interaction.followup.send(f"❌ Personaje **{personaje}** no encontrado")
-                return
-            
-            cursor.execute("SELECT id, nombre FROM items WHERE nombre = ?", (item,))
-            item_result = cursor.fetchone()
-            if not item_result:
-                await interaction.followup.send(f"❌ Item **{item}** no encontrado")
-                return
-            
-            char_id, item_id = char_result[0], item_result[0]
-            
-            cursor.execute("SELECT id, cantidad FROM inventarios WHERE personaje_id = ? AND item_id = ?", 
-                         (char_id, item_id))
-            existing = cursor.fetchone()
-            
-            if existing:
-                cursor.execute("UPDATE inventarios SET cantidad = cantidad + ? WHERE id = ?", 
-                             (cantidad, existing[0]))
-                new_cantidad = existing[1] + cantidad
-            else:
-                cursor.execute("INSERT INTO inventarios (personaje_id, item_id, cantidad) VALUES (?, ?, ?)",
-                             (char_id, item_id, cantidad))
-                new_cantidad = cantidad
-            
-            conn.commit()
+        def add_to_inventory():
+            new_cantidad = None
+            with db.get_connection() as conn:
+                cursor = conn.cursor()
+                
+                cursor.execute("SELECT id FROM personajes WHERE nombre = ?", (personaje,))
+                char_result = cursor.fetchone()
+                
+                cursor.execute("SELECT id, nombre FROM items WHERE nombre = ?", (item,))
+                item_result = cursor.fetchone()
+                
+                if char_result and item_result:
+                    char_id, item_id = char_result[0], item_result[0]
+                    
+                    cursor.execute(SQL_GIVE_ITEM, (char_id, item_id, cantidad))
+                    cursor.execute("SELECT cantidad FROM inventarios WHERE personaje_id = ? AND item_id = ?", 
+                                 (char_id, item_id))
+                    new_cantidad = cursor.fetchone()[0]
+                    
+                    conn.commit()
+                    embed_cache.bump('inventario', personaje)
+                return char_result, item_result, new_cantidad
+        
+        char_result, item_result, new_cantidad = await data_access.run("db.dar_item", add_to_inventory)
+        
+        if not char_result:
+            await interaction.followup.send(f"❌ Personaje **{personaje}** no encontrado")
+            return
+        
+        if not item_result:
+            await interaction.followup.send(f"❌ Item **{item}** no encontrado")
+            return
         
         embed = discord.Embed(title="🎁 Item Entregado", 
                             description=f"**{item}** x{cantidad} entregado a **{personaje}**", 
@@ -1255,23 +5054,26 @@ async def give_item(interaction: discord.Interaction, personaje: str, item: str,
         await interaction.followup.send("❌ Error interno")
 
 @tree.command(name="inventario", description="Muestra el inventario de un personaje")
+@app_commands.autocomplete(personaje=personaje_autocomplete)
+@instrumented
 async def show_inventory(interaction: discord.Interaction, personaje: str):
     await interaction.response.defer()
     
     try:
-        with db.get_connection() as conn:
-            cursor = conn.cursor()
-            cursor.execute("""
-                SELECT i.nombre, i.tipo, i.rareza, inv.cantidad, inv.equipado,
-                       i.efecto_fuerza, i.efecto_destreza, i.efecto_velocidad,
-                       i.efecto_resistencia, i.efecto_inteligencia, i.efecto_mana
-                FROM inventarios inv
-                JOIN items i ON inv.item_id = i.id
-                JOIN personajes p ON inv.personaje_id = p.id
-                WHERE p.nombre = ?
-                ORDER BY inv.equipado DESC, i.nombre
-            """, (personaje,))
-            inventory = cursor.fetchall()
+        cached = embed_cache.get('inventario', personaje)
+        if cached:
+            await interaction.followup.send(embed=cached[0])
+            return
+        
+        version = embed_cache.version('inventario', personaje)
+        
+        def fetch_inventory():
+            with db.get_connection(readonly=True) as conn:
+                cursor = conn.cursor()
+                cursor.execute(SQL_INVENTORY, (personaje,))
+                return cursor.fetchall()
+        
+        inventory = await data_access.run("db.inventario", fetch_inventory)
         
         if not inventory:
             await interaction.followup.send(f"❌ **{personaje}** no tiene items o no existe")
@@ -1304,6 +5106,7 @@ async def show_inventory(interaction: discord.Interaction, personaje: str):
                 embed.add_field(name=field_name, value='\n'.join(chunk), inline=False)
         
         embed.set_footer(text=f"Total de tipos de items: {len(inventory)}")
+        embed_cache.put('inventario', personaje, version, embed)
         
         await interaction.followup.send(embed=embed)
         
@@ -1314,96 +5117,126 @@ async def show_inventory(interaction: discord.Interaction, personaje: str):
 # ============= COMANDOS DE INFORMACIÓN =============
 
 @tree.command(name="info_npc", description="Información completa de un NPC")
+@app_commands.autocomplete(npc=npc_autocomplete)
+@instrumented
 async def npc_info(interaction: discord.Interaction, npc: str):
     await interaction.response.defer()
     
     try:
-        with db.get_connection() as conn:
-            cursor = conn.cursor()
-            cursor.execute("SELECT * FROM npcs WHERE nombre = ?", (npc,))
-            npc_data = cursor.fetchone()
+        cached = embed_cache.get('npc', npc)
+        if cached:
+            embed, imagen_hash, imagen_url = cached
+            files = await image_handler.attach_thumbnail(embed, imagen_hash, imagen_url)
+            await interaction.followup.send(embed=embed, files=files)
+            return
+        
+        version = embed_cache.version('npc', npc)
+        
+        def fetch_npc():
+            with db.get_connection(readonly=True) as conn:
+                cursor = conn.cursor()
+                cursor.execute(SQL_NPC_INFO, (npc,))
+                row = cursor.fetchone()
+                return dict(zip([column[0] for column in cursor.description], row)) if row else None
+        
+        npc_data = await data_access.run("db.info_npc", fetch_npc)
         
         if not npc_data:
             await interaction.followup.send(f"❌ NPC **{npc}** no encontrado")
             return
         
         embed = discord.Embed(
-            title=f"👹 {npc_data[1]}", 
-            description=npc_data[10] or "Un ser misterioso del universo Unity", 
+            title=f"👹 {npc_data['nombre']}", 
+            description=npc_data['descripcion'] or "Un ser misterioso del universo Unity", 
             color=0xff4444
         )
         
-        embed.add_field(name="🏷️ Tipo", value=npc_data[2].title(), inline=True)
+        embed.add_field(name="🏷️ Tipo", value=(npc_data['tipo'] or "general").title(), inline=True)
         embed.add_field(name="❤️ Puntos de Golpe", value=f"{config.FIXED_HP} PG", inline=True)
         
         # Campos de sincronización
-        sincronizado = npc_data[12] if len(npc_data) > 12 else False
-        cantidad = npc_data[13] if len(npc_data) > 13 else 1
+        sincronizado = bool(npc_data['sincronizado'])
+        cantidad = npc_data['cantidad'] or 1
         
         if sincronizado:
             embed.add_field(name="🤝 Sincronizado", value=f"Sí ({cantidad} unidades)", inline=True)
         else:
             embed.add_field(name="👤 Individual", value="Sí", inline=True)
         
-        stats_text = f"⚔️ **ATAQ_FISIC:** {npc_data[3]}\n"
-        stats_text += f"🏹 **ATAQ_DIST:** {npc_data[4]}\n"
-        stats_text += f"🔮 **ATAQ_MAGIC:** {npc_data[5]}\n"
-        stats_text += f"🛡️ **RES_FISICA:** {npc_data[6]}\n"
-        stats_text += f"✨ **RES_MAGICA:** {npc_data[7]}\n"
-        stats_text += f"⚡ **Velocidad:** {npc_data[8]}\n"
-        stats_text += f"🧙 **Maná:** {npc_data[9]}"
+        stats_text = f"⚔️ **ATAQ_FISIC:** {npc_data['ataq_fisic']}\n"
+        stats_text += f"🏹 **ATAQ_DIST:** {npc_data['ataq_dist']}\n"
+        stats_text += f"🔮 **ATAQ_MAGIC:** {npc_data['ataq_magic']}\n"
+        stats_text += f"🛡️ **RES_FISICA:** {npc_data['res_fisica']}\n"
+        stats_text += f"✨ **RES_MAGICA:** {npc_data['res_magica']}\n"
+        stats_text += f"⚡ **Velocidad:** {npc_data['velocidad']}\n"
+        stats_text += f"🧙 **Maná:** {npc_data['mana']}"
         
         embed.add_field(name="📊 Estadísticas", value=stats_text, inline=True)
         
         damage_text = f"**Ataques:**\n"
-        damage_text += f"⚔️ Físico: {npc_data[3]}\n"
-        damage_text += f"🏹 Distancia: {npc_data[4]}\n"
-        damage_text += f"🔮 Mágico: {npc_data[5]}"
+        damage_text += f"⚔️ Físico: {npc_data['ataq_fisic']}\n"
+        damage_text += f"🏹 Distancia: {npc_data['ataq_dist']}\n"
+        damage_text += f"🔮 Mágico: {npc_data['ataq_magic']}"
         
         defense_text = f"**Defensas:**\n"
-        defense_text += f"🛡️ Física: {npc_data[6]}\n"
-        defense_text += f"✨ Mágica: {npc_data[7]}\n"
-        defense_text += f"🏃 Esquivar: {npc_data[8]}"
+        defense_text += f"🛡️ Física: {npc_data['res_fisica']}\n"
+        defense_text += f"✨ Mágica: {npc_data['res_magica']}\n"
+        defense_text += f"🏃 Esquivar: {npc_data['velocidad']}"
         
         if sincronizado:
             damage_text += f"\n\n**Sincronizado:**\n"
-            damage_text += f"⚔️ Físico: {npc_data[3] * cantidad}\n"
-            damage_text += f"🏹 Distancia: {npc_data[4] * cantidad}\n"
-            damage_text += f"🔮 Mágico: {npc_data[5] * cantidad}"
+            damage_text += f"⚔️ Físico: {npc_data['ataq_fisic'] * cantidad}\n"
+            damage_text += f"🏹 Distancia: {npc_data['ataq_dist'] * cantidad}\n"
+            damage_text += f"🔮 Mágico: {npc_data['ataq_magic'] * cantidad}"
             
             defense_text += f"\n\n**Sincronizado:**\n"
-            defense_text += f"🛡️ Física: {npc_data[6] * cantidad}\n"
-            defense_text += f"✨ Mágica: {npc_data[7] * cantidad}\n"
-            defense_text += f"🏃 Esquivar: {npc_data[8] * cantidad}"
+            defense_text += f"🛡️ Física: {npc_data['res_fisica'] * cantidad}\n"
+            defense_text += f"✨ Mágica: {npc_data['res_magica'] * cantidad}\n"
+            defense_text += f"🏃 Esquivar: {npc_data['velocidad'] * cantidad}"
         
         embed.add_field(name="💥 Ataques", value=damage_text, inline=True)
         embed.add_field(name="🛡️ Defensas", value=defense_text, inline=True)
         
-        if npc_data[11]:  # imagen_url
-            embed.set_thumbnail(url=npc_data[11])
-        
-        await interaction.followup.send(embed=embed)
+        embed_cache.put('npc', npc, version, embed, npc_data['imagen_hash'], npc_data['imagen_url'])
+        files = await image_handler.attach_thumbnail(embed, npc_data['imagen_hash'], npc_data['imagen_url'])
+        await interaction.followup.send(embed=embed, files=files)
         
     except Exception as e:
         logger.error(f"❌ Error mostrando info NPC: {e}")
         await interaction.followup.send("❌ Error interno")
 
 @tree.command(name="info_personaje", description="Información completa de un personaje")
+@app_commands.autocomplete(personaje=personaje_autocomplete)
+@instrumented
 async def character_info(interaction: discord.Interaction, personaje: str):
     await interaction.response.defer()
     
     try:
-        with db.get_connection() as conn:
-            cursor = conn.cursor()
-            cursor.execute("SELECT * FROM personajes WHERE nombre = ?", (personaje,))
-            char_data = cursor.fetchone()
+        cached = embed_cache.get('personaje', personaje)
+        if cached:
+            embed, imagen_hash, imagen_url = cached
+            files = await image_handler.attach_thumbnail(embed, imagen_hash, imagen_url)
+            sheets_sync.mark_dirty(personaje)
+            await interaction.followup.send(embed=embed, files=files)
+            return
+        
+        version = embed_cache.version('personaje', personaje)
+        
+        def fetch_character():
+            with db.get_connection(readonly=True) as conn:
+                cursor = conn.cursor()
+                cursor.execute(SQL_CHARACTER_INFO, (personaje,))
+                row = cursor.fetchone()
+                return dict(zip([column[0] for column in cursor.description], row)) if row else None
+        
+        char_data = await data_access.run("db.info_personaje", fetch_character)
         
         if not char_data:
             await interaction.followup.send(f"❌ Personaje **{personaje}** no encontrado")
             return
         
-        base_stats = excel_manager.read_character_stats(personaje)
-        item_bonuses = inventory_system.calculate_equipped_bonuses(personaje)
+        base_stats = await data_access.run("db.stats", stats_manager.read_character_stats, personaje)
+        item_bonuses = await data_access.run("db.bonos", inventory_system.calculate_equipped_bonuses, personaje)
         
         if not base_stats:
             await interaction.followup.send(f"❌ No se pudieron cargar las estadísticas de **{personaje}**")
@@ -1417,11 +5250,11 @@ async def character_info(interaction: discord.Interaction, personaje: str):
                 'total': base_stats[attr]['base'] + item_bonuses.get(attr, 0)
             }
         
-        embed = discord.Embed(title=f"🎭 {personaje}", description=char_data[4] or "Un aventurero misterioso", color=0x9932cc)
+        embed = discord.Embed(title=f"🎭 {personaje}", description=char_data['descripcion'] or "Un aventurero misterioso", color=0x9932cc)
         
         embed.add_field(name="❤️ Puntos de Golpe", value=f"{config.FIXED_HP} PG", inline=True)
-        embed.add_field(name="💰 Oro", value=str(char_data[5]), inline=True)
-        embed.add_field(name="📝 Estado", value=char_data[6].title(), inline=True)
+        embed.add_field(name="💰 Oro", value=str(char_data['oro'] or 0), inline=True)
+        embed.add_field(name="📝 Estado", value=(char_data['estado'] or "activo").title(), inline=True)
         
         main_attrs = ['fuerza', 'destreza', 'velocidad', 'resistencia', 'inteligencia', 'mana']
         stats_text = ""
@@ -1434,17 +5267,404 @@ async def character_info(interaction: discord.Interaction, personaje: str):
         
         embed.add_field(name="📊 Atributos", value=stats_text, inline=False)
         
-        if char_data[7]:  # imagen_url
-            embed.set_thumbnail(url=char_data[7])
+        embed_cache.put('personaje', personaje, version, embed, char_data['imagen_hash'], char_data['imagen_url'])
+        files = await image_handler.attach_thumbnail(embed, char_data['imagen_hash'], char_data['imagen_url'])
         
-        google_sheets.sync_character(personaje, combined_stats)
+        sheets_sync.mark_dirty(personaje)
         
-        await interaction.followup.send(embed=embed)
+        await interaction.followup.send(embed=embed, files=files)
         
     except Exception as e:
         logger.error(f"❌ Error mostrando info: {e}")
         await interaction.followup.send("❌ Error interno")
 
+# ============= COMANDOS DE ESCENA =============
+
+@tree.command(name="escena_unir", description="Une un personaje o NPC a la escena de combate de este canal")
+@app_commands.autocomplete(personaje=personaje_autocomplete, npc=npc_autocomplete)
+@instrumented
+async def scene_join(interaction: discord.Interaction, personaje: str = None, npc: str = None):
+    await interaction.response.defer()
+    
+    try:
+        name = personaje or npc
+        if not name:
+            await interaction.followup.send("❌ Indica un personaje o un NPC")
+            return
+        
+        def rejection(scene):
+            if scene and scene.find(name):
+                return f"❌ **{name}** ya está en la escena"
+            if scene and len(scene.order) >= encounters.max_participants:
+                return f"❌ La escena ya tiene {encounters.max_participants} participantes"
+        
+        error = rejection(encounters.get(interaction.channel_id))
+        if error:
+            await interaction.followup.send(error)
+            return
+        
+        combatant = await data_access.run("db.escena_unir", encounters.load_participant, name, interaction.channel_id)
+        if combatant is None:
+            await interaction.followup.send(f"❌ **{name}** no existe")
+            return
+        
+        # Otra orden pudo cambiar la escena mientras se leía la base de datos
+        scene = encounters.get_or_create(interaction.channel_id)
+        error = rejection(scene)
+        if error:
+            await interaction.followup.send(error)
+            return
+        
+        scene.add(combatant)
+        encounters.touch(scene)
+        combat_logger.info(f"[ESCENA] {name} se une (iniciativa {combatant.initiative}, {combatant.hp} PG)",
+                           extra={'data': {'canal': scene.channel_id, 'evento': 'unir', 'nombre': name,
+                                           'iniciativa': combatant.initiative, 'pg': combatant.hp}})
+        
+        await interaction.followup.send(embed=encounters.render(scene))
+        
+    except Exception as e:
+        logger.error(f"❌ Error uniendo a la escena: {e}")
+        await interaction.followup.send("❌ Error interno")
+
+@tree.command(name="escena_estado", description="Orden de iniciativa, PG y condiciones de la escena")
+@instrumented
+async def scene_status(interaction: discord.Interaction):
+    scene = encounters.get(interaction.channel_id)
+    if scene is None:
+        await interaction.response.send_message("❌ No hay escena en este canal", ephemeral=True)
+        return
+    await interaction.response.send_message(embed=encounters.render(scene))
+
+@tree.command(name="escena_pg", description="Aplica daño (negativo) o curación (positivo) a un participante")
+@app_commands.describe(cambio="PG a sumar: -3 es daño, 2 es curación")
+@app_commands.autocomplete(participante=scene_participant_autocomplete)
+@instrumented
+async def scene_hp(interaction: discord.Interaction, participante: str, cambio: int):
+    scene = encounters.get(interaction.channel_id)
+    combatant = scene.find(participante) if scene else None
+    if combatant is None:
+        await interaction.response.send_message(f"❌ **{participante}** no está en la escena", ephemeral=True)
+        return
+    
+    combatant.hp = max(0, min(combatant.max_hp, combatant.hp + cambio))
+    encounters.touch(scene)
+    combat_logger.info(f"[ESCENA] {combatant.name} {cambio:+d} PG -> {combatant.hp}/{combatant.max_hp}",
+                       extra={'data': {'canal': scene.channel_id, 'evento': 'pg', 'nombre': combatant.name,
+                                       'cambio': cambio, 'pg': combatant.hp}})
+    
+    await interaction.response.send_message(embed=encounters.render(scene))
+
+@tree.command(name="escena_condicion", description="Añade o quita una condición (aturdido, envenenado...)")
+@app_commands.autocomplete(participante=scene_participant_autocomplete)
+@instrumented
+async def scene_condition(interaction: discord.Interaction, participante: str, condicion: str, quitar: bool = False):
+    scene = encounters.get(interaction.channel_id)
+    combatant = scene.find(participante) if scene else None
+    if combatant is None:
+        await interaction.response.send_message(f"❌ **{participante}** no está en la escena", ephemeral=True)
+        return
+    
+    condicion = condicion.strip().lower()[:40]
+    if quitar:
+        if condicion in combatant.conditions:
+            combatant.conditions.remove(condicion)
+    elif condicion not in combatant.conditions:
+        combatant.conditions.append(condicion)
+    encounters.touch(scene)
+    
+    await interaction.response.send_message(embed=encounters.render(scene))
+
+@tree.command(name="escena_turno", description="Pasa el turno al siguiente participante en pie")
+@instrumented
+async def scene_next_turn(interaction: discord.Interaction):
+    scene = encounters.get(interaction.channel_id)
+    if scene is None or not scene.order:
+        await interaction.response.send_message("❌ No hay escena en este canal", ephemeral=True)
+        return
+    
+    combatant = scene.advance()
+    if combatant is None:
+        await interaction.response.send_message("💀 No queda nadie en pie", embed=encounters.render(scene))
+        return
+    encounters.touch(scene)
+    
+    await interaction.response.send_message(f"▶️ Turno de **{combatant.name}** (ronda {scene.round})",
+                                            embed=encounters.render(scene))
+
+@tree.command(name="escena_salir", description="Saca a un participante de la escena")
+@app_commands.autocomplete(participante=scene_participant_autocomplete)
+@instrumented
+async def scene_leave(interaction: discord.Interaction, participante: str):
+    scene = encounters.get(interaction.channel_id)
+    combatant = scene.find(participante) if scene else None
+    if combatant is None:
+        await interaction.response.send_message(f"❌ **{participante}** no está en la escena", ephemeral=True)
+        return
+    
+    scene.remove(combatant)
+    encounters.touch(scene)
+    
+    await interaction.response.send_message(embed=encounters.render(scene))
+
+@tree.command(name="escena_terminar", description="Termina la escena de combate de este canal")
+@instrumented
+async def scene_end(interaction: discord.Interaction):
+    scene = encounters.end(interaction.channel_id)
+    if scene is None:
+        await interaction.response.send_message("❌ No hay escena en este canal", ephemeral=True)
+        return
+    
+    combat_logger.info(f"[ESCENA] Terminada tras {scene.round} rondas",
+                       extra={'data': {'canal': scene.channel_id, 'evento': 'terminar', 'rondas': scene.round}})
+    await interaction.response.send_message(f"🏁 Escena terminada tras {scene.round} rondas")
+
+# ============= HISTORIAL DE TIRADAS =============
+
+@tree.command(name="historial", description="Últimas tiradas de un personaje o NPC")
+@app_commands.describe(personaje="Personaje o NPC", limite="Cuántas tiradas mostrar (máx. 25)")
+@app_commands.autocomplete(personaje=personaje_autocomplete)
+@instrumented
+async def roll_log(interaction: discord.Interaction, personaje: str, limite: int = 10):
+    await interaction.response.defer()
+    
+    try:
+        limite = max(1, min(limite, 25))
+        await roll_history.flush()  # incluir las tiradas que aún estén en el búfer
+        rows = await data_access.run("db.historial", roll_history.history, personaje, limite)
+        
+        if not rows:
+            await interaction.followup.send(f"❌ **{personaje}** no tiene tiradas registradas")
+            return
+        
+        lines = []
+        for accion, cantidad, caras, dados, atributo, valor_atributo, bonificador, total, critico, pifia, fecha in rows:
+            mark = " 🌟" if critico else " 💥" if pifia else ""
+            if cantidad:
+                detail = f"{cantidad}d{caras} {json.loads(dados)} + {(atributo or '').title()} {valor_atributo}"
+                if bonificador:
+                    detail += f" + {bonificador}"
+            else:
+                detail = "valor fijo"
+            lines.append(f"`{fecha[5:16]}` **{accion.replace('_', ' ')}**: {detail} = **{total}**{mark}")
+        
+        embed = discord.Embed(title=f"📜 Historial de {personaje}", description='\n'.join(lines)[:4096], color=0x7289da)
+        embed.set_footer(text=f"Últimas {len(rows)} tiradas · fechas en UTC")
+        await interaction.followup.send(embed=embed)
+        
+    except Exception as e:
+        logger.error(f"❌ Error mostrando historial: {e}")
+        await interaction.followup.send("❌ Error interno")
+
+@tree.command(name="estadisticas_dados", description="Críticos, pifias y media por acción en el historial de tiradas")
+@app_commands.describe(personaje="Personaje o NPC (vacío = todos los personajes)",
+                       solo_este_canal="Solo tiradas de este canal", dias="Días hacia atrás")
+@app_commands.autocomplete(personaje=personaje_autocomplete)
+@instrumented
+async def roll_stats(interaction: discord.Interaction, personaje: str = None, solo_este_canal: bool = False,
+                     dias: int = 30):
+    await interaction.response.defer()
+    
+    try:
+        dias = max(1, dias)
+        await roll_history.flush()
+        rows = await data_access.run("db.estadisticas_dados", roll_history.action_stats, personaje,
+                                     None if personaje or not solo_este_canal else interaction.channel_id, dias)
+        
+        scope = f"**{personaje}**" if personaje else "este canal" if solo_este_canal else "todos los personajes"
+        if not rows:
+            await interaction.followup.send(f"❌ No hay tiradas de {scope} en los últimos {dias} días")
+            return
+        
+        embed = discord.Embed(title="📊 Estadísticas de Dados",
+                              description=f"Tiradas de {scope} en los últimos {dias} días", color=0x7289da)
+        for accion, count, avg_total, min_total, max_total, criticals, fumbles, with_dice in rows[:20]:
+            value = f"🎲 {count} tiradas · media **{avg_total:.1f}** · rango {min_total}-{max_total}"
+            if with_dice:
+                value += f"\n🌟 críticos {criticals / with_dice:.1%} · 💥 pifias {fumbles / with_dice:.1%}"
+            embed.add_field(name=accion.replace('_', ' ').title(), value=value, inline=False)
+        
+        await interaction.followup.send(embed=embed)
+        
+    except Exception as e:
+        logger.error(f"❌ Error calculando estadísticas de dados: {e}")
+        await interaction.followup.send("❌ Error interno")
+
+# ============= MÉTRICAS =============
+
+@tree.command(name="metricas", description="Latencia por comando (solo administradores)")
+@app_commands.default_permissions(administrator=True)
+@instrumented
+async def show_metrics(interaction: discord.Interaction):
+    await interaction.response.defer(ephemeral=True)
+    
+    try:
+        summary = command_metrics.summary()
+        
+        if not summary:
+            await interaction.followup.send("📈 Aún no hay comandos medidos", ephemeral=True)
+            return
+        
+        def ms(value):
+            return "∞" if value == float('inf') else f"{value * 1000:.0f}ms"
+        
+        embed = discord.Embed(title="📈 Métricas de Comandos", color=0x3399ff)
+        slowest = sorted(summary.items(), key=lambda item: item[1]['phases']['total']['p95'], reverse=True)
+        for name, entry in slowest[:20]:
+            phases = entry['phases']
+            total = phases['total']
+            lines = [f"📞 {entry['calls']} llamadas · ❌ {entry['errors']} errores",
+                     f"⏱️ total p50 {ms(total['p50'])} · p95 {ms(total['p95'])}"]
+            if CommandMetrics.FIRST_RESPONSE in phases:
+                lines.append(f"💬 respuesta p95 {ms(phases[CommandMetrics.FIRST_RESPONSE]['p95'])}")
+            io = [f"{phase} {ms(values['avg'])}" for phase, values in sorted(phases.items())
+                  if phase not in (CommandMetrics.TOTAL, CommandMetrics.FIRST_RESPONSE)]
+            if io:
+                lines.append(f"💾 media {' · '.join(io)}")
+            embed.add_field(name=name, value='\n'.join(lines), inline=False)
+        
+        io_stats = data_access.stats()
+        pool = db.pool.stats()
+        embed.add_field(name="🧵 E/S y SQLite", value='\n'.join([
+            f"Hilos {io_stats['in_flight']}/{io_stats['max_workers']} ocupados · {io_stats['abandoned']} tras timeout",
+            f"Escritor: {pool['writer_waits']} esperas ({ms(pool['writer_wait_time'])} en total)",
+            f"Lectores: {pool['readers_in_use']}/{pool['max_readers']} en uso · pico {pool['readers_peak']} · "
+            f"{pool['reader_waits']} esperas ({ms(pool['reader_wait_time'])})",
+        ]), inline=False)
+        
+        caches = f"stats {stat_cache.stats()['hit_ratio']:.0%} · embeds {embed_cache.stats()['hit_ratio']:.0%}"
+        embed.set_footer(text=f"Aciertos de caché: {caches} · {config.METRICS_FILE}")
+        
+        await interaction.followup.send(embed=embed, ephemeral=True)
+        
+    except Exception as e:
+        logger.error(f"❌ Error mostrando métricas: {e}")
+        await interaction.followup.send("❌ Error interno", ephemeral=True)
+
+# ============= EXPORTACIÓN =============
+
+@tree.command(name="exportar_excel", description="Exporta a Excel las estadísticas de los personajes")
+@app_commands.describe(personaje="Personaje a exportar (vacío = todos los activos)")
+@app_commands.autocomplete(personaje=personaje_autocomplete)
+@instrumented
+async def export_excel(interaction: discord.Interaction, personaje: str = None):
+    await interaction.response.defer()
+    
+    try:
+        exported = await data_access.run("excel.exportar", excel_manager.export_characters, 
+                                         [personaje] if personaje else None, timeout=300)
+        
+        if not exported:
+            await interaction.followup.send(f"❌ Personaje **{personaje}** no encontrado" if personaje 
+                                          else "❌ No hay personajes para exportar")
+            return
+        
+        embed = discord.Embed(title="📤 Exportación a Excel", 
+                            description=f"**{len(exported)}** personajes exportados a `{config.EXCEL_DIR}/activos`", 
+                            color=0x00ff00)
+        embed.add_field(name="🎭 Personajes", value=', '.join(exported)[:1024], inline=False)
+        
+        await interaction.followup.send(embed=embed)
+        
+    except Exception as e:
+        logger.error(f"❌ Error exportando Excel: {e}")
+        await interaction.followup.send("❌ Error interno")
+
+@tree.command(name="respaldo_personajes", description="Zip con un Excel por personaje, incluidos los archivados (solo administradores)")
+@app_commands.default_permissions(administrator=True)
+@instrumented
+async def backup_characters(interaction: discord.Interaction):
+    await interaction.response.defer(ephemeral=True)
+    
+    try:
+        report = await data_access.run("excel.respaldo", roster_backup.run, timeout=config.BACKUP_TIMEOUT)
+        
+        embed = discord.Embed(title="🗄️ Respaldo de Personajes", color=0x00ff00 if not report['errores'] else 0xffaa00)
+        embed.add_field(name="🎭 Personajes", value=str(report['personajes']), inline=True)
+        embed.add_field(name="📁 Archivados", value=str(report['archivados']), inline=True)
+        embed.add_field(name="⏱️ Tiempo", value=f"{report['segundos']}s", inline=True)
+        if report['errores']:
+            embed.add_field(name="❌ Errores", value='\n'.join(report['errores'])[:1024], inline=False)
+        
+        limit = interaction.guild.filesize_limit if interaction.guild else 10 * 1024 * 1024
+        if report['bytes'] <= limit:
+            await interaction.followup.send(embed=embed, file=discord.File(report['archivo']), ephemeral=True)
+        else:
+            embed.set_footer(text=f"Demasiado grande para Discord; guardado en {report['archivo']}")
+            await interaction.followup.send(embed=embed, ephemeral=True)
+        
+    except RuntimeError as e:
+        await interaction.followup.send(f"⏳ {str(e).capitalize()}", ephemeral=True)
+    except Exception as e:
+        logger.error(f"❌ Error creando respaldo: {e}")
+        await interaction.followup.send("❌ Error interno", ephemeral=True)
+
+CATALOG_CHOICES = [
+    app_commands.Choice(name="Bestiario (NPCs)", value="npcs"),
+    app_commands.Choice(name="Items", value="items")
+]
+
+@tree.command(name="importar_catalogo", description="Carga en bloque NPCs o items desde CSV, JSON o YAML (solo administradores)")
+@app_commands.describe(
+    catalogo="Qué tabla cargar",
+    archivo="Archivo .csv, .json o .yaml con una fila por NPC/item",
+    simular="Solo valida y cuenta altas/actualizaciones, sin escribir"
+)
+@app_commands.choices(catalogo=CATALOG_CHOICES)
+@app_commands.default_permissions(administrator=True)
+@instrumented
+async def import_catalog(interaction: discord.Interaction, catalogo: str, archivo: discord.Attachment,
+                         simular: bool = False):
+    await interaction.response.defer(ephemeral=True)
+    
+    try:
+        if archivo.size > config.CATALOG_MAX_BYTES:
+            await interaction.followup.send(f"❌ El archivo supera {config.CATALOG_MAX_BYTES // 1024} KB", ephemeral=True)
+            return
+        
+        data = await archivo.read()
+        report = await data_access.run("db.importar_catalogo", catalog.import_bytes, catalogo, archivo.filename,
+                                       data, simular, timeout=300)
+        
+        embed = discord.Embed(title=f"📚 Catálogo de {catalogo}{' (simulación)' if simular else ''}",
+                              description=f"`{archivo.filename}` validado", color=0x00ff00)
+        embed.add_field(name="➕ Nuevos", value=str(report['creados']), inline=True)
+        embed.add_field(name="✏️ Actualizados", value=str(report['actualizados']), inline=True)
+        if catalogo == 'items' and not simular:
+            embed.add_field(name="🎒 Personajes recalculados", value=str(report['equipos_recalculados']), inline=True)
+        
+        await interaction.followup.send(embed=embed, ephemeral=True)
+        
+    except CatalogError as e:
+        await interaction.followup.send(f"❌ No se importó nada:\n{str(e)[:1900]}", ephemeral=True)
+    except Exception as e:
+        logger.error(f"❌ Error importando catálogo: {e}")
+        await interaction.followup.send("❌ Error interno", ephemeral=True)
+
+@tree.command(name="exportar_catalogo", description="Descarga el bestiario o el catálogo de items (solo administradores)")
+@app_commands.describe(catalogo="Qué tabla exportar", formato="Formato del archivo")
+@app_commands.choices(catalogo=CATALOG_CHOICES, formato=[
+    app_commands.Choice(name="CSV", value="csv"),
+    app_commands.Choice(name="JSON", value="json"),
+    app_commands.Choice(name="YAML", value="yaml")
+])
+@app_commands.default_permissions(administrator=True)
+@instrumented
+async def export_catalog(interaction: discord.Interaction, catalogo: str, formato: str = "csv"):
+    await interaction.response.defer(ephemeral=True)
+    
+    try:
+        path = os.path.join(config.EXPORTS_DIR, f"{catalogo}.{formato}")
+        count = await data_access.run("db.exportar_catalogo", catalog.export, catalogo, formato, path, timeout=300)
+        await interaction.followup.send(f"📤 **{count}** filas de {catalogo}", file=discord.File(path),
+                                        ephemeral=True)
+        
+    except CatalogError as e:
+        await interaction.followup.send(f"❌ {e}", ephemeral=True)
+    except Exception as e:
+        logger.error(f"❌ Error exportando catálogo: {e}")
+        await interaction.followup.send("❌ Error interno", ephemeral=True)
+
 # ============= INICIALIZACIÓN =============
 def create_default_content():
     """Crea contenido por defecto"""
@@ -1466,15 +5686,347 @@ def create_default_content():
     except Exception as e:
         logger.error(f"❌ Error creando contenido por defecto: {e}")
 
+def prepare_data():
+    """Preparación no destructiva que la CLI comparte con el arranque: esquema, stats desde Excel y contenido base"""
+    db.ensure_initialized()
+    stats_manager.migrate_from_excel()
+    create_default_content()
+
+def prepare_startup(timings=None):
+    """Pasos síncronos previos a conectar con Discord; con timings anota cuánto tarda cada uno"""
+    steps = [
+        ('base_de_datos', db.ensure_initialized),
+        ('migracion_excel', stats_manager.migrate_from_excel),
+        ('auditoria_consultas', db.audit_query_plans),
+        ('bonos', inventory_system.check_bonus_consistency),
+        ('contenido_por_defecto', create_default_content),
+        ('indice_nombres', name_index.load),
+        ('escenas', encounters.load),
+        ('imagenes', image_handler.garbage_collect),
+    ]
+    for label, step in steps:
+        started = time.perf_counter()
+        step()
+        if timings is not None:
+            timings[label] = time.perf_counter() - started
+
+# ============= BENCHMARK DE ARRANQUE =============
+class StartupBenchmark:
+    """Mide en procesos limpios (python -X importtime) la importación del bot y el tiempo hasta estar listo"""
+    # El hijo carga el bot con otro nombre de módulo para que no arranque main() ni se conecte a Discord,
+    # y con UNITY_DATA_DIR apuntando a una copia temporal de los datos
+    CHILD_SCRIPT = (
+        "import importlib.util, json, sys, time\n"
+        "started = time.perf_counter()\n"
+        "spec = importlib.util.spec_from_file_location('unity_bot_benchmark', sys.argv[1])\n"
+        "bot = importlib.util.module_from_spec(spec)\n"
+        "spec.loader.exec_module(bot)\n"
+        "imported = time.perf_counter()\n"
+        "timings = {}\n"
+        "if sys.argv[2] == 'completo':\n"
+        "    bot.prepare_startup(timings)\n"
+        "print(json.dumps({'importacion': imported - started, 'pasos': timings,\n"
+        "                  'listo': time.perf_counter() - started}))\n"
+    )
+    IMPORTTIME_RE = re.compile(r'^import time:\s+(\d+) \|\s+(\d+) \| (\S.*)$')
+    RUN_TIMEOUT = 120
+    
+    @classmethod
+    def slow_imports(cls, stderr, top):
+        """Módulos de primer nivel (sin sangría en -X importtime) ordenados por tiempo acumulado"""
+        modules = Counter()
+        for line in stderr.splitlines():
+            match = cls.IMPORTTIME_RE.match(line)
+            if match:
+                modules[match.group(3)] += int(match.group(2))
+        return [(name, round(micros / 1000, 1)) for name, micros in modules.most_common(top)]
+    
+    @staticmethod
+    def scratch_copy(dest):
+        """Copia DATA_DIR para que el arranque de prueba migre, escriba y limpie sin tocar los datos reales
+        
+        Las imágenes se enlazan en vez de copiarse: el arranque solo puede borrarlas y borrar un enlace
+        no afecta al original. Todo lo demás (base de datos, Excel, logs) se copia de verdad.
+        """
+        images_dir = os.path.abspath(config.IMAGES_DIR)
+        
+        def copy_file(src, dst):
+            if os.path.abspath(src).startswith(images_dir + os.sep):
+                try:
+                    os.link(src, dst)
+                    return dst
+                except OSError:
+                    pass  # otro sistema de archivos: se copia
+            return shutil.copy2(src, dst)
+        
+        if os.path.isdir(config.DATA_DIR):
+            shutil.copytree(config.DATA_DIR, dest, copy_function=copy_file)
+        return dest
+    
+    @classmethod
+    def measure(cls, full=True, top=10):
+        with tempfile.TemporaryDirectory(prefix='unity-arranque-') as scratch:
+            data_dir = cls.scratch_copy(os.path.join(scratch, 'unity_data'))
+            result = subprocess.run(
+                [sys.executable, '-X', 'importtime', '-c', cls.CHILD_SCRIPT, os.path.abspath(__file__),
+                 'completo' if full else 'importacion'],
+                capture_output=True, text=True, timeout=cls.RUN_TIMEOUT,
+                env={**os.environ, 'UNITY_DATA_DIR': data_dir})
+        if result.returncode != 0:
+            raise RuntimeError(f"el arranque de prueba terminó con código {result.returncode}: "
+                               f"{result.stderr.strip().splitlines()[-1:]}")
+        timings = json.loads(result.stdout.strip().splitlines()[-1])
+        timings['modulos'] = cls.slow_imports(result.stderr, top)
+        return timings
+    
+    @classmethod
+    def run(cls, repetitions=3, full=True, top=10):
+        """Medianas de varias ejecuciones; los módulos lentos salen de la última"""
+        import statistics
+        runs = [cls.measure(full, top) for _ in range(max(1, repetitions))]
+        median = lambda values: round(statistics.median(values), 3)
+        return {
+            'repeticiones': len(runs),
+            'importacion_s': median([run['importacion'] for run in runs]),
+            'listo_s': median([run['listo'] for run in runs]),
+            'pasos_s': {step: median([run['pasos'][step] for run in runs]) for step in runs[-1]['pasos']},
+            'modulos_lentos_ms': runs[-1]['modulos'],
+        }
+
 async def main():
     try:
-        create_default_content()
-        logger.info("🚀 Iniciando Unity RPG Bot...")
+        prepare_startup()
+        roll_history.start()
+        encounters.start()
+        await command_metrics.start()
+        logger.info(f"🚀 Iniciando Unity RPG Bot... (preparado en {time.perf_counter() - BOOT_STARTED:.2f}s)")
         await client.start(config.DISCORD_TOKEN)
     except Exception as e:
         logger.error(f"💥 Error crítico: {e}")
+    finally:
+        if sheets_startup is not None:
+            sheets_startup.cancel()
+        await encounters.stop()
+        await roll_history.stop()
+        await command_metrics.stop()
+        await sheets_sync.stop()
+        await image_handler.close()
+
+# ============= LÍNEA DE COMANDOS =============
+def cli_audit_queries(args):
+    """Falla (código 1) si alguna consulta frecuente recurre a un recorrido completo de tabla"""
+    offenders = db.audit_query_plans()
+    if not offenders:
+        logger.info(f"✅ {len(HOT_QUERIES)} consultas frecuentes usan índices")
+    return 1 if offenders else 0
+
+def cli_check_bonuses(args):
+    """Recalcula todos los bonos equipados y reporta deriva; con --reparar la corrige"""
+    drift = inventory_system.check_bonus_consistency(repair='--reparar' in args)
+    for personaje_id, detalle in drift.items():
+        logger.info(f"🔍 Personaje {personaje_id}: {detalle}")
+    if not drift:
+        logger.info("✅ Bonos materializados consistentes")
+    return 1 if drift and '--reparar' not in args else 0
+
+def cli_simulate(args):
+    """Matriz completa plantel vs bestiario; --csv guarda todas las métricas"""
+    parser = argparse.ArgumentParser(prog="simular")
+    parser.add_argument('--personaje', action='append', help="Repetible; por defecto todos")
+    parser.add_argument('--npc', action='append', help="Repetible; por defecto todos")
+    parser.add_argument('--combates', type=int, default=1000)
+    parser.add_argument('--ataque', default='ataque_fisico', choices=list(CombatSimulator.NPC_DEFENSE_FOR))
+    parser.add_argument('--ataque-npc', default='fisico', choices=list(CombatSimulator.CHARACTER_DEFENSE_FOR))
+    parser.add_argument('--dados', default='1d20', help="NdM, p. ej. 2d6")
+    parser.add_argument('--csv', help="Ruta del CSV con los resultados")
+    options = parser.parse_args(args)
+    
+    try:
+        dice_count, dice_type = DiceSystem.parse_dice(options.dados)
+    except ValueError as e:
+        parser.error(str(e))
+    characters, npcs = combat_simulator.load_roster(options.personaje, options.npc)
+    if not characters or not npcs:
+        # Sin datos no es un fallo de la simulación (1) ni un error de uso (2, argparse): código 3
+        logger.warning(f"⚠️ Nada que simular: {len(characters)} personajes y {len(npcs)} NPCs encontrados")
+        return 3
+    try:
+        results = combat_simulator.run(options.personaje, options.npc, options.combates, dice_count,
+                                       dice_type, options.ataque, options.ataque_npc,
+                                       roster=(characters, npcs))
+    finally:
+        combat_simulator.shutdown()
+    
+    if options.csv:
+        import pandas as pd
+        pd.DataFrame(results).to_csv(options.csv, index=False)
+        logger.info(f"💾 Resultados guardados en {options.csv}")
+    print(CombatSimulator.TABLE_HEADER)
+    for row in results:
+        print(CombatSimulator.format_row(row))
+    return 0 if results else 1
+
+def cli_sync_sheets(args):
+    """Resincroniza todos los personajes activos con Google Sheets en un único lote"""
+    if not sheets_backend.ensure_connected():
+        logger.error("❌ Google Sheets no está configurado")
+        return 1
+    logger.info(f"✅ {sheets_sync.sync_all_active()} personajes sincronizados")
+    return 0
+
+def cli_collect_images(args):
+    """Borra imágenes sin referencias; --simular sólo informa"""
+    image_handler.garbage_collect(dry_run='--simular' in args)
+    return 0
+
+def cli_import_images(args):
+    """Importa al almacén las imágenes de las carpetas antiguas; --borrar elimina los originales"""
+    image_handler.import_legacy(delete='--borrar' in args)
+    return 0
+
+def cli_import_logs(args):
+    """Importa las tiradas de logs de texto (por defecto unity.log y rotados); --desde-cero ignora el avance"""
+    parser = argparse.ArgumentParser(prog="importar_logs")
+    parser.add_argument('archivos', nargs='*', help="Logs a importar; por defecto unity.log y sus rotados")
+    parser.add_argument('--desde-cero', action='store_true', help="Reimporta desde el inicio (puede duplicar)")
+    options = parser.parse_args(args)
+    
+    report = log_backfill.run(options.archivos, restart=options.desde_cero)
+    logger.info(f"✅ Importación de logs: {report}")
+    return 0
+
+def cli_startup_benchmark(args):
+    """Importación y tiempo hasta estar listo (sin Discord); --max-segundos falla si se supera"""
+    parser = argparse.ArgumentParser(prog="benchmark_arranque")
+    parser.add_argument('--repeticiones', type=int, default=3)
+    parser.add_argument('--top', type=int, default=10, help="Módulos más lentos a mostrar")
+    parser.add_argument('--solo-importacion', action='store_true', help="No ejecuta los pasos de arranque")
+    parser.add_argument('--json', help="Ruta donde guardar el informe")
+    parser.add_argument('--max-segundos', type=float, help="Umbral de regresión para la mediana de 'listo'")
+    options = parser.parse_args(args)
+    
+    report = StartupBenchmark.run(options.repeticiones, not options.solo_importacion, options.top)
+    print(f"Importación: {report['importacion_s']:.3f}s | Listo: {report['listo_s']:.3f}s "
+          f"(mediana de {report['repeticiones']})")
+    for step, seconds in report['pasos_s'].items():
+        print(f"  {step:<24} {seconds:.3f}s")
+    print("Módulos más lentos (acumulado):")
+    for name, millis in report['modulos_lentos_ms']:
+        print(f"  {name:<24} {millis:>8.1f} ms")
+    if options.json:
+        with open(options.json, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        logger.info(f"💾 Informe de arranque guardado en {options.json}")
+    if options.max_segundos is not None and report['listo_s'] > options.max_segundos:
+        logger.error(f"❌ Arranque de {report['listo_s']:.3f}s supera el umbral de {options.max_segundos}s")
+        return 1
+    return 0
+
+def cli_import_catalog(args):
+    """Carga un bestiario o catálogo de items (CSV/JSON/YAML) en una transacción; --simular sólo valida"""
+    parser = argparse.ArgumentParser(prog="importar_catalogo")
+    parser.add_argument('archivo')
+    parser.add_argument('--catalogo', required=True, choices=list(CatalogManager.FIELDS))
+    parser.add_argument('--simular', action='store_true')
+    options = parser.parse_args(args)
+    
+    try:
+        report = catalog.import_file(options.catalogo, options.archivo, dry_run=options.simular)
+    except CatalogError as e:
+        logger.error(f"❌ No se importó nada:\n{e}")
+        return 1
+    logger.info(f"✅ Catálogo importado: {report}")
+    return 0
+
+def cli_export_catalog(args):
+    """Exporta el bestiario o el catálogo de items; el formato sale de la extensión del archivo"""
+    parser = argparse.ArgumentParser(prog="exportar_catalogo")
+    parser.add_argument('archivo')
+    parser.add_argument('--catalogo', required=True, choices=list(CatalogManager.FIELDS))
+    options = parser.parse_args(args)
+    
+    try:
+        catalog.export(options.catalogo, CatalogManager.detect_format(options.archivo), options.archivo)
+    except CatalogError as e:
+        logger.error(f"❌ {e}")
+        return 1
+    return 0
+
+def cli_backup_characters(args):
+    """Zip con un Excel por personaje (stats, info, inventario y equipo) más los archivados"""
+    parser = argparse.ArgumentParser(prog="respaldo_personajes")
+    parser.add_argument('--salida', help="Ruta del zip; por defecto unity_data/respaldos/personajes_<fecha>.zip")
+    parser.add_argument('--procesos', type=int, help="Procesos de escritura en paralelo")
+    options = parser.parse_args(args)
+    
+    report = roster_backup.run(options.salida, options.procesos)
+    return 1 if report['errores'] else 0
+
+def cli_reconcile(args):
+    """Cruza Excel, SQLite e imágenes; --reparar aplica los arreglos seguros, --completo ignora el manifiesto"""
+    parser = argparse.ArgumentParser(prog="reconciliar")
+    parser.add_argument('--reparar', action='store_true')
+    parser.add_argument('--completo', action='store_true', help="Vuelve a leer todos los archivos")
+    parser.add_argument('--json', help="Ruta donde guardar el informe completo")
+    options = parser.parse_args(args)
+    
+    report = DataReconciler(full=options.completo).run(repair=options.reparar)
+    if options.json:
+        with open(options.json, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+    
+    excel, images = report['excel'], report['imagenes']
+    print(f"📗 Excel: {len(excel['huerfanos'])} huérfanos, {len(excel['faltantes'])} faltantes, "
+          f"{len(excel['desajustes'])} desajustes, {len(excel['sin_estadisticas'])} sin stats en SQLite, "
+          f"{len(excel['archivados_con_activo'])} archivados con personaje activo, "
+          f"{len(excel['ilegibles'])} ilegibles")
+    for path in excel['huerfanos']:
+        print(f"   huérfano: {path}")
+    for name in excel['faltantes']:
+        print(f"   sin Excel: {name}")
+    for entry in excel['desajustes']:
+        print(f"   {entry['personaje']}.{entry['campo']}: Excel={entry['excel']} SQLite={entry['sqlite']}")
+    for kind, groups in report['duplicados'].items():
+        for group in groups:
+            print(f"👥 Duplicado en {kind}: {' / '.join(repr(name) for name in group)}")
+    print(f"🖼️ Imágenes: {len(images['filas_sin_archivo'])} filas sin archivo, {len(images['archivos_sin_fila'])} "
+          f"archivos sin fila, {len(images['checksum_incorrecto'])} con checksum incorrecto, "
+          f"{len(images['referencias_rotas'])} referencias rotas, {images['sin_importar']} antiguas sin importar")
+    for entry in report['bases_sobrantes']:
+        print(f"🗃️ Base sobrante {entry['archivo']}: {entry['tablas']}; "
+              f"{len(entry['personajes_ausentes'])} personajes que no están en la principal")
+    print(f"📋 Manifiesto: {report['manifiesto']['reutilizados']} reutilizados, {report['manifiesto']['analizados']} leídos")
+    if 'reparado' in report:
+        print(f"🛠️ Reparado: {report['reparado']}")
+    
+    pending = (excel['huerfanos'] or excel['faltantes'] or excel['desajustes'] or excel['sin_estadisticas']
+               or images['filas_sin_archivo'] or images['referencias_rotas'])
+    return 1 if pending and not options.reparar else 0
+
+# Comandos que trabajan sobre los datos tal como están: no se migran ni se completan antes
+CLI_RAW_DATA = {'reconciliar', 'benchmark_arranque'}
+
+CLI_COMMANDS = {
+    'auditar_consultas': cli_audit_queries,
+    'verificar_bonos': cli_check_bonuses,
+    'simular': cli_simulate,
+    'sincronizar_sheets': cli_sync_sheets,
+    'limpiar_imagenes': cli_collect_images,
+    'importar_imagenes': cli_import_images,
+    'importar_logs': cli_import_logs,
+    'importar_catalogo': cli_import_catalog,
+    'exportar_catalogo': cli_export_catalog,
+    'respaldo_personajes': cli_backup_characters,
+    'reconciliar': cli_reconcile,
+    'benchmark_arranque': cli_startup_benchmark
+}
 
 if __name__ == "__main__":
+    if len(sys.argv) > 1 and sys.argv[1] in CLI_COMMANDS:
+        if sys.argv[1] not in CLI_RAW_DATA:
+            prepare_data()
+        sys.exit(CLI_COMMANDS[sys.argv[1]](sys.argv[2:]))
+    
     try:
         asyncio.run(main())
     except KeyboardInterrupt:
@@ -1482,4 +6034,9 @@ if __name__ == "__main__":
     except Exception as e:
         logger.error(f"💥 Error fatal: {e}")
     finally:
+        logger.info(f"🔌 Estado del pool SQLite al cerrar: {db.pool.stats()}")
+        logger.info(f"📦 Cachés al cerrar: stats {stat_cache.stats()} | embeds {embed_cache.stats()}")
+        data_access.shutdown()
+        combat_simulator.shutdown()
+        db.close()
         logger.info("👋 Unity RPG Bot cerrado")
\ No newline at end of file
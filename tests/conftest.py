@@ -0,0 +1,76 @@
+"""El bot vive en bot.py.py, que no se puede importar por nombre: se carga con importlib
+sobre un directorio de datos temporal (UNITY_DATA_DIR), así las pruebas nunca tocan unity_data."""
+import importlib.util
+import os
+import sys
+from pathlib import Path
+
+import pytest
+
+ROOT = Path(__file__).resolve().parent.parent
+
+
+@pytest.fixture(scope="session")
+def bot(tmp_path_factory):
+    os.environ["UNITY_DATA_DIR"] = str(tmp_path_factory.mktemp("unity_data"))
+    os.environ["SHEETS_BACKEND"] = "fake"
+    spec = importlib.util.spec_from_file_location("unity_bot", ROOT / "bot.py.py")
+    module = importlib.util.module_from_spec(spec)
+    sys.modules["unity_bot"] = module  # los workers de procesos importan sus funciones por nombre
+    spec.loader.exec_module(module)
+    module.prepare_data()
+    yield module
+    module.db.close()
+
+
+@pytest.fixture(scope="session")
+def make_character(bot):
+    """Inserta un personaje activo con stats base (sin Excel) y devuelve su nombre"""
+    def make(nombre, **stats):
+        with bot.db.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("INSERT OR IGNORE INTO personajes (nombre, usuario_id, excel_path) VALUES (?, ?, ?)",
+                           (nombre, "1", f"{bot.config.EXCEL_DIR}/activos/{nombre}.xlsx"))
+            personaje_id = cursor.execute("SELECT id FROM personajes WHERE nombre = ?", (nombre,)).fetchone()[0]
+            columns = ["personaje_id", *stats]
+            cursor.execute(f"INSERT OR REPLACE INTO estadisticas_personajes ({', '.join(columns)}) "
+                           f"VALUES ({', '.join('?' * len(columns))})", (personaje_id, *stats.values()))
+        bot.stat_cache.invalidate(nombre)
+        return nombre
+    return make
+
+
+class FakeInteraction:
+    """Lo mínimo que usan los comandos y menús: respuesta, followup y el id del autor.
+    Guarda en sent el texto (o la descripción del embed) de cada mensaje."""
+    def __init__(self, user_id=1):
+        self.sent = []
+        interaction = self
+
+        def record(content=None, **kwargs):
+            embed = kwargs.get("embed")
+            interaction.sent.append(content if content is not None else embed.description if embed else None)
+
+        class Response:
+            async def defer(self, *args, **kwargs):
+                pass
+
+            async def send_message(self, content=None, **kwargs):
+                record(content, **kwargs)
+
+            async def edit_message(self, content=None, **kwargs):
+                record(content, **kwargs)
+
+        class Followup:
+            async def send(self, content=None, **kwargs):
+                record(content, **kwargs)
+
+        class User:
+            id = user_id
+
+        self.response, self.followup, self.user = Response(), Followup(), User()
+
+
+@pytest.fixture
+def interaction():
+    return FakeInteraction()
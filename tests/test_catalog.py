@@ -0,0 +1,52 @@
+import pytest
+
+NPCS = [
+    {'nombre': 'Catálogo Lobo', 'tipo': 'bestia', 'ataq_fisic': 14, 'velocidad': 16, 'descripcion': 'Caza en manada'},
+    {'nombre': 'Catálogo Liche', 'tipo': 'no muerto', 'ataq_magic': 22, 'res_magica': 18, 'mana': 30},
+    {'nombre': 'Catálogo Ogro, el Grande', 'ataq_fisic': 20, 'res_fisica': 15, 'descripcion': 'Línea "con" comillas'},
+]
+ITEMS = [
+    {'nombre': 'Catálogo Daga', 'tipo': 'arma', 'efecto_destreza': 2, 'precio': 15, 'rareza': 'comun'},
+    {'nombre': 'Catálogo Pergamino', 'tipo': 'consumible', 'es_equipable': False, 'descripcion': 'Un uso'},
+]
+
+
+def rows(bot, kind, prefix='Catálogo'):
+    return [row for row in bot.catalog.iter_rows(kind) if row['nombre'].startswith(prefix)]
+
+
+@pytest.mark.parametrize("fmt", ["csv", "json", "yaml"])
+@pytest.mark.parametrize("kind, records", [("npcs", NPCS), ("items", ITEMS)])
+def test_export_then_import_is_a_no_op(bot, tmp_path, kind, records, fmt):
+    bot.catalog.import_records(kind, records)
+    before = rows(bot, kind)
+    assert len(before) == len(records)
+
+    path = tmp_path / f"{kind}.{fmt}"
+    assert bot.catalog.export(kind, fmt, str(path)) >= len(records)
+    report = bot.catalog.import_file(kind, str(path))
+
+    assert report['creados'] == 0
+    assert rows(bot, kind) == before
+
+
+def test_missing_columns_keep_their_values(bot):
+    bot.catalog.import_records('npcs', [{'nombre': 'Catálogo Parcial', 'ataq_fisic': 12, 'mana': 25}])
+    report = bot.catalog.import_records('npcs', [{'nombre': 'Catálogo Parcial', 'ataq_fisic': 13}])
+
+    assert (report['creados'], report['actualizados']) == (0, 1)
+    row, = rows(bot, 'npcs', 'Catálogo Parcial')
+    assert (row['ataq_fisic'], row['mana']) == (13, 25)
+
+
+def test_invalid_rows_write_nothing(bot):
+    records = [{'nombre': 'Catálogo Válido'}, {'tipo': 'sin nombre'}, {'nombre': 'Catálogo Malo', 'mana': 'mucho'}]
+    with pytest.raises(bot.CatalogError):
+        bot.catalog.import_records('npcs', records)
+    assert rows(bot, 'npcs', 'Catálogo Válido') == []
+
+
+def test_dry_run_reports_without_writing(bot):
+    report = bot.catalog.import_records('items', [{'nombre': 'Catálogo Simulado', 'tipo': 'arma'}], dry_run=True)
+    assert report['creados'] == 1
+    assert rows(bot, 'items', 'Catálogo Simulado') == []
@@ -0,0 +1,57 @@
+import asyncio
+
+
+class FakeCommand:
+    def __init__(self, name, description):
+        self.name = name
+        self.description = description
+
+    def to_dict(self, tree):
+        return {'type': 1, 'name': self.name, 'description': self.description}
+
+
+class FakeTree:
+    def __init__(self, *commands):
+        self.commands = list(commands)
+        self.uploads = 0
+
+    def get_commands(self, guild=None):
+        return self.commands
+
+    def copy_global_to(self, guild):
+        pass
+
+    async def sync(self, guild=None):
+        self.uploads += 1
+        return self.commands
+
+
+def test_sync_skips_when_digest_is_unchanged(bot, tmp_path):
+    state_file = str(tmp_path / "command_hashes.json")
+    tree = FakeTree(FakeCommand("tirar", "Tira dados"), FakeCommand("escena", "Gestiona la escena"))
+
+    assert asyncio.run(bot.CommandTreeSync(state_file).sync(tree, 42)) == tree.commands
+    assert tree.uploads == 1
+
+    # Un proceso nuevo (reinicio) con el mismo árbol no vuelve a subirlo
+    assert asyncio.run(bot.CommandTreeSync(state_file).sync(tree, 42)) is None
+    assert tree.uploads == 1
+
+    tree.commands[0].description = "Tira dados con atributo"
+    asyncio.run(bot.CommandTreeSync(state_file).sync(tree, 42))
+    assert tree.uploads == 2
+
+
+def test_sync_checks_once_per_process_and_force_bypasses_hash(bot, tmp_path):
+    state_file = str(tmp_path / "command_hashes.json")
+    tree = FakeTree(FakeCommand("tirar", "Tira dados"))
+    sync = bot.CommandTreeSync(state_file)
+
+    asyncio.run(sync.sync(tree, 42))
+    tree.commands.append(FakeCommand("nuevo", "Aparece tras un RESUME"))
+    assert asyncio.run(sync.sync(tree, 42)) is None
+    assert tree.uploads == 1
+
+    tree.commands.pop()
+    asyncio.run(bot.CommandTreeSync(state_file, force=True).sync(tree, 42))
+    assert tree.uploads == 2
@@ -0,0 +1,43 @@
+import itertools
+import math
+
+import pytest
+
+SMALL = [(1, 6), (2, 6), (3, 4), (2, 20), (3, 8)]
+
+
+def brute_force(dice_count, dice_type, modifier, target):
+    faces = range(1, dice_type + 1)
+    hits = sum(1 for roll in itertools.product(faces, repeat=dice_count) if sum(roll) + modifier >= target)
+    return hits / dice_type ** dice_count
+
+
+@pytest.mark.parametrize("dice_count, dice_type", SMALL)
+def test_distribution_sums_to_one(bot, dice_count, dice_type):
+    distribution = bot.DiceEngine.distribution(dice_count, dice_type, modifier=3)
+    assert math.isclose(sum(distribution.values()), 1.0)
+    assert min(distribution) == dice_count + 3
+    assert max(distribution) == dice_count * dice_type + 3
+
+
+@pytest.mark.parametrize("dice_count, dice_type", SMALL)
+def test_probability_at_least_matches_brute_force(bot, dice_count, dice_type):
+    for modifier in (0, 5):
+        for target in range(modifier - 1, dice_count * dice_type + modifier + 3):
+            assert math.isclose(bot.DiceEngine.probability_at_least(dice_count, dice_type, modifier, target),
+                                brute_force(dice_count, dice_type, modifier, target))
+
+
+def test_sessions_are_reproducible_and_independent(bot):
+    first, second = bot.DiceEngine(seed=1234), bot.DiceEngine(seed=1234)
+    rolls = [first.roll(3, 20, session=7).tolist() for _ in range(5)]
+    assert rolls == [second.roll(3, 20, session=7).tolist() for _ in range(5)]
+    assert rolls != [bot.DiceEngine(seed=1234).roll(3, 20, session=8).tolist() for _ in range(5)]
+    assert all(1 <= value <= 20 for roll in rolls for value in roll)
+
+
+def test_roll_many_splits_per_spec(bot):
+    engine = bot.DiceEngine(seed=1)
+    pools = engine.roll_many([(2, 6), (1, 20), (3, 4)])
+    assert [len(pool) for pool in pools] == [2, 1, 3]
+    assert all(1 <= value <= 4 for value in pools[2])
@@ -0,0 +1,51 @@
+import discord
+import pytest
+
+
+@pytest.fixture
+def cache(bot):
+    return bot.EmbedCache(max_entries=2)
+
+
+def embed(title):
+    return discord.Embed(title=title, description="ficha")
+
+
+def test_hit_returns_a_copy(cache):
+    cache.put("personaje", "Ana", cache.version("personaje", "Ana"), embed("Ana"), "hash", "url")
+    cached, image_hash, image_url = cache.get("personaje", "Ana")
+    assert (cached.title, image_hash, image_url) == ("Ana", "hash", "url")
+    cached.title = "cambiado"
+    assert cache.get("personaje", "Ana")[0].title == "Ana"
+
+
+def test_bump_invalidates_only_that_entity(cache):
+    for kind in ("personaje", "npc"):
+        cache.put(kind, "Ana", cache.version(kind, "Ana"), embed(kind))
+    cache.bump("personaje", "Ana")
+    assert cache.get("personaje", "Ana") is None
+    assert cache.get("npc", "Ana") is not None
+
+
+def test_bump_character_invalidates_sheet_and_inventory(cache):
+    for kind in ("personaje", "inventario"):
+        cache.put(kind, "Ana", cache.version(kind, "Ana"), embed(kind))
+    cache.bump_character("Ana")
+    assert cache.get("personaje", "Ana") is None
+    assert cache.get("inventario", "Ana") is None
+
+
+def test_embed_built_before_a_write_is_never_stored(cache):
+    version = cache.version("npc", "Goblin")
+    cache.bump("npc", "Goblin")  # otra orden escribe mientras se construía el embed
+    cache.put("npc", "Goblin", version, embed("viejo"))
+    assert cache.get("npc", "Goblin") is None
+
+
+def test_lru_eviction_and_stats(cache):
+    for name in ("A", "B", "C"):
+        cache.put("npc", name, 0, embed(name))
+    assert cache.get("npc", "A") is None
+    assert cache.get("npc", "C") is not None
+    stats = cache.stats()
+    assert (stats["entries"], stats["hits"], stats["misses"]) == (2, 1, 1)
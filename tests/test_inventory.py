@@ -0,0 +1,58 @@
+import asyncio
+
+import pytest
+
+
+@pytest.fixture
+def holder(bot, make_character):
+    return make_character("Portador")
+
+
+def toggle(bot, interaction, character_name, item_name):
+    select_class = type("EquipSelect", (bot.EquipItemSelect,), {"values": [item_name]})
+    select = select_class(character_name, [(item_name, False, "comun")])
+    asyncio.run(select.callback(interaction))
+
+
+def personaje_id(bot, nombre):
+    with bot.db.get_connection(readonly=True) as conn:
+        return conn.execute("SELECT id FROM personajes WHERE nombre = ?", (nombre,)).fetchone()[0]
+
+
+def test_materialized_bonuses_follow_give_equip_and_unequip(bot, holder, interaction):
+    asyncio.run(bot.give_item.callback(interaction, holder, "Espada de Acero", 2))
+    assert "entregado" in interaction.sent[-1]
+    assert bot.inventory_system.check_bonus_consistency() == {}
+
+    toggle(bot, interaction, holder, "Espada de Acero")
+    assert "equipado" in interaction.sent[-1]
+    assert bot.inventory_system.calculate_equipped_bonuses(holder)["fuerza"] == 3
+    assert bot.inventory_system.check_bonus_consistency() == {}
+
+    asyncio.run(bot.give_item.callback(interaction, holder, "Amuleto Mágico", 1))
+    toggle(bot, interaction, holder, "Amuleto Mágico")
+    assert bot.inventory_system.calculate_equipped_bonuses(holder)["mana"] == 3
+    assert bot.inventory_system.check_bonus_consistency() == {}
+
+    toggle(bot, interaction, holder, "Espada de Acero")
+    toggle(bot, interaction, holder, "Amuleto Mágico")
+    assert bot.inventory_system.calculate_equipped_bonuses(holder) == {attr: 0 for attr in
+                                                                      bot.InventorySystem.ATTRIBUTES}
+    assert bot.inventory_system.check_bonus_consistency() == {}
+
+
+def test_tampered_rows_are_reported_and_repaired(bot, holder, interaction):
+    asyncio.run(bot.give_item.callback(interaction, holder, "Armadura de Cuero", 1))
+    toggle(bot, interaction, holder, "Armadura de Cuero")
+    holder_id = personaje_id(bot, holder)
+    with bot.db.get_connection() as conn:
+        conn.execute("UPDATE bonos_equipados SET resistencia = 99 WHERE personaje_id = ?", (holder_id,))
+
+    drift = bot.inventory_system.check_bonus_consistency()
+    assert list(drift) == [holder_id]
+    assert drift[holder_id]["materializado"]["resistencia"] == 99
+    assert drift[holder_id]["esperado"]["resistencia"] == 2
+
+    bot.inventory_system.check_bonus_consistency(repair=True)
+    assert bot.inventory_system.check_bonus_consistency() == {}
+    toggle(bot, interaction, holder, "Armadura de Cuero")
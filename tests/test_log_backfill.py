@@ -0,0 +1,73 @@
+import json
+
+import pytest
+
+OLD_FORMAT = "2025-05-26 23:15:41,056 - INFO - [DADOS] Fëanor - Ataque distancia: D20(20) + Destreza(18) + Bonus(0) = 38\n"
+NEW_FORMAT = ("2025-06-16 16:15:09,050 - INFO - [DADOS] Yurany - ataque_fisico: 3d20([13, 17, 1]) "
+              "+ Fuerza(7) + Bonus(3) = 41\n")
+NPC_DAMAGE = "2025-06-16 16:24:15,431 - INFO - [NPC ATAQUE] Goblin Gordo - fisico: 15 daño\n"
+NPC_SYNCED = "2025-06-16 16:23:46,177 - INFO - [NPC ATAQUE] 5 Goblins sincronizados - fisico: 25 daño\n"
+NPC_PLAIN = "2025-06-16 16:30:00,000 - INFO - [NPC DEFENSA] Goblin Gordo - defensa_fisica: 12\n"
+UNPARSED = "2025-06-17 10:00:00,000 - INFO - [DADOS] Raro - ataque: formato desconocido\n"
+OTHER = "2025-06-17 10:00:01,000 - INFO - ✅ Bot conectado\n"
+
+
+def fields(row):
+    (origin, name, action, dice_count, dice_type, dice, attribute, attribute_value,
+     bonus, total, critical, fumble, session, created_at) = row
+    return {'origin': origin, 'name': name, 'action': action, 'dice_count': dice_count, 'dice_type': dice_type,
+            'dice': json.loads(dice) if dice else None, 'attribute': attribute,
+            'attribute_value': attribute_value, 'bonus': bonus, 'total': total,
+            'critical': critical, 'fumble': fumble}
+
+
+def test_old_format_single_die(bot):
+    row = fields(bot.LogBackfill.parse_line(OLD_FORMAT))
+    assert row == {'origin': 'personaje', 'name': 'Fëanor', 'action': 'ataque_distancia', 'dice_count': 1,
+                   'dice_type': 20, 'dice': [20], 'attribute': 'destreza', 'attribute_value': 18, 'bonus': 0,
+                   'total': 38, 'critical': True, 'fumble': False}
+
+
+def test_new_format_dice_pool(bot):
+    row = fields(bot.LogBackfill.parse_line(NEW_FORMAT))
+    assert row['dice'] == [13, 17, 1]
+    assert (row['dice_count'], row['dice_type'], row['bonus'], row['total']) == (3, 20, 3, 41)
+    assert (row['critical'], row['fumble']) == (False, True)
+
+
+@pytest.mark.parametrize("line, name, action, total", [
+    (NPC_DAMAGE, 'Goblin Gordo', 'fisico', 15),
+    (NPC_SYNCED, 'Goblin', 'fisico', 25),
+    (NPC_PLAIN, 'Goblin Gordo', 'defensa_fisica', 12),
+])
+def test_npc_lines(bot, line, name, action, total):
+    row = fields(bot.LogBackfill.parse_line(line))
+    assert (row['origin'], row['name'], row['action'], row['total']) == ('npc', name, action, total)
+
+
+@pytest.mark.parametrize("line", [UNPARSED, OTHER, ""])
+def test_non_roll_lines_are_ignored(bot, line):
+    assert bot.LogBackfill.parse_line(line) is None
+
+
+def test_import_resumes_and_reports_unparsed(bot, tmp_path):
+    log = tmp_path / "unity.log"
+    log.write_text(OLD_FORMAT + OTHER + NPC_DAMAGE + UNPARSED + NEW_FORMAT, encoding="utf-8")
+    backfill = bot.LogBackfill(batch_size=2)
+
+    report = backfill.run([str(log)])
+    assert (report['lineas'], report['tiradas'], report['sin_reconocer']) == (5, 3, 1)
+    assert report['ejemplos_sin_reconocer'] == [UNPARSED.rstrip('\n')]
+
+    # Una línea a medio escribir no se importa hasta que termina
+    with open(log, "a", encoding="utf-8") as f:
+        f.write(NPC_PLAIN.rstrip('\n'))
+    assert backfill.run([str(log)])['tiradas'] == 0
+    with open(log, "a", encoding="utf-8") as f:
+        f.write('\n')
+    assert backfill.run([str(log)])['tiradas'] == 1
+
+    with bot.db.get_connection(readonly=True) as conn:
+        count = conn.execute("SELECT COUNT(*) FROM tiradas WHERE nombre IN ('Fëanor', 'Yurany', 'Goblin Gordo')"
+                             ).fetchone()[0]
+    assert count == 4
@@ -0,0 +1,38 @@
+import pytest
+
+
+@pytest.fixture
+def index(bot):
+    index = bot.NameIndex()
+    for name in ("Fëanor", "Feanor", "Fenrir", "Rosaria", "Narrador឵", "Goblin Gordo", "Gólem"):
+        index.add("personajes", name)
+    return index
+
+
+def test_normalize_strips_accents_case_and_invisible_characters(bot):
+    assert bot.NameIndex.normalize("  Fëanor ") == "feanor"
+    assert bot.NameIndex.normalize("Narrador឵") == "narrador"
+    assert bot.NameIndex.normalize("Goblin   GORDO") == "goblin gordo"
+
+
+def test_prefix_matches_come_first_in_order(index):
+    assert index.search("personajes", "fe")[:3] == ["Feanor", "Fëanor", "Fenrir"]
+    assert index.search("personajes", "GO") == ["Goblin Gordo", "Gólem"]
+    assert index.search("personajes", "gól")[0] == "Gólem"
+
+
+def test_trigrams_find_names_that_do_not_start_with_the_query(index):
+    assert index.search("personajes", "gordo") == ["Goblin Gordo"]
+    assert "Rosaria" in index.search("personajes", "osari")
+
+
+def test_unrelated_queries_and_limit(index):
+    assert index.search("personajes", "zzzz") == []
+    assert len(index.search("personajes", "", limit=3)) == 3
+
+
+def test_remove_drops_prefix_and_trigram_entries(index):
+    index.remove("personajes", "Rosaria")
+    assert index.search("personajes", "ros") == []
+    assert index.search("personajes", "osari") == []
+    index.remove("personajes", "Rosaria")  # quitar dos veces no falla
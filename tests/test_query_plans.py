@@ -0,0 +1,3 @@
+def test_hot_queries_use_indexes(bot):
+    """Si una migración borra o cambia un índice, alguna consulta frecuente pasa a recorrer la tabla entera"""
+    assert bot.db.audit_query_plans() == {}
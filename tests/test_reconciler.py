@@ -0,0 +1,41 @@
+import os
+
+
+def write_workbook(bot, nombre, **stats):
+    path = f"{bot.config.EXCEL_DIR}/activos/{nombre}.xlsx"
+    values = {attr: 10 for attr in bot.StatsManager.ATTRIBUTES}
+    values.update(stats)
+    bot.ExcelManager.write_character_excel(path, nombre, "1", 0, values)
+    return path
+
+
+def test_reports_orphan_missing_workbook_and_mismatch(bot, make_character):
+    make_character("Conciliado", fuerza=10)
+    write_workbook(bot, "Conciliado", fuerza=14)
+    make_character("Sin Libro", fuerza=10)
+    orphan = write_workbook(bot, "Huérfano Viejo")
+
+    excel = bot.DataReconciler().run()['excel']
+
+    assert {'personaje': "Conciliado", 'campo': 'fuerza', 'excel': 14, 'sqlite': 10} in excel['desajustes']
+    assert "Sin Libro" in excel['faltantes']
+    assert "Conciliado" not in excel['faltantes']
+    assert orphan in excel['huerfanos']
+
+
+def test_second_pass_reuses_manifest_and_repair_fixes_excel(bot, make_character):
+    make_character("Reparable", fuerza=12)
+    write_workbook(bot, "Reparable", fuerza=8)
+    orphan = write_workbook(bot, "Huérfano Reparable")
+    bot.DataReconciler().run()
+
+    reconciler = bot.DataReconciler()
+    report = reconciler.run(repair=True)
+    assert reconciler.counters['analizados'] == 0 and reconciler.counters['reutilizados'] > 0
+    assert report['reparado']['excel_archivados'] >= 1
+
+    assert not os.path.exists(orphan)
+    assert os.path.exists(f"{bot.config.EXCEL_DIR}/archivados/Huérfano Reparable.xlsx")
+    excel = bot.DataReconciler().run()['excel']
+    assert not [entry for entry in excel['desajustes'] if entry['personaje'] == "Reparable"]
+    assert "Reparable" not in excel['faltantes']
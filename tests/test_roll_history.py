@@ -0,0 +1,58 @@
+import asyncio
+
+import pytest
+
+
+@pytest.fixture
+def history(bot):
+    return bot.RollHistory(batch_size=2, flush_interval=60, max_pending=5)
+
+
+def test_flush_writes_in_batches(bot, history):
+    for total in (11, 15, 19):
+        history.record('personaje', 'Historial A', 'ataque_fisico', total, session=99, dice_count=1, dice_type=20,
+                       dice=[total - 5], attribute='fuerza', attribute_value=5, critical=total == 25)
+    assert history.stats()['pending'] == 3
+
+    asyncio.run(history.flush())
+
+    stats = history.stats()
+    assert (stats['pending'], stats['written'], stats['batches']) == (0, 3, 2)
+    assert sorted(row[7] for row in bot.RollHistory.history('Historial A', 10)) == [11, 15, 19]
+
+
+def test_failed_flush_requeues_and_bounded_buffer_drops_oldest(bot, history, monkeypatch):
+    def broken(rows):
+        raise bot.sqlite3.OperationalError("database is locked")
+
+    monkeypatch.setattr(bot.RollHistory, "_write", staticmethod(broken))
+    for total in range(7):
+        history.record('npc', 'Historial Caído', 'fisico', total)
+    asyncio.run(history.flush())
+
+    stats = history.stats()
+    assert (stats['pending'], stats['dropped'], stats['errors'], stats['written']) == (5, 2, 1, 0)
+
+
+def test_history_is_newest_first_and_limited(bot, history):
+    for total, created_at in ((1, '2026-01-01 10:00:00'), (2, '2026-01-02 10:00:00'), (3, '2026-01-03 10:00:00')):
+        history.record('personaje', 'Historial B', 'defensa_fisica', total, created_at=created_at)
+    history.flush_sync()
+
+    assert [row[7] for row in bot.RollHistory.history('Historial B', 2)] == [3, 2]
+
+
+def test_action_stats_by_name_channel_and_window(bot, history):
+    history.record('personaje', 'Historial C', 'ataque_magico', 20, session=4242, dice_count=1, dice_type=20,
+                   dice=[20], critical=True)
+    history.record('personaje', 'Historial C', 'ataque_magico', 4, session=4242, dice_count=1, dice_type=20,
+                   dice=[1], fumble=True)
+    history.record('personaje', 'Historial C', 'ataque_magico', 30, created_at='2000-01-01 00:00:00')
+    history.flush_sync()
+
+    (accion, tiradas, media, minimo, maximo, criticos, pifias, con_dados), = \
+        bot.RollHistory.action_stats(name='Historial C', days=30)
+    assert (accion, tiradas, media, minimo, maximo, criticos, pifias, con_dados) == \
+        ('ataque_magico', 2, 12.0, 4, 20, 1, 1, 2)
+    assert bot.RollHistory.action_stats(channel_id=4242)[0][1] == 2
+    assert bot.RollHistory.action_stats(name='Historial C', days=100000)[0][1] == 3
@@ -0,0 +1,48 @@
+def make_scene(bot):
+    scene = bot.Scene("100")
+    for name, kind, initiative in (("Arien", 'personaje', 18), ("Goblin", 'npc', 12), ("Borin", 'personaje', 7)):
+        scene.add(bot.Combatant(name, kind, 10, 10, initiative, initiative))
+    return scene
+
+
+def test_advance_skips_downed_participants_and_wraps_round(bot):
+    scene = make_scene(bot)
+    assert [c.name for c in scene.order] == ["Arien", "Goblin", "Borin"]
+    scene.find("goblin").hp = 0
+
+    assert scene.advance().name == "Borin"
+    assert scene.advance().name == "Arien"
+    assert scene.round == 2
+
+
+def test_advance_returns_none_when_everyone_is_down(bot):
+    scene = make_scene(bot)
+    for combatant in scene.order:
+        combatant.hp = 0
+    assert scene.advance() is None
+    assert (scene.round, scene.turn) == (1, 0)
+
+
+def test_scene_survives_reload(bot):
+    manager = bot.EncounterManager(flush_interval=60, max_participants=10)
+    scene = manager.get_or_create(555)
+    for combatant in make_scene(bot).order:
+        scene.add(combatant)
+    scene.find("Goblin").hp = 4
+    scene.find("Goblin").conditions.append("aturdido")
+    scene.advance()
+    manager.touch(scene)
+    manager.flush_sync()
+
+    restored = bot.EncounterManager(flush_interval=60, max_participants=10)
+    restored.load()
+    loaded = restored.get(555)
+    assert [c.name for c in loaded.order] == ["Arien", "Goblin", "Borin"]
+    assert (loaded.round, loaded.turn, loaded.current.name) == (1, 1, "Goblin")
+    assert (loaded.current.hp, loaded.current.conditions) == (4, ["aturdido"])
+
+    restored.end(555)
+    restored.flush_sync()
+    again = bot.EncounterManager(flush_interval=60, max_participants=10)
+    again.load()
+    assert again.get(555) is None
@@ -0,0 +1,70 @@
+import asyncio
+
+import pytest
+
+
+@pytest.fixture
+def queue_factory(bot):
+    def make(backend, batch_size=2):
+        return bot.SheetsSyncQueue(backend, batch_size=batch_size, max_pending=10,
+                                   flush_interval=0, max_backoff=8)
+    return make
+
+
+@pytest.fixture
+def sleeps(bot, monkeypatch):
+    """Registra las esperas del backoff en vez de dormir"""
+    delays = []
+
+    async def fake_sleep(delay):
+        delays.append(delay)
+
+    monkeypatch.setattr(bot.asyncio, "sleep", fake_sleep)
+    return delays
+
+
+def test_repeated_marks_are_coalesced_into_batches(bot, make_character, queue_factory):
+    names = [make_character(nombre) for nombre in ("Sync A", "Sync B", "Sync C")]
+    backend = bot.FakeSheetsBackend()
+    sync = queue_factory(backend)
+
+    for nombre in ("Sync A", "Sync B", "Sync A", "Sync C", "Sync B"):
+        sync.mark_dirty(nombre)
+    assert sync.stats()["pending"] == 3
+    assert sync.counters["coalesced"] == 2
+
+    asyncio.run(sync.flush())
+
+    assert [len(batch) for batch in backend.batches] == [2, 1]
+    assert sorted(name for batch in backend.batches for name in batch) == names
+    assert set(backend.sheets) == {f"PJ_{name}" for name in names}
+    assert sync.stats()["pending"] == 0
+    assert sync.counters["synced"] == 3
+
+
+def test_quota_error_requeues_and_backs_off_exponentially(bot, make_character, queue_factory, sleeps):
+    make_character("Cuota A")
+    backend = bot.FakeSheetsBackend(quota_failures=2)
+    sync = queue_factory(backend)
+    sync.mark_dirty("Cuota A")
+
+    asyncio.run(sync.flush())
+
+    assert sync.counters["quota_errors"] == 2
+    assert len(sleeps) == 2
+    assert 1.0 <= sleeps[0] <= 1.25  # primer backoff de 1s con hasta un 25% de jitter
+    assert 2.0 <= sleeps[1] <= 2.5
+    assert backend.batches == [["Cuota A"]]  # el lote reencolado acaba escribiéndose
+    assert sync.backoff == 0.0
+
+
+def test_backoff_is_capped(bot, make_character, queue_factory, sleeps):
+    make_character("Cuota B")
+    backend = bot.FakeSheetsBackend(quota_failures=6)
+    sync = queue_factory(backend)
+    sync.mark_dirty("Cuota B")
+
+    asyncio.run(sync.flush())
+
+    assert max(sleeps) <= 8 * 1.25
+    assert backend.batches == [["Cuota B"]]
@@ -0,0 +1,23 @@
+import pytest
+
+
+@pytest.mark.parametrize("text, expected", [("d20", (1, 20)), ("2d6", (2, 6)), (" 3D8 ", (3, 8))])
+def test_parse_dice(bot, text, expected):
+    assert bot.DiceSystem.parse_dice(text) == expected
+
+
+@pytest.mark.parametrize("text", ["20", "2d7", "0d6", "xd6", "2d", "100d20"])
+def test_parse_dice_rejects_what_simular_rejects(bot, text):
+    with pytest.raises(ValueError):
+        bot.DiceSystem.parse_dice(text)
+
+
+@pytest.mark.parametrize("dados", ["20", "2d7"])
+def test_cli_rejects_invalid_dice_as_usage_error(bot, dados):
+    with pytest.raises(SystemExit) as excinfo:
+        bot.cli_simulate(["--dados", dados])
+    assert excinfo.value.code == 2
+
+
+def test_cli_reports_empty_roster(bot):
+    assert bot.cli_simulate(["--npc", "No existe", "--combates", "10"]) == 3
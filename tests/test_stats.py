@@ -0,0 +1,45 @@
+import asyncio
+
+
+def character_row(bot, nombre):
+    with bot.db.get_connection(readonly=True) as conn:
+        return conn.execute("""SELECT p.oro, s.fuerza FROM personajes p
+                            LEFT JOIN estadisticas_personajes s ON s.personaje_id = p.id
+                            WHERE p.nombre = ?""", (nombre,)).fetchone()
+
+
+def test_edit_applies_stats_and_gold_together(bot, make_character, interaction):
+    make_character("Editable", fuerza=10)
+
+    asyncio.run(bot.edit_character.callback(interaction, "Editable", fuerza=15, oro=7))
+
+    assert "actualizado exitosamente" in interaction.sent[-1]
+    assert character_row(bot, "Editable") == (7, 15)
+
+
+def test_edit_without_stats_row_changes_nothing(bot, interaction):
+    with bot.db.get_connection() as conn:
+        conn.execute("INSERT INTO personajes (nombre, usuario_id, excel_path, oro) VALUES ('Sin Stats', '1', 'x', 5)")
+
+    asyncio.run(bot.edit_character.callback(interaction, "Sin Stats", fuerza=15, oro=9))
+
+    assert interaction.sent[-1].startswith("❌")
+    assert character_row(bot, "Sin Stats") == (5, None)  # el oro tampoco se aplicó
+
+
+def test_migration_leaves_unreadable_workbooks_pending(bot, tmp_path):
+    workbook = tmp_path / "Legible.xlsx"
+    bot.ExcelManager.write_character_excel(str(workbook), "Legible", "1", 0,
+                                           {attr: 14 for attr in bot.StatsManager.ATTRIBUTES})
+    with bot.db.get_connection() as conn:
+        conn.executemany("INSERT INTO personajes (nombre, usuario_id, excel_path) VALUES (?, '1', ?)",
+                         [("Legible", str(workbook)), ("Ilegible", str(tmp_path / "no_existe.xlsx"))])
+
+    assert bot.stats_manager.migrate_from_excel() == 1
+
+    assert character_row(bot, "Legible")[1] == 14
+    assert character_row(bot, "Ilegible")[1] is None  # sin stats inventadas: sigue pendiente
+    bot.ExcelManager.write_character_excel(str(tmp_path / "no_existe.xlsx"), "Ilegible", "1", 0,
+                                           {attr: 12 for attr in bot.StatsManager.ATTRIBUTES})
+    assert bot.stats_manager.migrate_from_excel() == 1
+    assert character_row(bot, "Ilegible")[1] == 12